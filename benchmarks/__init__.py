@@ -0,0 +1,6 @@
+"""Reproducible benchmarks of the hardness pipeline on synthetic surveys.
+
+Run from the directory that contains the plugin folder, for example:
+
+    python -m hardness_calculator.benchmarks.run --sizes 1e4 1e5 1e6 --output bench.json
+"""
@@ -0,0 +1,121 @@
+import numpy as np
+from ..engine import INPUT_KEYS
+
+# Rows converted to Python values at a time while features are served
+FEATURE_BLOCK_SIZE = 65536
+
+
+class MemoryFields:
+    """Field list with the indexOf()/count() subset of QgsFields used by the pipeline"""
+
+    def __init__(self, names):
+        self.names = list(names)
+
+    def indexOf(self, name):
+        return self.names.index(name) if name in self.names else -1
+
+    def count(self):
+        return len(self.names)
+
+    def append(self, name):
+        self.names.append(name)
+
+
+class MemoryFeatureRequest:
+    """Feature request with the setFlags()/setSubsetOfAttributes() subset of QgsFeatureRequest"""
+    NoGeometry = 1
+
+    def __init__(self):
+        self.flags = 0
+        self.attributes = None
+
+    def setFlags(self, flags):
+        self.flags = flags
+        return self
+
+    def setSubsetOfAttributes(self, attributes):
+        self.attributes = list(attributes)
+        return self
+
+
+class MemoryFeature:
+    """Feature with the id()/attributes() subset of QgsFeature; NULL values are None"""
+    __slots__ = ("_id", "_attributes")
+
+    def __init__(self, feature_id, attributes):
+        self._id = feature_id
+        self._attributes = attributes
+
+    def id(self):
+        return self._id
+
+    def attributes(self):
+        return self._attributes
+
+
+class MemoryProvider:
+    """Data provider stand-in that keeps written attribute values in arrays.
+
+    changeAttributeValues() applies the change map value by value, as a
+    provider does, so the cost of building and sending batches is measured.
+    """
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.values = {}
+
+    def addAttributes(self, names):
+        for name in names:
+            self.layer.fields().append(name)
+            self.values[self.layer.fields().indexOf(name)] = np.full(self.layer.featureCount(), None, dtype=object)
+        return True
+
+    def changeAttributeValues(self, changes):
+        for feature_id, attributes in changes.items():
+            for index, value in attributes.items():
+                self.values[index][feature_id] = value
+        return True
+
+
+class MemoryLayer:
+    """In-memory stand-in for a point QgsVectorLayer over SurveyColumns.
+
+    Features are served on the fly from the columns with NaN as NULL, so a
+    ten million row layer needs no per-feature objects until it is read.
+    Feature ids are the row numbers. Requests are MemoryFeatureRequest; the
+    features carry the four input attributes whatever the request, as a
+    provider is free to return more attributes than the requested subset.
+    """
+
+    def __init__(self, columns, name="synthetic"):
+        self.columns = columns
+        self._name = name
+        self._fields = MemoryFields(INPUT_KEYS)
+        self._provider = MemoryProvider(self)
+
+    def name(self):
+        return self._name
+
+    def source(self):
+        return f"memory:{self._name}"
+
+    def fields(self):
+        return self._fields
+
+    def featureCount(self):
+        return len(self.columns)
+
+    def dataProvider(self):
+        return self._provider
+
+    def isModified(self):
+        return False
+
+    def getFeatures(self, request=None):
+        columns = self.columns
+        inputs = (columns.e1, columns.e2, columns.peak_sv, columns.depth)
+        for start in range(0, len(columns), FEATURE_BLOCK_SIZE):
+            stop = start + FEATURE_BLOCK_SIZE
+            rows = np.column_stack([column[start:stop] for column in inputs]).tolist()
+            for feature_id, values in zip(columns.fids[start:stop].tolist(), rows):
+                yield MemoryFeature(feature_id, [None if value != value else value for value in values])
@@ -0,0 +1,251 @@
+"""Benchmark the hardness pipeline on synthetic surveys and save the results as JSON.
+
+Every size is run in Manual and Optimized mode with the standard and the
+linearized E1/E2 term, once in memory and once streamed in chunks as in
+streaming mode. Each phase (extract, filter, correlation, fit, evaluate,
+write) is measured on an in-memory layer stand-in with the same
+Instrumentation as a processing run, and its peak traced memory is
+measured in a separate pass so that tracing does not distort the timings.
+Features are read through the plugin's extraction functions, with
+MemoryFeatureRequest in place of QgsFeatureRequest, so no QGIS is needed.
+
+    python -m hardness_calculator.benchmarks.run --sizes 1e4 1e5 1e6 1e7 --output bench.json
+    python -m hardness_calculator.benchmarks.run --sizes 1e6 --output new.json --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import scipy
+from ..engine import (INPUT_KEYS, MODE_MANUAL, MODE_OPTIMIZED, HardnessParameters, Moments, evaluate_hardness,
+                      fit_from_moments, fit_rows, percentile_bounds, percentile_estimator, run_engine, within_bounds)
+from ..extraction import extract_columns, iter_column_chunks
+from ..instrumentation import PHASES, Instrumentation
+from ..processing_log import ProcessingLog
+from ..writer import BatchWriter
+from .memory_layer import MemoryFeatureRequest, MemoryLayer
+from .synthetic import synthetic_survey
+
+# Phases faster than this in the baseline are too noisy to flag as regressions
+MIN_COMPARED_SECONDS = 0.005
+
+
+class TracedInstrumentation(Instrumentation):
+    """Instrumentation that also records the peak traced memory above the start of each phase"""
+
+    def __init__(self):
+        super().__init__()
+        self.peak_bytes = {}
+
+    @contextmanager
+    def phase(self, name, rows=0):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        with super().phase(name, rows) as stats:
+            yield stats
+        self.peak_bytes[name] = max(self.peak_bytes.get(name, 0), tracemalloc.get_traced_memory()[1] - base)
+
+
+def new_writer(layer, params):
+    fields = layer.fields()
+    return BatchWriter(layer.dataProvider(), fields.indexOf("Hardness"), fields.indexOf("Confidence"),
+                       params.write_batch_size)
+
+
+def run_pipeline(layer, params, instrumentation):
+    """Run the phases of one calculation on a MemoryLayer; returns the coefficients"""
+    log = ProcessingLog(None, instrumentation=instrumentation)
+    with log.timed("extract") as phase:
+        columns = extract_columns(layer, layer.fields(), params.field_names, layer.featureCount(),
+                                  request_type=MemoryFeatureRequest)
+        phase.rows += len(columns)
+
+    result = run_engine(columns, params, log)
+    with log.timed("write", len(columns)):
+        new_writer(layer, params).write(result.fids, result.hardness, result.confidence)
+    return result.coefficients
+
+
+def run_streaming_pipeline(layer, params, instrumentation):
+    """Run the chunked passes of a streaming calculation on a MemoryLayer; returns the coefficients.
+
+    Mirrors HardnessTask.process_streaming: a percentile pass and a moments
+    pass in Optimized mode, then one pass that evaluates and writes chunk
+    by chunk.
+    """
+    log = ProcessingLog(None, instrumentation=instrumentation)
+
+    def chunks():
+        return log.timed_chunks("extract", iter_column_chunks(
+            layer, layer.fields(), params.field_names, params.chunk_size, layer.featureCount(),
+            request_type=MemoryFeatureRequest))
+
+    if params.mode == MODE_MANUAL:
+        coefficients = (params.k1, params.k2, params.k3)
+    else:
+        estimator = percentile_estimator(params)
+        for chunk in chunks():
+            with log.timed("filter", len(chunk)):
+                estimator.update(fit_rows(chunk, params.linearize))
+        low, high = percentile_bounds(estimator, params)
+        moments = Moments()
+        for chunk in chunks():
+            with log.timed("correlation", len(chunk)):
+                values = fit_rows(chunk, params.linearize)
+                moments.update(values[within_bounds(values, low, high)])
+        with log.timed("fit", moments.n):
+            coefficients = fit_from_moments(moments, params.bounds, log).coefficients
+
+    writer = new_writer(layer, params)
+    for chunk in chunks():
+        with log.timed("evaluate", len(chunk)):
+            hardness, confidence = evaluate_hardness(chunk, *coefficients, params.linearize)
+        with log.timed("write", len(chunk)):
+            writer.write(chunk.fids, hardness, confidence)
+    return coefficients
+
+
+def benchmark_case(layer, params, repeat, trace_memory):
+    """Median phase wall and CPU times over repeat runs, plus the peak traced memory of an extra run"""
+    pipeline = run_streaming_pipeline if params.streaming else run_pipeline
+    runs = []
+    for _ in range(repeat):
+        instrumentation = Instrumentation()
+        coefficients = pipeline(layer, params, instrumentation)
+        runs.append(instrumentation.phases)
+
+    peak_bytes = {}
+    if trace_memory:
+        instrumentation = TracedInstrumentation()
+        tracemalloc.start()
+        try:
+            pipeline(layer, params, instrumentation)
+        finally:
+            tracemalloc.stop()
+        peak_bytes = instrumentation.peak_bytes
+
+    phases = {}
+    for name in PHASES:
+        if name in runs[0]:
+            seconds = float(np.median([run[name].wall for run in runs]))
+            phases[name] = {
+                "seconds": seconds,
+                "cpu_seconds": float(np.median([run[name].cpu for run in runs])),
+                "rows_per_second": runs[0][name].rows / seconds if runs[0][name].rows and seconds > 0 else None,
+                "peak_rss_bytes": max(run[name].peak_rss or 0 for run in runs) or None,
+            }
+            if name in peak_bytes:
+                phases[name]["peak_bytes"] = int(peak_bytes[name])
+    return {
+        "rows": layer.featureCount(),
+        "mode": params.mode,
+        "linearize": params.linearize,
+        "streaming": params.streaming,
+        "coefficients": [float(k) for k in coefficients],
+        "total_seconds": sum(phase["seconds"] for phase in phases.values()),
+        "phases": phases,
+    }
+
+
+def environment():
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def case_key(case):
+    return case["rows"], case["mode"], case["linearize"], case.get("streaming", False)
+
+
+def compare(results, baseline, tolerance):
+    """Print phase time ratios against a baseline result file; returns the number of regressions"""
+    reference = {case_key(case): case for case in baseline["cases"]}
+    regressions = 0
+    for case in results["cases"]:
+        old = reference.get(case_key(case))
+        if old is None:
+            continue
+        for name, phase in case["phases"].items():
+            old_seconds = old["phases"].get(name, {}).get("seconds")
+            if not old_seconds:
+                continue
+            ratio = phase["seconds"] / old_seconds
+            flag = ""
+            if ratio > 1 + tolerance and old_seconds >= MIN_COMPARED_SECONDS:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{case['rows']:>10} {case['mode']:<9} {'lin' if case['linearize'] else 'std':<3} "
+                  f"{'stream' if case.get('streaming') else 'memory':<6} {name:<11} "
+                  f"{old_seconds:9.4f} s -> {phase['seconds']:9.4f} s  x{ratio:5.2f}{flag}")
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the hardness pipeline on synthetic surveys.")
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1e4, 1e5, 1e6], help="rows per survey (default: 1e4 1e5 1e6)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case; the median is reported (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument("--percentile-sketch", action="store_true", help="quantile sketch instead of exact percentiles")
+    parser.add_argument("--write-batch-size", type=int, default=50000)
+    parser.add_argument("--chunk-size", type=int, default=100000, help="features per chunk of the streaming cases (default: 100000)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced run that measures peak memory")
+    parser.add_argument("--output", default="bench.json", help="result file (default: bench.json)")
+    parser.add_argument("--baseline", default=None, help="earlier result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="slowdown reported as a regression (default: 0.2 = 20%%)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    results = {"environment": environment(), "cases": []}
+    for size in args.sizes:
+        layer = MemoryLayer(synthetic_survey(int(size), args.seed), f"synthetic_{int(size)}")
+        layer.dataProvider().addAttributes(["Hardness", "Confidence"])
+        for streaming in (False, True):
+            for mode in (MODE_MANUAL, MODE_OPTIMIZED):
+                for linearize in (False, True):
+                    params = HardnessParameters(
+                        field_names={key: key for key in INPUT_KEYS},
+                        mode=mode,
+                        linearize=linearize,
+                        k2=0.03 if linearize else 0.5,
+                        exact_quantiles=not args.percentile_sketch,
+                        write_batch_size=args.write_batch_size,
+                        streaming=streaming,
+                        chunk_size=args.chunk_size,
+                    )
+                    case = benchmark_case(layer, params, args.repeat, not args.no_memory)
+                    results["cases"].append(case)
+                    phases = ", ".join(
+                        f"{name} {phase['seconds']:.3f} s" + (f" / {phase['peak_bytes'] / 2 ** 20:.0f} MiB" if "peak_bytes" in phase else "")
+                        for name, phase in case["phases"].items())
+                    print(f"{case['rows']:>10} {mode:<9} {'linearized' if linearize else 'standard':<10} "
+                          f"{'streaming' if streaming else 'in memory':<9} {case['total_seconds']:8.3f} s  ({phases})")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{regressions} phase(s) slower than the baseline by more than {args.tolerance * 100:g}%")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+import numpy as np
+from ..engine import SurveyColumns
+
+# Coefficients of the depth model behind the synthetic E1, E1/E2 and PeakSV columns
+TRUE_COEFFICIENTS = (0.8, 0.3, 0.35)
+
+# Fixed seed, so every run benchmarks the same data
+SYNTHETIC_SEED = 0
+
+
+def synthetic_survey(n, seed=SYNTHETIC_SEED, null_fraction=0.02, nonpositive_e2_fraction=0.05, outlier_fraction=0.01):
+    """SurveyColumns of n synthetic echosounder pings along parallel survey lines.
+
+    E1, E2 and PeakSV are positive and log-normally spread; Depth follows
+    the hardness model with TRUE_COEFFICIENTS plus noise. A null_fraction
+    of each column is NULL (NaN), a nonpositive_e2_fraction of E2 is zero or
+    negative (simplified formula, Low confidence) and an outlier_fraction of
+    rows has E1 or Depth off by one to two orders of magnitude, so all the
+    validity rules and the outlier filter are exercised.
+    """
+    rng = np.random.default_rng(seed)
+    e1 = rng.lognormal(1.5, 0.4, n)
+    e2 = e1 * rng.uniform(0.2, 0.9, n)
+    peak_sv = rng.lognormal(0.8, 0.3, n)
+    k1, k2, k3 = TRUE_COEFFICIENTS
+    depth = k1 * e1 + k2 * e1 / e2 + k3 * peak_sv + rng.normal(0, 0.2, n)
+
+    # Pings along east-west lines 10 units apart, 1 unit between pings
+    line_length = max(1, int(np.sqrt(n * 10)))
+    index = np.arange(n)
+    x = (index % line_length).astype(float) + rng.normal(0, 0.1, n)
+    y = (index // line_length) * 10.0 + rng.normal(0, 0.5, n)
+
+    nonpositive = rng.random(n) < nonpositive_e2_fraction
+    e2[nonpositive] = -rng.uniform(0, 1, np.count_nonzero(nonpositive)).round()
+    outliers = np.flatnonzero(rng.random(n) < outlier_fraction)
+    half = len(outliers) // 2
+    e1[outliers[:half]] *= rng.uniform(10, 100, half)
+    depth[outliers[half:]] *= rng.uniform(10, 100, len(outliers) - half)
+    for column in (e1, e2, peak_sv, depth):
+        column[rng.random(n) < null_fraction] = np.nan
+
+    return SurveyColumns(np.arange(n, dtype=np.int64), e1, e2, peak_sv, depth, x, y)
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import re
+import time
+from urllib.parse import unquote, urlparse
+
+from .engine import RegressionFit
+
+# Bump when the cached entry layout or the fitting method changes
+CACHE_VERSION = 1
+
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 512
+
+
+def source_path(source):
+    """File path part of a layer source string ("path|layername=..." -> "path").
+
+    Delimited-text layers have a file URI as source
+    ("file:///path/survey.csv?delimiter=,&xField=X"); its decoded path is
+    returned, without the leading slash before a Windows drive letter.
+    """
+    if source.startswith("file:"):
+        path = unquote(urlparse(source).path)
+        return path[1:] if re.match(r"/[A-Za-z]:", path) else path
+    return source.split("|")[0]
+
+
+def output_stem(source):
+    """Path stem of the files written next to a layer source, unique per layer of a multi-layer file.
+
+    "x.gpkg|layername=a" -> "x_a", so the layers of one GeoPackage do not
+    share their logs, state or grids; characters unsafe in file names are
+    replaced with "_".
+    """
+    stem = os.path.splitext(source_path(source))[0]
+    if not source.startswith("file:"):
+        for part in source.split("|")[1:]:
+            if part.startswith("layername="):
+                stem += "_" + re.sub(r"[^\w.-]", "_", part[len("layername="):])
+    return stem
+
+
+def change_stamp(source):
+    """Modification stamp of the files behind a file-based source, or None if it has none.
+
+    For shapefiles the .dbf holding the attributes is included as well.
+    """
+    path = source_path(source)
+    paths = [path]
+    if path.lower().endswith(".shp"):
+        paths.append(path[:-4] + ".dbf")
+    stamps = []
+    for candidate in paths:
+        if not os.path.isfile(candidate):
+            return None
+        stat = os.stat(candidate)
+        stamps.append(f"{stat.st_mtime_ns}:{stat.st_size}")
+    return ";".join(stamps)
+
+
+def fit_cache_key(source, feature_count, stamp, params):
+    """Cache key of a fit: layer source, content fingerprint and every setting that affects the fit"""
+    settings = {
+        "version": CACHE_VERSION,
+        "source": source,
+        "feature_count": feature_count,
+        "stamp": stamp,
+        "fields": params.field_names,
+        "linearize": params.linearize,
+        "k_bounds": params.k_bounds,
+        "lower": params.lower_percentile,
+        "upper": params.upper_percentile,
+        "exact_quantiles": params.exact_quantiles,
+        "quantile_error": None if params.exact_quantiles else params.quantile_error,
+        # Sketch estimates depend on how the rows were batched
+        "chunk_size": params.chunk_size if params.streaming else None,
+        "validation": [params.bootstrap_samples, params.folds, params.interval_level] if params.validation else None,
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class FitCache:
+    """Disk-backed, size-bounded LRU cache of RegressionFit results.
+
+    Each entry is a small JSON file named after its key; the file
+    modification time records the last use, and the least recently used
+    entries are removed once the cache exceeds max_bytes or max_entries.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, max_entries=DEFAULT_MAX_ENTRIES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Cached RegressionFit for key, or None"""
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)
+            return RegressionFit.from_dict(entry["fit"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def put(self, key, fit):
+        """Store a RegressionFit under key and evict old entries"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump({"created": time.time(), "fit": fit.to_dict()}, f)
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits its bounds"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        while entries and (total > self.max_bytes or len(entries) > self.max_entries):
+            _, size, name = entries.pop(0)
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
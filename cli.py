@@ -0,0 +1,295 @@
+"""Batch hardness calculation outside QGIS.
+
+Run from the directory that contains the plugin folder, for example:
+
+    python -m hardness_calculator.cli --mode optimized --workers 16 surveys/*.gpkg
+
+Each survey is processed by one worker process. Results are written as
+<survey>_hardness.csv (fid, Hardness, Confidence) with a processing log
+and a JSON phase timing file (<survey>_hardness_timing.json) next to it.
+With --sweep, each survey is instead fitted with every listed
+configuration and the comparison is written to <survey>_sweep.csv; no
+hardness is calculated. With --grid, the hardness is also binned onto a
+raster saved as <survey>_hardness_grid.tif.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from .cache import FitCache, change_stamp, fit_cache_key
+from .engine import (
+    INPUT_KEYS, MODE_MANUAL, MODE_OPTIMIZED, MODE_REGIONAL, HardnessParameters, percentile_estimator, run_engine,
+)
+from .instrumentation import Instrumentation
+from .processing_log import LEVEL_NAMES, PHASE, ProcessingLog
+from .raster import HardnessGrid, RasterGrid, write_geotiff
+from .readers import read_crs_wkt, read_survey
+from .sweep import best_result, comparison_table, log_sweep, parse_bounds, parse_percentile_pairs, run_sweep, sweep_configs
+from .validation import log_validation
+from .writer import confidence_values
+
+
+def output_path(path, output_dir, suffix):
+    """<survey><suffix> in output_dir, or next to the survey file"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    directory = output_dir or os.path.dirname(os.path.abspath(path))
+    return os.path.join(directory, f"{stem}{suffix}")
+
+
+def output_paths(path, output_dir):
+    """(result CSV, processing log) paths for a survey file"""
+    return output_path(path, output_dir, "_hardness.csv"), output_path(path, output_dir, "_hardness_processing.txt")
+
+
+def process_survey(path, params, output_dir=None, log_level=PHASE, cache_dir=None, coordinate_fields=("X", "Y")):
+    """Read, fit, evaluate and save one survey; returns a summary dict (runs in a worker)"""
+    start = time.perf_counter()
+    cache = FitCache(cache_dir) if cache_dir and params.mode == MODE_OPTIMIZED else None
+    csv_path, log_path = output_paths(path, output_dir)
+    instrumentation = Instrumentation(params.profile)
+    with ProcessingLog(log_path, log_level, instrumentation=instrumentation) as log:
+        log.summary(f"Processing survey: {path}")
+        log.summary(f"Mode: {params.mode}, linearization: {'Enabled' if params.linearize else 'Disabled'}")
+        if params.mode != MODE_MANUAL:
+            log.summary(f"Percentiles: {params.lower_percentile*100}% - {params.upper_percentile*100}%, "
+                        f"{percentile_estimator(params).describe()}")
+        with log.timed("extract") as phase:
+            with_coordinates = params.mode == MODE_REGIONAL or params.grid
+            columns = read_survey(path, params.field_names, coordinate_fields if with_coordinates else None)
+            phase.rows += len(columns)
+        log.summary(f"Total features: {len(columns)}")
+
+        key = None
+        cached_fit = None
+        stamp = change_stamp(path) if cache is not None else None
+        if stamp is not None:
+            key = fit_cache_key(os.path.abspath(path), len(columns), stamp, params)
+            cached_fit = cache.get(key)
+            log.summary(f"Fit cache: {'hit' if cached_fit is not None else 'miss'} (key {key[:12]})")
+
+        result = run_engine(columns, params, log, cached_fit)
+        if key is not None and cached_fit is None:
+            cache.put(key, result.fit)
+        k1, k2, k3 = result.coefficients
+        log.summary(f"k1: {k1:.4f}, k2: {k2:.4f}, k3: {k3:.4f}")
+        if result.fit is not None and result.fit.validation is not None:
+            log_validation(log, result.fit)
+        for reason, n in result.diagnostics.items():
+            log.count(reason, n)
+        log.write_counts("Row diagnostics:")
+
+        with log.timed("write", len(columns)):
+            pd.DataFrame({
+                "fid": result.fids,
+                "Hardness": result.hardness,
+                "Confidence": confidence_values(result.confidence, params.coded_confidence),
+            }).to_csv(csv_path, index=False)
+        log.summary(f"Results written to {csv_path}")
+        if params.grid:
+            write_grid(log, path, output_dir, params, columns, result.hardness)
+
+        instrumentation.log_summary(log)
+        instrumentation.save_json(output_path(path, output_dir, "_hardness_timing.json"), survey=path,
+                                  mode=params.mode, linearize=params.linearize, features=len(columns))
+        if instrumentation.profiler is not None:
+            instrumentation.save_profile(output_path(path, output_dir, "_hardness_profile.prof"))
+
+    return {
+        "survey": path,
+        "features": len(columns),
+        "coefficients": result.coefficients,
+        "seconds": time.perf_counter() - start,
+        "cached": cached_fit is not None,
+        "validation": result.fit.validation if result.fit is not None else None,
+    }
+
+
+def write_grid(log, path, output_dir, params, columns, hardness):
+    """Bin the hardness of a survey onto a raster and save it as <survey>_hardness_grid.tif"""
+    grid_path = output_path(path, output_dir, "_hardness_grid.tif")
+    try:
+        with log.timed("grid", len(columns)):
+            grid = HardnessGrid(RasterGrid.covering_points(columns.x, columns.y, params.grid_cell_size), params.grid_median)
+            grid.update(columns.x, columns.y, hardness)
+            write_geotiff(grid_path, grid.grid, grid.bands(params), read_crs_wkt(path))
+    except (ImportError, OSError, RuntimeError, ValueError) as e:
+        log.summary(f"Warning: the hardness grid could not be written: {e}")
+        return
+    log.summary(f"Hardness grid: {grid.describe()}")
+    log.summary(f"Grid written to {grid_path}")
+
+
+def sweep_survey(path, params, configs, output_dir=None, log_level=PHASE):
+    """Fit every sweep configuration on one survey and save the comparison table (runs in a worker)"""
+    start = time.perf_counter()
+    csv_path = output_path(path, output_dir, "_sweep.csv")
+    with ProcessingLog(output_path(path, output_dir, "_hardness_sweep.txt"), log_level) as log:
+        log.summary(f"Parameter sweep on survey: {path}")
+        columns = read_survey(path, params.field_names)
+        log.summary(f"Total features: {len(columns)}")
+        results = run_sweep(columns, configs, params.workers)
+        log_sweep(log, results)
+        comparison_table(results).to_csv(csv_path)
+        log.summary(f"Comparison written to {csv_path}")
+
+    best = best_result(results)
+    return {
+        "survey": path,
+        "features": len(columns),
+        "best": best,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def level_option(name):
+    """Command-line spelling of a log level name ("Per-feature debug" -> "per-feature-debug")"""
+    return name.lower().replace(" ", "-")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Compute sonar hardness for many survey files in parallel.")
+    parser.add_argument("surveys", nargs="+", help="CSV, GeoPackage or shapefile surveys")
+    for key in INPUT_KEYS:
+        parser.add_argument(f"--{key.lower()}", default=key, help=f"{key} field name (default: {key})")
+    parser.add_argument("--x", default="X", help="x coordinate column of CSV surveys in regional mode or with --grid (default: X)")
+    parser.add_argument("--y", default="Y", help="y coordinate column of CSV surveys in regional mode or with --grid (default: Y)")
+    parser.add_argument("--mode", choices=[MODE_MANUAL, MODE_OPTIMIZED, MODE_REGIONAL], default=MODE_MANUAL)
+    parser.add_argument("--linearize", action="store_true", help="use 10^((E1-E2)/10) instead of E1/E2")
+    parser.add_argument("--k1", type=float, default=0.7)
+    parser.add_argument("--k2", type=float, default=None, help="default: 0.5, or 0.03 with --linearize")
+    parser.add_argument("--k3", type=float, default=0.3)
+    parser.add_argument("--lower", type=float, default=5.0, help="lower outlier percentile (%%)")
+    parser.add_argument("--upper", type=float, default=95.0, help="upper outlier percentile (%%)")
+    parser.add_argument("--percentile-sketch", action="store_true",
+                        help="approximate the outlier percentiles with a quantile sketch in constant memory instead of exact quantiles")
+    parser.add_argument("--quantile-error", type=float, default=0.1, help="sketch rank error with --percentile-sketch (%%)")
+    parser.add_argument("--tile-size", type=float, default=0.0, help="regional tile size in survey units (default: automatic)")
+    parser.add_argument("--min-tile-samples", type=int, default=200, help="regional: samples a tile needs for its own fit")
+    parser.add_argument("--borrow-rings", type=int, default=2, help="regional: neighbour rings a sparse tile may borrow from")
+    parser.add_argument("--bootstrap", type=int, default=0, metavar="N",
+                        help="N bootstrap resamples for confidence intervals and cross-validated R2 (--mode optimized only)")
+    parser.add_argument("--folds", type=int, default=5, help="cross-validation folds with --bootstrap")
+    parser.add_argument("--interval-level", type=float, default=95.0, help="bootstrap interval level (%%)")
+    parser.add_argument("--max-relative-interval", type=float, default=0.0,
+                        help="set Confidence to Low where the hardness interval exceeds this %% of hardness")
+    parser.add_argument("--coded-confidence", action="store_true", help="write Confidence as 1 = High, 0 = Low")
+    parser.add_argument("--sweep", default=None, metavar="PAIRS",
+                        help='compare fits for these percentile pairs, e.g. "5-95,1-99", instead of calculating hardness')
+    parser.add_argument("--sweep-formulations", action="store_true", help="sweep both standard and linearized E1/E2")
+    parser.add_argument("--sweep-bounds", default="", metavar="BOUNDS",
+                        help='additional k bounds to sweep, "k1min k1max k2min k2max k3min k3max; ..."')
+    parser.add_argument("--grid", type=float, default=None, metavar="CELL",
+                        help="also write a hardness raster <survey>_hardness_grid.tif with this cell size in survey units (0 = automatic)")
+    parser.add_argument("--grid-median", action="store_true", help="add a per-cell median band to the grid")
+    parser.add_argument("--grid-idw", action="store_true", help="add an inverse distance weighted band to the grid")
+    parser.add_argument("--idw-neighbors", type=int, default=8, help="IDW: neighbouring cells used per cell (default: 8)")
+    parser.add_argument("--idw-power", type=float, default=2.0, help="IDW: distance power (default: 2)")
+    parser.add_argument("--idw-radius", type=float, default=0.0, help="IDW: search radius in survey units (default: 5 cells)")
+    parser.add_argument("--profile", action="store_true", help="save a cProfile dump <survey>_hardness_profile.prof")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: all cores)")
+    parser.add_argument("--output-dir", default=None, help="directory for results (default: next to each survey)")
+    parser.add_argument("--cache-dir", default=None, help="reuse fitted coefficients stored in this directory")
+    parser.add_argument("--log-level", choices=[level_option(name) for name in LEVEL_NAMES.values()], default="per-phase")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    params = HardnessParameters(
+        field_names={key: getattr(args, key.lower()) for key in INPUT_KEYS},
+        mode=args.mode,
+        linearize=args.linearize,
+        k1=args.k1,
+        k2=args.k2 if args.k2 is not None else (0.03 if args.linearize else 0.5),
+        k3=args.k3,
+        lower_percentile=args.lower / 100,
+        upper_percentile=args.upper / 100,
+        exact_quantiles=not args.percentile_sketch,
+        quantile_error=args.quantile_error / 100,
+        coded_confidence=args.coded_confidence,
+        profile=args.profile,
+        tile_size=args.tile_size,
+        min_tile_samples=args.min_tile_samples,
+        borrow_rings=args.borrow_rings,
+        validation=args.bootstrap > 0,
+        bootstrap_samples=args.bootstrap,
+        folds=args.folds,
+        interval_level=args.interval_level / 100,
+        max_relative_interval=args.max_relative_interval / 100,
+        grid=args.grid is not None,
+        grid_cell_size=args.grid or 0.0,
+        grid_median=args.grid_median,
+        grid_idw=args.grid_idw,
+        idw_neighbors=args.idw_neighbors,
+        idw_power=args.idw_power,
+        idw_radius=args.idw_radius,
+        # Surveys already run in parallel; only a single survey spreads its bootstrap and sweep fits over the cores
+        workers=0 if len(args.surveys) == 1 else 1,
+    )
+    try:
+        params.validate()
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    configs = None
+    if args.sweep:
+        try:
+            configs = sweep_configs([False, True] if args.sweep_formulations else [args.linearize],
+                                    parse_percentile_pairs(args.sweep), parse_bounds(args.sweep_bounds))
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 2
+    log_level = {level_option(name): level for level, name in LEVEL_NAMES.items()}[args.log_level]
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    if configs is not None:
+        return sweep_surveys(args, params, configs, log_level)
+
+    failures = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {executor.submit(process_survey, path, params, args.output_dir, log_level, args.cache_dir, (args.x, args.y)): path for path in args.surveys}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                summary = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"FAILED {path}: {e}", file=sys.stderr)
+                continue
+            k1, k2, k3 = summary["coefficients"]
+            source = " (cached fit)" if summary["cached"] else ""
+            print(f"{path}: {summary['features']} features, k1={k1:.4f} k2={k2:.4f} k3={k3:.4f}{source}, {summary['seconds']:.1f} s")
+            if summary["validation"] is not None:
+                print(f"    {summary['validation'].describe(summary['coefficients'])}")
+    return 1 if failures else 0
+
+
+def sweep_surveys(args, params, configs, log_level):
+    """Run the parameter sweep on every survey and print the configuration of each with the lowest depth RMSE"""
+    failures = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {executor.submit(sweep_survey, path, params, configs, args.output_dir, log_level): path for path in args.surveys}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                summary = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"FAILED {path}: {e}", file=sys.stderr)
+                continue
+            best = summary["best"]
+            if best is None:
+                print(f"{path}: {summary['features']} features, no configuration could be fitted and compared")
+                continue
+            k1, k2, k3 = best.fit.coefficients
+            print(f"{path}: {len(configs)} configurations, lowest depth RMSE {best.depth_rmse:.4f} "
+                  f"on {best.compared} common rows with {best.config.label()} "
+                  f"(k1={k1:.4f} k2={k2:.4f} k3={k3:.4f}), {summary['seconds']:.1f} s")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+import os
+import struct
+from dataclasses import dataclass
+
+import numpy as np
+from .engine import INPUT_KEYS, SurveyColumns
+
+# Records mapped and decoded at a time, so memory stays bounded on any file size
+DBF_BLOCK_SIZE = 262144
+
+# Field types decoded as numbers: numeric, float and character (text holding numbers)
+NUMERIC_TYPES = "NFC"
+
+# Shapefile shape types whose (first) point is read directly: null, (multi)point, -Z and -M variants
+POINT_TYPES = (1, 11, 21)
+MULTIPOINT_TYPES = (8, 18, 28)
+
+_HEADER = struct.Struct("<B3BIHH20x")
+_SHAPEFILE_HEADER_SIZE = 100
+_DESCRIPTOR = struct.Struct("<11sc4xBB14x")
+_DELETED = ord("*")
+_SPACE = ord(" ")
+
+
+@dataclass
+class DbfField:
+    """Field descriptor of a dBASE table; offset is the byte position within a record"""
+    name: str
+    type: str
+    offset: int
+    length: int
+    decimals: int
+
+
+def sibling_path(path, extension):
+    """The file beside path with another extension (either case), or None if there is none"""
+    stem = os.path.splitext(path)[0]
+    for candidate in (extension.lower(), extension.upper()):
+        if os.path.isfile(stem + candidate):
+            return stem + candidate
+    return None
+
+
+def dbf_path_for(shp_path):
+    """The .dbf beside a shapefile, or None if there is none"""
+    return sibling_path(shp_path, ".dbf")
+
+
+def _decode_numbers(raw):
+    """Float values of the fixed-width ASCII numbers in an (n, width) uint8 array.
+
+    Blank fields and '*' overflow markers are NULL (NaN), as in OGR; any
+    other text that is not a number is NaN as well.
+    """
+    text = np.ascontiguousarray(raw).view(f"S{raw.shape[1]}").ravel()
+    missing = ((raw == _SPACE) | (raw == 0)).all(axis=1) | (raw == _DELETED).any(axis=1)
+    if missing.any():
+        text = np.where(missing, b"0", text)
+    try:
+        values = text.astype(np.float64)
+    except ValueError:
+        values = np.array([_to_float(value) for value in text.tolist()])
+    values[missing] = np.nan
+    return values
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+class PointShapes:
+    """Direct reader of the point coordinates of a point or multipoint shapefile.
+
+    Record positions come from the .shx index; the first point of each
+    record is gathered from the memory-mapped .shp, as QGIS does for
+    multipoints. Null shapes have NaN coordinates. Raises ValueError for
+    other shape types or a missing index.
+    """
+
+    def __init__(self, shp_path):
+        self.path = shp_path
+        self.index_path = sibling_path(shp_path, ".shx")
+        if self.index_path is None:
+            raise ValueError(f"{shp_path} has no .shx index")
+        with open(shp_path, "rb") as f:
+            header = f.read(_SHAPEFILE_HEADER_SIZE)
+        if len(header) < _SHAPEFILE_HEADER_SIZE:
+            raise ValueError(f"{shp_path} is not a shapefile")
+        shape_type = struct.unpack_from("<i", header, 32)[0]
+        if shape_type not in POINT_TYPES + MULTIPOINT_TYPES:
+            raise ValueError(f"{shp_path} holds shape type {shape_type}, not points")
+        self.record_count = (os.path.getsize(self.index_path) - _SHAPEFILE_HEADER_SIZE) // 8
+
+    def __len__(self):
+        return self.record_count
+
+    def read(self, start, stop):
+        """(x, y) arrays of the records in [start, stop)"""
+        index = np.memmap(self.index_path, dtype=">i4", mode="r", offset=_SHAPEFILE_HEADER_SIZE + start * 8,
+                          shape=(stop - start, 2))
+        content = index[:, 0].astype(np.int64) * 2 + 8  # offsets are in 16-bit words, after an 8-byte record header
+        del index
+        shp = np.memmap(self.path, dtype=np.uint8, mode="r")
+
+        def gather(positions, dtype, count):
+            """(n, count) values of dtype at the byte positions, and whether they lie within the file"""
+            width = np.dtype(dtype).itemsize * count
+            inside = positions + width <= len(shp)
+            return shp[np.where(inside, positions, 0)[:, None] + np.arange(width)].view(dtype), inside
+
+        shape_types, known = gather(content, "<i4", 1)
+        shape_types = np.where(known, shape_types[:, 0], 0)
+        multipoint = np.isin(shape_types, MULTIPOINT_TYPES)
+        # Point: type, x, y; multipoint: type, bounding box, number of points, x, y, ...
+        n_points, _ = gather(content + 36, "<i4", 1)
+        points, inside = gather(np.where(multipoint, content + 40, content + 4), "<f8", 2)
+        del shp
+        valid = inside & (np.isin(shape_types, POINT_TYPES) | (multipoint & (n_points[:, 0] > 0)))
+        return np.where(valid, points[:, 0], np.nan), np.where(valid, points[:, 1], np.nan)
+
+
+class DbfTable:
+    """Direct reader of the numeric columns of a dBASE (.dbf) attribute table.
+
+    Only the header is read on construction. Each read memory-maps its range
+    of records, decodes the bytes of the requested fields straight into
+    NumPy arrays and releases the mapping again, so no file
+    handle stays open between reads (the data provider may rewrite the file
+    meanwhile, e.g. to add the result fields). Deleted records are skipped;
+    feature ids are the 0-based record numbers, which are the OGR (and so
+    QGIS) feature ids of a shapefile. With the PointShapes of the
+    shapefile, the point coordinates can be read along with the fields.
+    Raises ValueError for a file that is not a dBASE table, a field that
+    cannot be decoded as a number or points that do not match the records.
+    """
+
+    def __init__(self, path, points=None):
+        self.path = path
+        self.points = points
+        with open(path, "rb") as f:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                raise ValueError(f"{path} is not a dBASE table")
+            _, _, _, _, record_count, self.header_length, self.record_length = _HEADER.unpack(header)
+            descriptors = f.read(max(0, self.header_length - _HEADER.size))
+
+        self.fields = {}
+        offset = 1  # after the deletion flag
+        for start in range(0, len(descriptors) - _DESCRIPTOR.size + 1, _DESCRIPTOR.size):
+            if descriptors[start] == 0x0D:
+                break
+            name, field_type, length, decimals = _DESCRIPTOR.unpack_from(descriptors, start)
+            name = name.split(b"\0")[0].decode("latin-1")
+            self.fields[name] = DbfField(name, field_type.decode("latin-1"), offset, length, decimals)
+            offset += length
+        if not self.fields or offset > self.record_length:
+            raise ValueError(f"{path} is not a dBASE table")
+
+        # A truncated file holds fewer records than its header announces
+        available = (os.path.getsize(path) - self.header_length) // self.record_length
+        self.record_count = max(0, min(record_count, available))
+        if points is not None and len(points) != self.record_count:
+            raise ValueError(f"{points.path} holds {len(points)} shapes for {self.record_count} records")
+
+    def __len__(self):
+        return self.record_count
+
+    def field(self, name):
+        field = self.fields.get(name)
+        if field is None:
+            raise ValueError(f"Field '{name}' does not exist in {self.path}.")
+        if field.type not in NUMERIC_TYPES:
+            raise ValueError(f"Field '{name}' of {self.path} has type {field.type}, which is not read directly.")
+        return field
+
+    def mapped_fields(self, field_names):
+        """DbfField of each key of INPUT_KEYS, in that order"""
+        return [self.field(field_names[key]) for key in INPUT_KEYS]
+
+    def read(self, fields, start=0, stop=None, with_coordinates=False):
+        """(fids, list of float arrays of fields) of the records in [start, stop) that are not deleted.
+
+        With with_coordinates the x and y arrays of the points follow the fields.
+        """
+        stop = self.record_count if stop is None else min(stop, self.record_count)
+        if stop <= start:
+            return np.empty(0, np.int64), [np.empty(0) for _ in fields]
+        records = np.memmap(self.path, dtype=np.uint8, mode="r", offset=self.header_length + start * self.record_length,
+                            shape=(stop - start, self.record_length))
+        kept = records[:, 0] != _DELETED
+        values = [_decode_numbers(records[:, field.offset:field.offset + field.length]) for field in fields]
+        # Every array above is a copy, so dropping the map unmaps the file
+        del records
+        if with_coordinates:
+            values.extend(self.points.read(start, stop))
+        fids = np.arange(start, stop, dtype=np.int64)
+        if not kept.all():
+            fids = fids[kept]
+            values = [column[kept] for column in values]
+        return fids, values
+
+    def read_columns(self, field_names, feedback=None, with_coordinates=False):
+        """The mapped E1/E2/PeakSV/Depth fields of the whole table as SurveyColumns.
+
+        feedback (any object with isCanceled()/setProgress()) receives
+        progress updates and can cancel the read, in which case None is
+        returned. With with_coordinates the x/y columns are filled from the
+        points.
+        """
+        parts = list(self.iter_chunks(field_names, DBF_BLOCK_SIZE, feedback, with_coordinates))
+        if feedback is not None and feedback.isCanceled():
+            return None
+        names = ["fids", "e1", "e2", "peak_sv", "depth"] + (["x", "y"] if with_coordinates else [])
+        if not parts:
+            return SurveyColumns(np.empty(0, np.int64), *(np.empty(0) for _ in names[1:]))
+        return SurveyColumns(*(np.concatenate([getattr(chunk, name) for chunk in parts]) for name in names))
+
+    def iter_chunks(self, field_names, chunk_size, feedback=None, with_coordinates=False):
+        """Yield SurveyColumns of (at most) chunk_size records of the mapped fields.
+
+        Same contract as extraction.iter_column_chunks(): iteration stops
+        early if feedback is canceled, and callers check
+        feedback.isCanceled() afterwards.
+        """
+        if with_coordinates and self.points is None:
+            raise ValueError(f"No point shapes given for {self.path}")
+        fields = self.mapped_fields(field_names)
+        for start in range(0, self.record_count, chunk_size):
+            fids, values = self.read(fields, start, start + chunk_size, with_coordinates)
+            if len(fids):
+                yield SurveyColumns(fids, *values)
+            if feedback is not None:
+                if feedback.isCanceled():
+                    return
+                feedback.setProgress(min(100.0, (start + chunk_size) / self.record_count * 100))
@@ -0,0 +1,595 @@
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import lsq_linear
+from .sketch import quantile_estimator
+
+# Logical inputs, in the order they are read from a layer
+INPUT_KEYS = ("E1", "E2", "PeakSV", "Depth")
+
+# Confidence codes used by the vectorized evaluation
+CONFIDENCE_NONE = -1
+CONFIDENCE_LOW = 0
+CONFIDENCE_HIGH = 1
+CONFIDENCE_LABELS = {CONFIDENCE_HIGH: "High", CONFIDENCE_LOW: "Low"}
+
+# Calculation modes
+MODE_MANUAL = "manual"
+MODE_OPTIMIZED = "optimized"
+MODE_REGIONAL = "regional"
+
+# Regression columns, in the order used by fit_rows() and Moments
+FIT_COLUMNS = ["E1", "E1_E2_ratio", "PeakSV", "Depth"]
+
+# Rows fed to the quantile sketch at a time
+SKETCH_BATCH_SIZE = 100000
+
+# Bounds of the constrained (k1, k2, k3) regression
+BOUNDS_STANDARD = ([0.5, 0.1, 0.2], [1.5, 0.7, 0.5])
+BOUNDS_LINEARIZED = ([0.5, 0.01, 0.2], [1.5, 0.05, 0.5])
+
+
+@dataclass
+class HardnessParameters:
+    """Settings of one hardness calculation"""
+    field_names: dict = field(default_factory=dict)
+    mode: str = MODE_MANUAL
+    linearize: bool = False
+    k1: float = 0.7
+    k2: float = 0.5
+    k3: float = 0.3
+    lower_percentile: float = 0.05
+    upper_percentile: float = 0.95
+    streaming: bool = False
+    chunk_size: int = 100000
+    exact_quantiles: bool = True
+    quantile_error: float = 0.001
+    incremental: bool = False
+    write_batch_size: int = 50000
+    coded_confidence: bool = False
+    tile_size: float = 0.0
+    min_tile_samples: int = 200
+    borrow_rings: int = 2
+    workers: int = 0
+    validation: bool = False
+    bootstrap_samples: int = 1000
+    folds: int = 5
+    interval_level: float = 0.95
+    max_relative_interval: float = 0.0
+    k_bounds: tuple = None
+    profile: bool = False
+    grid: bool = False
+    grid_cell_size: float = 0.0
+    grid_median: bool = False
+    grid_idw: bool = False
+    idw_neighbors: int = 8
+    idw_power: float = 2.0
+    idw_radius: float = 0.0
+
+    @property
+    def bounds(self):
+        """(lower, upper) bounds of the constrained regression: k_bounds if set, else the formulation's default"""
+        if self.k_bounds is not None:
+            return self.k_bounds
+        return BOUNDS_LINEARIZED if self.linearize else BOUNDS_STANDARD
+
+    def validate(self):
+        """Raise ValueError if the settings cannot be used"""
+        if self.mode not in (MODE_MANUAL, MODE_OPTIMIZED, MODE_REGIONAL):
+            raise ValueError(f"Unknown calculation mode: {self.mode}")
+        fitted = self.mode != MODE_MANUAL
+        if fitted and not (0 <= self.lower_percentile < self.upper_percentile <= 1):
+            raise ValueError("Percentiles must be between 0 and 100, with lower < upper.")
+        if fitted and not self.exact_quantiles and not (0 < self.quantile_error < 1):
+            raise ValueError("The quantile error bound must be between 0 and 1.")
+        if self.validation and self.mode != MODE_OPTIMIZED:
+            raise ValueError("Bootstrap intervals and cross-validation are only available in Optimized mode.")
+        if self.validation:
+            if self.bootstrap_samples < 10:
+                raise ValueError("Use at least 10 bootstrap resamples.")
+            if self.folds < 2:
+                raise ValueError("Cross-validation needs at least 2 folds.")
+            if not (0 < self.interval_level < 1):
+                raise ValueError("The interval level must be between 0 and 100%.")
+            if self.max_relative_interval < 0:
+                raise ValueError("The maximum relative interval width cannot be negative.")
+        if self.mode == MODE_REGIONAL:
+            if self.tile_size < 0:
+                raise ValueError("The tile size must be positive, or 0 for an automatic size.")
+            if self.min_tile_samples < 1:
+                raise ValueError("The minimum number of samples per tile must be at least 1.")
+            if self.borrow_rings < 0:
+                raise ValueError("The number of neighbour rings cannot be negative.")
+        if self.grid:
+            if self.incremental:
+                raise ValueError("The hardness grid needs a full run; it is not written by an incremental update.")
+            if self.grid_cell_size < 0:
+                raise ValueError("The grid cell size must be positive, or 0 for an automatic size.")
+            if self.grid_idw:
+                if self.idw_neighbors < 1:
+                    raise ValueError("IDW needs at least 1 neighbour.")
+                if self.idw_power <= 0:
+                    raise ValueError("The IDW power must be positive.")
+                if self.idw_radius < 0:
+                    raise ValueError("The IDW search radius must be positive, or 0 for an automatic radius.")
+        if self.write_batch_size < 1:
+            raise ValueError("The write batch size must be a positive number of features.")
+        if self.streaming and self.chunk_size < 1:
+            raise ValueError("The chunk size must be a positive number of features.")
+
+
+class SurveyColumns:
+    """Columnar view of the four mapped sonar attributes of a layer.
+
+    Values that are NULL or cannot be converted to float are stored as NaN,
+    so every validity rule can be expressed as a boolean mask. x and y hold
+    the point coordinates when they were read (regional mode), else None.
+    """
+
+    def __init__(self, fids, e1, e2, peak_sv, depth, x=None, y=None):
+        self.fids = fids
+        self.e1 = e1
+        self.e2 = e2
+        self.peak_sv = peak_sv
+        self.depth = depth
+        self.x = x
+        self.y = y
+
+    def __len__(self):
+        return len(self.fids)
+
+    @property
+    def valid(self):
+        """Rows where hardness can be computed (E1 > 0 and PeakSV > 0)"""
+        return (self.e1 > 0) & (self.peak_sv > 0)
+
+    @property
+    def has_e2(self):
+        """Rows with a usable second echo (E2 > 0)"""
+        return self.e2 > 0
+
+    @property
+    def fit_mask(self):
+        """Rows usable for the regression (full formula and a known depth)"""
+        return self.valid & self.has_e2 & ~np.isnan(self.depth)
+
+    def subset(self, mask):
+        """SurveyColumns with only the rows selected by a boolean mask or index array"""
+        if self.x is None:
+            return SurveyColumns(self.fids[mask], self.e1[mask], self.e2[mask], self.peak_sv[mask], self.depth[mask])
+        return SurveyColumns(self.fids[mask], self.e1[mask], self.e2[mask], self.peak_sv[mask], self.depth[mask],
+                             self.x[mask], self.y[mask])
+
+
+def input_digest(columns):
+    """64-bit digest per row of the inputs that determine its hardness (E1, E2, PeakSV)"""
+    digest = np.full(len(columns), 0x9E3779B97F4A7C15, dtype=np.uint64)
+    for values in (columns.e1, columns.e2, columns.peak_sv):
+        bits = np.ascontiguousarray(values, dtype=np.float64).view(np.uint64)
+        digest = (digest ^ bits) * np.uint64(0x100000001B3)
+        digest ^= digest >> np.uint64(29)
+    return digest
+
+
+def ratio_term(e1, e2, linearize):
+    """E1/E2 term of the hardness formula: 10^((E1-E2)/10) if linearized, E1/E2 otherwise"""
+    with np.errstate(over="ignore", divide="ignore", invalid="ignore"):
+        if linearize:
+            return np.power(10.0, (e1 - e2) / 10.0)
+        return e1 / e2
+
+
+def evaluate_hardness(columns, k1, k2, k3, linearize):
+    """Evaluate the hardness formula over all rows of a SurveyColumns at once.
+
+    Rows with E1 > 0 and PeakSV > 0 use k1*E1 + k2*f(E1,E2) + k3*PeakSV with
+    High confidence when E2 > 0, and the simplified k1*E1 + k3*PeakSV with Low
+    confidence otherwise. Returns (hardness, confidence) aligned with
+    columns.fids: hardness is NaN where it cannot be computed or is not
+    finite, confidence holds the CONFIDENCE_* codes. The coefficients are
+    scalars or per-row arrays (regional mode).
+    """
+    valid = columns.valid
+    high = valid & columns.has_e2
+
+    with np.errstate(over="ignore", invalid="ignore"):
+        hardness = k1 * columns.e1 + k3 * columns.peak_sv
+        term = ratio_term(columns.e1[high], columns.e2[high], linearize)
+        hardness[high] += np.broadcast_to(k2, hardness.shape)[high] * term
+    hardness[~valid | ~np.isfinite(hardness)] = np.nan
+
+    confidence = np.full(len(columns), CONFIDENCE_NONE, dtype=np.int8)
+    confidence[valid] = CONFIDENCE_LOW
+    confidence[high] = CONFIDENCE_HIGH
+    return hardness, confidence
+
+
+def confidence_labels(confidence):
+    """Map confidence codes to the "High"/"Low"/None attribute values"""
+    labels = np.array([None, CONFIDENCE_LABELS[CONFIDENCE_LOW], CONFIDENCE_LABELS[CONFIDENCE_HIGH]], dtype=object)
+    return labels[confidence + 1]
+
+
+def input_diagnostics(columns, hardness=None):
+    """Count the rows affected by each validity rule, for the processing log"""
+    valid = columns.valid
+    counts = OrderedDict()
+    counts["E1 NULL or non-numeric"] = np.isnan(columns.e1)
+    counts["E1 <= 0"] = columns.e1 <= 0
+    counts["PeakSV NULL or non-numeric"] = np.isnan(columns.peak_sv)
+    counts["PeakSV <= 0"] = columns.peak_sv <= 0
+    counts["E2 NULL, non-numeric or <= 0 (simplified formula)"] = valid & ~columns.has_e2
+    counts["Depth NULL or non-numeric (excluded from fit)"] = valid & columns.has_e2 & np.isnan(columns.depth)
+    if hardness is not None:
+        counts["Non-finite hardness (set to NULL)"] = valid & np.isnan(hardness)
+    return OrderedDict((reason, int(np.count_nonzero(mask))) for reason, mask in counts.items())
+
+
+def fit_rows(columns, linearize, with_coordinates=False):
+    """Regression rows of a SurveyColumns as an (n, 4) array of FIT_COLUMNS.
+
+    With with_coordinates the point x and y are appended as two more
+    columns; they may be NaN.
+    """
+    fit_mask = columns.fit_mask
+    e1 = columns.e1[fit_mask]
+    values = np.column_stack([
+        e1,
+        ratio_term(e1, columns.e2[fit_mask], linearize),
+        columns.peak_sv[fit_mask],
+        columns.depth[fit_mask],
+    ])
+    finite = np.isfinite(values).all(axis=1)
+    if with_coordinates:
+        values = np.column_stack([values, columns.x[fit_mask], columns.y[fit_mask]])
+    return values[finite]
+
+
+def percentile_estimator(params):
+    """Empty quantile estimator (sketch or exact) for the regression columns"""
+    return quantile_estimator(params.exact_quantiles, params.quantile_error, len(FIT_COLUMNS))
+
+
+def percentile_bounds(estimator, params):
+    """Per-column (low, high) outlier bounds from a filled quantile estimator"""
+    return estimator.quantile(params.lower_percentile), estimator.quantile(params.upper_percentile)
+
+
+def within_bounds(values, low, high):
+    """Rows of values whose every column lies within [low, high]"""
+    return ((values >= low) & (values <= high)).all(axis=1)
+
+
+class Moments:
+    """Mergeable sufficient statistics of the regression columns.
+
+    Holds the row count, column means, co-moment matrix (sum of outer
+    products of the centered rows) and column minimum/maximum. Batches are
+    combined with the pairwise update of Chan et al., so the statistics of
+    a whole layer can be accumulated chunk by chunk in constant memory.
+    """
+
+    def __init__(self, width=4):
+        self.n = 0
+        self.mean = np.zeros(width)
+        self.comoment = np.zeros((width, width))
+        self.min = np.full(width, np.inf)
+        self.max = np.full(width, -np.inf)
+
+    @classmethod
+    def from_values(cls, values):
+        moments = cls(values.shape[1])
+        moments.update(values)
+        return moments
+
+    def update(self, values):
+        """Add the rows of an (n, width) array"""
+        if len(values) == 0:
+            return
+        other = Moments(values.shape[1])
+        other.n = len(values)
+        other.mean = values.mean(axis=0)
+        centered = values - other.mean
+        other.comoment = centered.T @ centered
+        other.min = values.min(axis=0)
+        other.max = values.max(axis=0)
+        self.merge(other)
+
+    def merge(self, other):
+        """Add the statistics of another Moments"""
+        if other.n == 0:
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.n / n)
+        self.comoment = self.comoment + other.comoment + np.outer(delta, delta) * (self.n * other.n / n)
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.n = n
+
+    def to_dict(self):
+        return {
+            "n": self.n,
+            "mean": self.mean.tolist(),
+            "comoment": self.comoment.tolist(),
+            "min": self.min.tolist(),
+            "max": self.max.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        moments = cls(len(data["mean"]))
+        moments.n = data["n"]
+        moments.mean = np.array(data["mean"])
+        moments.comoment = np.array(data["comoment"])
+        moments.min = np.array(data["min"])
+        moments.max = np.array(data["max"])
+        return moments
+
+    def correlation(self):
+        """Pearson correlation matrix of the columns"""
+        scale = np.sqrt(np.diag(self.comoment))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.comoment / np.outer(scale, scale)
+
+
+@dataclass
+class RegressionFit:
+    """Result of the bounded regression of the normalized acoustic terms on depth"""
+    coefficients: tuple
+    unbounded: tuple
+    intercept: float
+    rmse: float
+    n: int
+    moments: Moments = None
+    outlier_bounds: tuple = None
+    validation: object = None
+
+    def to_dict(self):
+        return {
+            "coefficients": list(self.coefficients),
+            "unbounded": list(self.unbounded),
+            "intercept": self.intercept,
+            "rmse": self.rmse,
+            "n": self.n,
+            "moments": self.moments.to_dict() if self.moments is not None else None,
+            "outlier_bounds": [list(map(float, bound)) for bound in self.outlier_bounds] if self.outlier_bounds is not None else None,
+            "validation": self.validation.to_dict() if self.validation is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        from .validation import ValidationResult
+        return cls(
+            tuple(data["coefficients"]),
+            tuple(data["unbounded"]),
+            data["intercept"],
+            data["rmse"],
+            data["n"],
+            Moments.from_dict(data["moments"]) if data.get("moments") else None,
+            tuple(np.array(bound) for bound in data["outlier_bounds"]) if data.get("outlier_bounds") else None,
+            ValidationResult.from_dict(data["validation"]) if data.get("validation") else None,
+        )
+
+
+def normalized_statistics(moments):
+    """(mean, covariance, gram) of the FIT_COLUMNS of moments, min-max normalized to [0, 1].
+
+    z = (x - min) / (max - min); a constant E1/E2 column becomes 0, any
+    other constant column raises ValueError. gram is the uncentered z'z.
+    """
+    value_range = moments.max - moments.min
+    for index, name in enumerate(FIT_COLUMNS):
+        if value_range[index] == 0 and name != "E1_E2_ratio":
+            raise ValueError(f"{name} has no variation after outlier removal.")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = np.where(value_range > 0, 1.0 / value_range, 0.0)
+    mean = (moments.mean - moments.min) * scale
+    covariance = moments.comoment * np.outer(scale, scale)
+    return mean, covariance, covariance + moments.n * np.outer(mean, mean)
+
+
+def fit_from_moments(moments, bounds, log):
+    """Fit (k1, k2, k3) from the Moments of the outlier-filtered FIT_COLUMNS.
+
+    Every column is min-max normalized to [0, 1] (a constant E1/E2 column
+    becomes 0). The unbounded fit is ordinary least squares with intercept;
+    the final coefficients solve the bounded least-squares problem without
+    intercept, reduced to its 3x3 normal equations.
+    """
+    if moments.n == 0:
+        raise ValueError("No data points left after outlier removal.")
+
+    correlation_matrix = pd.DataFrame(moments.correlation(), index=FIT_COLUMNS, columns=FIT_COLUMNS)
+    log.phase("\nCorrelation Matrix:")
+    log.phase(f"{correlation_matrix.round(3).to_string()}")
+
+    mean, covariance, gram = normalized_statistics(moments)
+    n = moments.n
+
+    # Unbounded regression (with intercept)
+    unbounded = np.linalg.lstsq(covariance[:3, :3], covariance[:3, 3], rcond=None)[0]
+    intercept = mean[3] - unbounded @ mean[:3]
+
+    log.phase("\nUnbounded Regression Results:")
+    log.phase(f"  k1: {unbounded[0]:.4f}")
+    log.phase(f"  k2: {unbounded[1]:.4f}")
+    log.phase(f"  k3: {unbounded[2]:.4f}")
+    log.phase(f"  Intercept: {intercept:.4f}")
+
+    # Bounded regression (no intercept) on the Gram matrix of the normalized terms
+    coefficients = bounded_solve(gram[:3, :3], gram[:3, 3], bounds)
+    sse = coefficients @ gram[:3, :3] @ coefficients - 2 * coefficients @ gram[:3, 3] + gram[3, 3]
+    rmse = float(np.sqrt(max(sse, 0.0) / n))
+
+    return RegressionFit(tuple(float(k) for k in coefficients), tuple(float(k) for k in unbounded), float(intercept), rmse, n, moments)
+
+
+def bounded_solve(gram, moment, bounds):
+    """Minimize ||Xk - y||^2 within bounds, given X'X (gram) and X'y (moment).
+
+    Builds a square system A with A'A = X'X and A'b = X'y from the
+    eigendecomposition of the Gram matrix and hands it to lsq_linear, which
+    yields the same minimizer as solving on the full design matrix.
+    """
+    eigenvalues, eigenvectors = np.linalg.eigh(gram)
+    keep = eigenvalues > eigenvalues.max() * 1e-12
+    root = np.sqrt(eigenvalues[keep])
+    a = root[:, None] * eigenvectors[:, keep].T
+    b = (eigenvectors[:, keep].T @ moment) / root
+    return lsq_linear(a, b, bounds=bounds).x
+
+
+def fit_coefficients(columns, params, log):
+    """Estimate (k1, k2, k3) by bounded regression of the acoustic terms on depth.
+
+    Uses the rows of columns.fit_mask, removes outliers outside the
+    configured percentiles of every column, normalizes to [0, 1] and solves
+    the bounded least-squares problem. With params.validation the fit
+    also gets bootstrap intervals and cross-validated R² (fit.validation).
+    Diagnostics go to log, and the filter, correlation, fit and validate
+    phases to its instrumentation.
+    """
+    with log.timed("filter", len(columns)):
+        values = fit_rows(columns, params.linearize)
+        if len(values) == 0:
+            raise ValueError("No valid data found in the selected fields.")
+
+        # Remove outliers, with the bounds from a quantile sketch fed in batches (or exact quantiles)
+        estimator = percentile_estimator(params)
+        for start in range(0, len(values), SKETCH_BATCH_SIZE):
+            estimator.update(values[start:start + SKETCH_BATCH_SIZE])
+        low, high = percentile_bounds(estimator, params)
+        filtered = values[within_bounds(values, low, high)]
+    log.phase(f"\nPercentile bounds: {estimator.describe()}")
+
+    log.phase(f"\nData points after outlier removal: {len(filtered)}")
+    log.phase(f"Outliers removed: {len(values) - len(filtered)}")
+
+    with log.timed("correlation", len(filtered)):
+        moments = Moments.from_values(filtered)
+    with log.timed("fit", moments.n):
+        fit = fit_from_moments(moments, params.bounds, log)
+    fit.outlier_bounds = (low, high)
+    if params.validation:
+        from .validation import BlockGrams, validate_fit
+        with log.timed("validate", moments.n):
+            block_grams = BlockGrams()
+            block_grams.update(filtered)
+            fit.validation = validate_fit(block_grams, moments, params, params.workers)
+    return fit
+
+
+def fit_pooled(parts, params, log):
+    """Estimate one (k1, k2, k3) for several surveys from their merged statistics.
+
+    parts is a sequence of SurveyColumns, one per survey. Their rows are
+    never concatenated: every part fills its own quantile estimator, the
+    estimators are merged for common outlier bounds, and the Moments (and
+    with params.validation the BlockGrams) of each part's rows within those
+    bounds are merged for the fit. The per-part work runs in
+    params.workers threads (0 = one per CPU core). Same phases and
+    diagnostics as fit_coefficients().
+    """
+    from .validation import BlockGrams, validate_fit
+
+    def estimate(columns):
+        values = fit_rows(columns, params.linearize)
+        estimator = percentile_estimator(params)
+        for start in range(0, len(values), SKETCH_BATCH_SIZE):
+            estimator.update(values[start:start + SKETCH_BATCH_SIZE])
+        return values, estimator
+
+    def accumulate(values):
+        filtered = values[within_bounds(values, low, high)]
+        block_grams = BlockGrams() if params.validation else None
+        if block_grams is not None:
+            block_grams.update(filtered)
+        return Moments.from_values(filtered), block_grams
+
+    with ThreadPoolExecutor(max_workers=params.workers or os.cpu_count() or 1) as executor:
+        with log.timed("filter", sum(len(columns) for columns in parts)):
+            estimated = list(executor.map(estimate, parts))
+            estimator = percentile_estimator(params)
+            for _, part_estimator in estimated:
+                estimator.merge(part_estimator)
+            if estimator.n == 0:
+                raise ValueError("No valid data found in the selected fields.")
+            low, high = percentile_bounds(estimator, params)
+        log.phase(f"\nPercentile bounds: {estimator.describe()}, merged over {len(parts)} surveys")
+
+        with log.timed("correlation", estimator.n):
+            accumulated = list(executor.map(accumulate, [values for values, _ in estimated]))
+            moments = Moments()
+            block_grams = BlockGrams() if params.validation else None
+            for part_moments, part_grams in accumulated:
+                moments.merge(part_moments)
+                if block_grams is not None:
+                    block_grams.merge(part_grams)
+    log.phase(f"\nData points after outlier removal: {moments.n}")
+    log.phase(f"Outliers removed: {estimator.n - moments.n}")
+
+    with log.timed("fit", moments.n):
+        fit = fit_from_moments(moments, params.bounds, log)
+    fit.outlier_bounds = (low, high)
+    if block_grams is not None:
+        with log.timed("validate", moments.n):
+            fit.validation = validate_fit(block_grams, moments, params, params.workers)
+    return fit
+
+
+@dataclass
+class HardnessResult:
+    """Outcome of run_engine(): coefficients and per-row results aligned with the input fids"""
+    coefficients: tuple
+    fids: np.ndarray
+    hardness: np.ndarray
+    confidence: np.ndarray
+    diagnostics: dict
+    fit: RegressionFit = None
+    regional: object = None
+
+
+def run_engine(columns, params, log, fit=None):
+    """Headless pipeline: filter and fit (Optimized mode), then evaluate every row.
+
+    A previously computed RegressionFit (e.g. from the fit cache) skips the
+    filtering and fitting in Optimized mode. Regional mode needs the x and y
+    columns and evaluates every row with its blended tile coefficients; the
+    result's coefficients are then those of the global fit. Raises ValueError when the parameters are invalid
+    or no row can be used.
+    """
+    params.validate()
+    if not columns.fit_mask.any():
+        raise ValueError("No valid data found in the selected fields.")
+
+    regional = None
+    if params.mode == MODE_MANUAL:
+        fit = None
+        coefficients = (params.k1, params.k2, params.k3)
+    elif params.mode == MODE_REGIONAL:
+        from .regional import fit_regional
+        regional = fit_regional(columns, params, log)
+        fit = regional.global_fit
+        coefficients = fit.coefficients
+    else:
+        if fit is None:
+            fit = fit_coefficients(columns, params, log)
+        coefficients = fit.coefficients
+
+    with log.timed("evaluate", len(columns)):
+        row_coefficients = regional.coefficients_at(columns.x, columns.y) if regional is not None else coefficients
+        hardness, confidence = evaluate_hardness(columns, *row_coefficients, params.linearize)
+        diagnostics = input_diagnostics(columns, hardness)
+        if fit is not None and fit.validation is not None and params.max_relative_interval > 0:
+            from .validation import interval_confidence
+            diagnostics["High confidence downgraded (wide bootstrap interval)"] = interval_confidence(
+                columns, hardness, confidence, fit.validation, params.linearize, params.max_relative_interval)
+    diagnostics["High confidence (full formula)"] = int(np.count_nonzero(confidence == CONFIDENCE_HIGH))
+    diagnostics["Low confidence (simplified formula)"] = int(np.count_nonzero(confidence == CONFIDENCE_LOW))
+    diagnostics["NULL hardness"] = int(np.count_nonzero(np.isnan(hardness)))
+    return HardnessResult(coefficients, columns.fids, hardness, confidence, diagnostics, fit, regional)
@@ -0,0 +1,215 @@
+import random
+
+import numpy as np
+from .cache import source_path
+from .dbf import dbf_path_for
+from .engine import INPUT_KEYS, SurveyColumns
+
+# Fixed seed, so the preview sample of an unchanged layer is the same every time
+SAMPLE_SEED = 0
+
+
+def _to_float(value):
+    """Convert an attribute value to float, mapping NULL/invalid values to NaN"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _grow(arrays, size):
+    """Return copies of arrays enlarged to size, new slots filled with NaN"""
+    grown = []
+    for array in arrays:
+        new_array = np.full(size, np.nan, dtype=array.dtype) if array.dtype.kind == "f" else np.zeros(size, dtype=array.dtype)
+        new_array[:len(array)] = array
+        grown.append(new_array)
+    return grown
+
+
+def _point_xy(geometry):
+    """(x, y) of a point geometry (the first point of a multipoint), NaN for a missing geometry"""
+    if geometry.isNull() or geometry.isEmpty():
+        return np.nan, np.nan
+    point = geometry.vertexAt(0)
+    return point.x(), point.y()
+
+
+def direct_dbf_path(layer):
+    """.dbf whose records can be read directly instead of through the provider, or None.
+
+    That is the case for a shapefile layer of the OGR provider without a
+    subset filter or unsaved edits, where the attribute table on disk holds
+    exactly the layer's features. Call on the main thread.
+    """
+    if layer.providerType() != "ogr" or layer.subsetString() or layer.isModified():
+        return None
+    path = source_path(layer.source())
+    if not path.lower().endswith(".shp"):
+        return None
+    return dbf_path_for(path)
+
+
+def _attribute_request(fields, field_names, with_geometry=False, request_type=None):
+    """Feature request for the mapped attributes only, without geometry unless with_geometry is set.
+
+    request_type is the request class to build, QgsFeatureRequest by
+    default; sources other than QGIS layers (the benchmark's MemoryLayer)
+    pass their own.
+    """
+    indices = []
+    for key in INPUT_KEYS:
+        index = fields.indexOf(field_names[key])
+        if index < 0:
+            raise ValueError(f"Field '{field_names[key]}' selected for {key} does not exist in the layer.")
+        indices.append(index)
+
+    if request_type is None:
+        from qgis.core import QgsFeatureRequest as request_type
+    request = request_type()
+    if not with_geometry:
+        request.setFlags(request_type.NoGeometry)
+    request.setSubsetOfAttributes(indices)
+    return request, indices
+
+
+def extract_columns(source, fields, field_names, total=-1, feedback=None, with_coordinates=False, request_type=None):
+    """Read the mapped E1/E2/PeakSV/Depth attributes of a feature source into NumPy arrays.
+
+    source is a layer or a QgsVectorLayerFeatureSource (safe to iterate from
+    a background task) with the given fields; total is its feature count if
+    known. Only the four mapped attributes are requested from the provider
+    and no geometry is fetched. field_names maps each key of INPUT_KEYS to a
+    field name. An optional feedback (QgsFeedback, QgsTask or any object with
+    isCanceled()/setProgress()) receives progress updates and can cancel the
+    read, in which case None is returned. With with_coordinates the point
+    geometries are read as well and stored in the x/y columns. request_type
+    replaces QgsFeatureRequest for sources that are not QGIS layers.
+    """
+    request, indices = _attribute_request(fields, field_names, with_coordinates, request_type)
+
+    capacity = total if total > 0 else 1024
+    fids = np.zeros(capacity, dtype=np.int64)
+    values = [np.full(capacity, np.nan) for _ in INPUT_KEYS]
+    e1_idx, e2_idx, peak_idx, depth_idx = indices
+    e1, e2, peak_sv, depth = values
+    x = np.full(capacity, np.nan) if with_coordinates else None
+    y = np.full(capacity, np.nan) if with_coordinates else None
+
+    update_interval = max(1, total // 100)
+    count = 0
+    for feature in source.getFeatures(request):
+        if count == capacity:
+            capacity *= 2
+            fids, e1, e2, peak_sv, depth = _grow([fids, e1, e2, peak_sv, depth], capacity)
+            if with_coordinates:
+                x, y = _grow([x, y], capacity)
+
+        attributes = feature.attributes()
+        fids[count] = feature.id()
+        e1[count] = _to_float(attributes[e1_idx])
+        e2[count] = _to_float(attributes[e2_idx])
+        peak_sv[count] = _to_float(attributes[peak_idx])
+        depth[count] = _to_float(attributes[depth_idx])
+        if with_coordinates:
+            x[count], y[count] = _point_xy(feature.geometry())
+        count += 1
+
+        if feedback is not None and count % update_interval == 0:
+            if feedback.isCanceled():
+                return None
+            if total > 0:
+                feedback.setProgress(min(100.0, count / total * 100))
+
+    if with_coordinates:
+        return SurveyColumns(fids[:count], e1[:count], e2[:count], peak_sv[:count], depth[:count], x[:count], y[:count])
+    return SurveyColumns(fids[:count], e1[:count], e2[:count], peak_sv[:count], depth[:count])
+
+
+def iter_column_chunks(source, fields, field_names, chunk_size, total=-1, feedback=None, with_coordinates=False,
+                       request_type=None):
+    """Yield SurveyColumns of at most chunk_size features from a feature source.
+
+    Same request and conversion rules as extract_columns(), but only one
+    chunk is held in memory at a time. Iteration stops early if feedback is
+    canceled; callers check feedback.isCanceled() afterwards.
+    """
+    request, (e1_idx, e2_idx, peak_idx, depth_idx) = _attribute_request(fields, field_names, with_coordinates,
+                                                                         request_type)
+    width = len(INPUT_KEYS) + (2 if with_coordinates else 0)
+
+    def new_chunk():
+        return np.zeros(chunk_size, dtype=np.int64), [np.full(chunk_size, np.nan) for _ in range(width)]
+
+    fids, values = new_chunk()
+    e1, e2, peak_sv, depth = values[:4]
+    count = 0
+    seen = 0
+    for feature in source.getFeatures(request):
+        attributes = feature.attributes()
+        fids[count] = feature.id()
+        e1[count] = _to_float(attributes[e1_idx])
+        e2[count] = _to_float(attributes[e2_idx])
+        peak_sv[count] = _to_float(attributes[peak_idx])
+        depth[count] = _to_float(attributes[depth_idx])
+        if with_coordinates:
+            values[4][count], values[5][count] = _point_xy(feature.geometry())
+        count += 1
+
+        if count == chunk_size:
+            seen += count
+            yield SurveyColumns(fids, *values)
+            if feedback is not None:
+                if feedback.isCanceled():
+                    return
+                if total > 0:
+                    feedback.setProgress(min(100.0, seen / total * 100))
+            fids, values = new_chunk()
+            e1, e2, peak_sv, depth = values[:4]
+            count = 0
+
+    if count:
+        yield SurveyColumns(fids[:count], *(column[:count] for column in values))
+
+
+def sample_features(source, fields, field_names, size, total=-1, grid=None, feedback=None, seed=SAMPLE_SEED):
+    """Random sample of at most size features with their geometries, read in one pass.
+
+    Uses reservoir sampling, so the layer size need not be known. With a
+    TileGrid the sample is spatially stratified: every tile keeps its own
+    reservoir of size / len(grid) features, so sparse areas are represented
+    as well as dense ones. Returns (SurveyColumns with x/y, geometries), or
+    None if feedback is canceled.
+    """
+    request, (e1_idx, e2_idx, peak_idx, depth_idx) = _attribute_request(fields, field_names, with_geometry=True)
+    capacity = max(1, size // len(grid)) if grid is not None else size
+    rng = random.Random(seed)
+    reservoirs = {}
+    seen = {}
+
+    update_interval = max(1, total // 100)
+    for count, feature in enumerate(source.getFeatures(request), 1):
+        stratum = grid.tile_id(*_point_xy(feature.geometry())) if grid is not None else 0
+        seen[stratum] = seen.get(stratum, 0) + 1
+        reservoir = reservoirs.setdefault(stratum, [])
+        if len(reservoir) < capacity:
+            reservoir.append(feature)
+        else:
+            slot = rng.randrange(seen[stratum])
+            if slot < capacity:
+                reservoir[slot] = feature
+
+        if feedback is not None and count % update_interval == 0:
+            if feedback.isCanceled():
+                return None
+            if total > 0:
+                feedback.setProgress(min(100.0, count / total * 100))
+
+    features = sorted((feature for reservoir in reservoirs.values() for feature in reservoir), key=lambda f: f.id())
+    values = np.full((len(features), 6), np.nan)
+    for row, feature in enumerate(features):
+        attributes = feature.attributes()
+        values[row, :4] = [_to_float(attributes[index]) for index in (e1_idx, e2_idx, peak_idx, depth_idx)]
+        values[row, 4:] = _point_xy(feature.geometry())
+    fids = np.array([feature.id() for feature in features], dtype=np.int64)
+    return SurveyColumns(fids, *values.T), [feature.geometry() for feature in features]
@@ -1,13 +1,70 @@
-from qgis.PyQt.QtWidgets import QDialog, QVBoxLayout, QLabel, QPushButton, QComboBox, QLineEdit, QMessageBox, QProgressBar, QRadioButton, QButtonGroup, QCheckBox
-from qgis.core import QgsProject, QgsVectorLayer, QgsField, QgsWkbTypes, edit
-from qgis.PyQt.QtCore import QVariant, Qt
-import pandas as pd
-import numpy as np
 import time
-from scipy.optimize import lsq_linear
-from sklearn.linear_model import LinearRegression
-from datetime import datetime
-import os
+from dataclasses import replace
+
+from qgis.PyQt.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QComboBox, QLineEdit, QMessageBox, QProgressBar,
+    QRadioButton, QButtonGroup, QCheckBox, QTableWidget, QTableWidgetItem, QAbstractItemView, QDoubleSpinBox,
+    QListWidget, QListWidgetItem,
+)
+from qgis.core import QgsApplication, QgsProject, QgsVectorLayer, QgsWkbTypes
+from qgis.PyQt.QtCore import Qt
+from .engine import MODE_MANUAL, MODE_OPTIMIZED, MODE_REGIONAL, HardnessParameters
+from .processing_log import LEVEL_NAMES, PHASE
+from .cache import FitCache, output_stem
+from .preview import PREVIEW_SAMPLE_SIZE, HardnessPreview, create_preview_layer
+from .sweep import comparison_table, parse_bounds, parse_percentile_pairs, sweep_configs
+from .task import BatchHardnessTask, HardnessTask, PreviewSampleTask, SweepTask, plugin_cache_dir
+
+
+class SweepResultsDialog(QDialog):
+    """Comparison table of a parameter sweep; exec_() is accepted when a configuration is chosen to apply"""
+
+    def __init__(self, results, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Parameter Sweep Results")
+        self.resize(900, 400)
+        self.results = results
+        self.selected = None
+
+        layout = QVBoxLayout()
+        table = comparison_table(results)
+        self.table = QTableWidget(len(table), len(table.columns))
+        self.table.setHorizontalHeaderLabels(list(table.columns))
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        for row, values in enumerate(table.itertuples(index=False)):
+            for column, value in enumerate(values):
+                text = f"{value:.4f}" if isinstance(value, float) else str(value)
+                self.table.setItem(row, column, QTableWidgetItem(text))
+        self.table.resizeColumnsToContents()
+        layout.addWidget(self.table)
+
+        buttons = QHBoxLayout()
+        self.apply_button = QPushButton("Apply Selected Configuration")
+        self.apply_button.setEnabled(False)
+        self.apply_button.clicked.connect(self.apply_selected)
+        self.close_button = QPushButton("Close")
+        self.close_button.clicked.connect(self.reject)
+        buttons.addWidget(self.apply_button)
+        buttons.addWidget(self.close_button)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+
+        self.table.itemSelectionChanged.connect(self.update_apply_button)
+
+    def selected_row(self):
+        rows = self.table.selectionModel().selectedRows()
+        return rows[0].row() if rows else None
+
+    def update_apply_button(self):
+        row = self.selected_row()
+        self.apply_button.setEnabled(row is not None and self.results[row].fit is not None)
+
+    def apply_selected(self):
+        self.selected = self.results[self.selected_row()]
+        self.accept()
+
 
 class HardnessDialog(QDialog):
     def __init__(self, iface):
@@ -45,15 +102,18 @@ class HardnessDialog(QDialog):
         self.mode_label = QLabel("Select Calculation Mode:")
         self.manual_mode = QRadioButton("Manual (User-defined k1, k2, k3)")
         self.optimized_mode = QRadioButton("Optimized (Regression-based)")
+        self.regional_mode = QRadioButton("Regional (Tiled regression, coefficients vary across the survey)")
         self.manual_mode.setChecked(True)
 
         self.mode_group = QButtonGroup()
         self.mode_group.addButton(self.manual_mode)
         self.mode_group.addButton(self.optimized_mode)
+        self.mode_group.addButton(self.regional_mode)
 
         layout.addWidget(self.mode_label)
         layout.addWidget(self.manual_mode)
         layout.addWidget(self.optimized_mode)
+        layout.addWidget(self.regional_mode)
 
         # Linearization option
         self.linearize_checkbox = QCheckBox("Use linearized E1/E2")
@@ -76,7 +136,7 @@ class HardnessDialog(QDialog):
         layout.addWidget(self.k3_input)
 
         # Percentile input for optimized mode
-        self.percentile_label = QLabel("Set Percentiles for Outlier Removal (Optimized Mode):")
+        self.percentile_label = QLabel("Set Percentiles for Outlier Removal (Optimized/Regional Mode):")
         self.percentile_lower_label = QLabel("Lower Percentile (%):")
         self.percentile_lower_input = QLineEdit("5")
         self.percentile_upper_label = QLabel("Upper Percentile (%):")
@@ -88,11 +148,169 @@ class HardnessDialog(QDialog):
         layout.addWidget(self.percentile_upper_label)
         layout.addWidget(self.percentile_upper_input)
 
+        # Percentile estimation: exact quantiles, or the streaming quantile sketch in constant memory
+        self.exact_percentiles_checkbox = QCheckBox("Exact percentiles (memory grows with the layer; off: quantile sketch)")
+        self.exact_percentiles_checkbox.setChecked(True)
+        self.quantile_error_label = QLabel("Percentile sketch rank error (%):")
+        self.quantile_error_input = QLineEdit("0.1")
+        layout.addWidget(self.exact_percentiles_checkbox)
+        layout.addWidget(self.quantile_error_label)
+        layout.addWidget(self.quantile_error_input)
+        self.exact_percentiles_checkbox.toggled.connect(self.update_ui_mode)
+
+        # Bootstrap intervals and cross-validation of the optimized fit
+        self.validation_checkbox = QCheckBox("Bootstrap confidence intervals and cross-validated R²")
+        self.bootstrap_label = QLabel("Bootstrap resamples:")
+        self.bootstrap_input = QLineEdit("1000")
+        self.folds_label = QLabel("Cross-validation folds:")
+        self.folds_input = QLineEdit("5")
+        self.interval_level_label = QLabel("Interval level (%):")
+        self.interval_level_input = QLineEdit("95")
+        self.max_interval_label = QLabel("Set Confidence to Low where the hardness interval exceeds (% of hardness, 0 = off):")
+        self.max_interval_input = QLineEdit("0")
+        layout.addWidget(self.validation_checkbox)
+        for widget in self.validation_widgets():
+            layout.addWidget(widget)
+        self.validation_checkbox.toggled.connect(self.update_ui_mode)
+
+        # Tile grid of regional mode
+        self.tile_size_label = QLabel("Tile size (layer units, 0 = automatic):")
+        self.tile_size_input = QLineEdit("0")
+        self.min_tile_samples_label = QLabel("Minimum samples per tile:")
+        self.min_tile_samples_input = QLineEdit("200")
+        self.borrow_rings_label = QLabel("Neighbour rings to borrow samples from:")
+        self.borrow_rings_input = QLineEdit("2")
+        for widget in (self.tile_size_label, self.tile_size_input, self.min_tile_samples_label,
+                       self.min_tile_samples_input, self.borrow_rings_label, self.borrow_rings_input):
+            layout.addWidget(widget)
+
+        # Persistent cache of fitted coefficients
+        self.cache_checkbox = QCheckBox("Reuse cached fit when the layer is unchanged")
+        self.cache_checkbox.setChecked(True)
+        layout.addWidget(self.cache_checkbox)
+
+        # Streaming mode for layers that do not fit in memory
+        self.streaming_checkbox = QCheckBox("Streaming mode (constant memory, for very large layers)")
+        self.chunk_size_label = QLabel("Chunk size (features):")
+        self.chunk_size_input = QLineEdit("100000")
+        layout.addWidget(self.streaming_checkbox)
+        layout.addWidget(self.chunk_size_label)
+        layout.addWidget(self.chunk_size_input)
+        self.streaming_checkbox.toggled.connect(self.update_streaming_options)
+        self.update_streaming_options()
+
+        # Batched write-back
+        self.write_batch_label = QLabel("Write batch size (features):")
+        self.write_batch_input = QLineEdit("50000")
+        self.coded_confidence_checkbox = QCheckBox("Write Confidence as an integer code (1 = High, 0 = Low)")
+        layout.addWidget(self.write_batch_label)
+        layout.addWidget(self.write_batch_input)
+        layout.addWidget(self.coded_confidence_checkbox)
+
+        # Hardness raster next to the layer
+        self.grid_checkbox = QCheckBox("Write a hardness grid (GeoTIFF) next to the layer")
+        self.grid_cell_size_label = QLabel("Grid cell size (layer units, 0 = automatic):")
+        self.grid_cell_size_input = QLineEdit("0")
+        self.grid_median_checkbox = QCheckBox("Add a median band (memory grows with the layer)")
+        self.grid_idw_checkbox = QCheckBox("Add an inverse distance weighted band")
+        self.idw_neighbors_label = QLabel("IDW neighbours:")
+        self.idw_neighbors_input = QLineEdit("8")
+        self.idw_power_label = QLabel("IDW power:")
+        self.idw_power_input = QLineEdit("2")
+        self.idw_radius_label = QLabel("IDW search radius (layer units, 0 = 5 cells):")
+        self.idw_radius_input = QLineEdit("0")
+        layout.addWidget(self.grid_checkbox)
+        for widget in self.grid_widgets():
+            layout.addWidget(widget)
+        self.grid_checkbox.toggled.connect(self.update_grid_options)
+        self.grid_idw_checkbox.toggled.connect(self.update_grid_options)
+        self.update_grid_options()
+
+        # Incremental update of the fields written by the last run
+        self.incremental_checkbox = QCheckBox("Incremental: update the last Hardness/Confidence fields for new or edited features only")
+        self.incremental_checkbox.setToolTip("Uses the coefficients and linearization recorded by the last full run on this layer.")
+        layout.addWidget(self.incremental_checkbox)
+
+        # Processing log verbosity
+        self.log_level_label = QLabel("Processing log level:")
+        self.log_level_combo = QComboBox()
+        for level, name in LEVEL_NAMES.items():
+            self.log_level_combo.addItem(name, level)
+        self.log_level_combo.setCurrentIndex(self.log_level_combo.findData(PHASE))
+        layout.addWidget(self.log_level_label)
+        layout.addWidget(self.log_level_combo)
+        self.profile_checkbox = QCheckBox("Save a cProfile profile of the run next to the layer")
+        layout.addWidget(self.profile_checkbox)
+
         # Calculate button
         self.calculate_button = QPushButton("Calculate Hardness")
         self.calculate_button.clicked.connect(self.calculate_hardness)
         layout.addWidget(self.calculate_button)
 
+        # Cancel button for the running background task
+        self.task = None
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_calculation)
+        layout.addWidget(self.cancel_button)
+
+        # Batch: several layers (e.g. survey lines) with one set of coefficients
+        self.batch_label = QLabel("Batch: layers to calculate together with one pooled fit (same field names):")
+        self.batch_list = QListWidget()
+        for layer in QgsProject.instance().mapLayers().values():
+            if isinstance(layer, QgsVectorLayer) and layer.geometryType() == QgsWkbTypes.PointGeometry:
+                item = QListWidgetItem(layer.name())
+                item.setData(Qt.UserRole, layer.id())
+                item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+                item.setCheckState(Qt.Unchecked)
+                self.batch_list.addItem(item)
+        self.batch_button = QPushButton("Calculate Checked Layers")
+        self.batch_button.clicked.connect(self.calculate_batch)
+        for widget in (self.batch_label, self.batch_list, self.batch_button):
+            layout.addWidget(widget)
+
+        # Parameter sweep: fit several configurations on one read and compare them
+        self.sweep_percentiles_label = QLabel("Sweep percentile pairs (lower-upper %, comma separated):")
+        self.sweep_percentiles_input = QLineEdit("5-95, 2.5-97.5, 1-99")
+        self.sweep_linearize_checkbox = QCheckBox("Sweep both standard and linearized E1/E2")
+        self.sweep_linearize_checkbox.setChecked(True)
+        self.sweep_bounds_label = QLabel("Additional k bounds (k1min k1max k2min k2max k3min k3max; ...):")
+        self.sweep_bounds_input = QLineEdit()
+        self.sweep_button = QPushButton("Run Parameter Sweep")
+        self.sweep_button.clicked.connect(self.run_parameter_sweep)
+        for widget in (self.sweep_percentiles_label, self.sweep_percentiles_input, self.sweep_linearize_checkbox,
+                       self.sweep_bounds_label, self.sweep_bounds_input, self.sweep_button):
+            layout.addWidget(widget)
+
+        # Live preview of manual coefficients on a sample held in memory
+        self.preview = None
+        self.preview_label = QLabel("Live preview of manual k1, k2, k3 on a sample (nothing is written):")
+        self.preview_size_label = QLabel("Sample size (features):")
+        self.preview_size_input = QLineEdit(str(PREVIEW_SAMPLE_SIZE))
+        self.preview_stratified_checkbox = QCheckBox("Spatially stratified sample")
+        self.preview_button = QPushButton("Load Preview Sample")
+        self.preview_button.clicked.connect(self.load_preview_sample)
+        self.preview_spins = []
+        for name in ("k1", "k2", "k3"):
+            spin = QDoubleSpinBox()
+            spin.setPrefix(f"{name} = ")
+            spin.setDecimals(4)
+            spin.setRange(0.0, 10.0)
+            spin.setSingleStep(0.01)
+            spin.setEnabled(False)
+            spin.valueChanged.connect(self.update_preview)
+            self.preview_spins.append(spin)
+        self.preview_summary = QLabel()
+        self.preview_summary.setWordWrap(True)
+        self.preview_apply_button = QPushButton("Calculate with Previewed Coefficients")
+        self.preview_apply_button.setEnabled(False)
+        self.preview_apply_button.clicked.connect(self.apply_preview)
+        for widget in (self.preview_label, self.preview_size_label, self.preview_size_input,
+                       self.preview_stratified_checkbox, self.preview_button, *self.preview_spins,
+                       self.preview_summary, self.preview_apply_button):
+            layout.addWidget(widget)
+        self.linearize_checkbox.stateChanged.connect(self.update_preview)
+
         # Output display
         self.result_label = QLabel("Results (k1, k2, k3):")
         self.result_field = QLineEdit()
@@ -110,6 +328,7 @@ class HardnessDialog(QDialog):
 
         # Connect mode change to UI updates
         self.manual_mode.toggled.connect(self.update_ui_mode)
+        self.optimized_mode.toggled.connect(self.update_ui_mode)
         self.update_ui_mode()
 
     def update_k2_bounds_and_label(self):
@@ -124,6 +343,30 @@ class HardnessDialog(QDialog):
                 self.k2_input.setText("0.5")
 
 
+    def validation_widgets(self):
+        return (self.bootstrap_label, self.bootstrap_input, self.folds_label, self.folds_input,
+                self.interval_level_label, self.interval_level_input, self.max_interval_label, self.max_interval_input)
+
+    def update_streaming_options(self):
+        is_streaming = self.streaming_checkbox.isChecked()
+        self.chunk_size_label.setEnabled(is_streaming)
+        self.chunk_size_input.setEnabled(is_streaming)
+        # Exact percentiles keep every value; streaming suggests the constant-memory sketch
+        self.exact_percentiles_checkbox.setChecked(not is_streaming)
+
+    def grid_widgets(self):
+        return (self.grid_cell_size_label, self.grid_cell_size_input, self.grid_median_checkbox, self.grid_idw_checkbox,
+                self.idw_neighbors_label, self.idw_neighbors_input, self.idw_power_label, self.idw_power_input,
+                self.idw_radius_label, self.idw_radius_input)
+
+    def update_grid_options(self):
+        is_grid = self.grid_checkbox.isChecked()
+        is_idw = is_grid and self.grid_idw_checkbox.isChecked()
+        for widget in self.grid_widgets()[:4]:
+            widget.setEnabled(is_grid)
+        for widget in self.grid_widgets()[4:]:
+            widget.setEnabled(is_idw)
+
     def update_field_combos(self):
         # Resolve layer by name safely
         layer_name = (self.layer_combo.currentText() or "").strip()
@@ -172,309 +415,359 @@ class HardnessDialog(QDialog):
         self.k3_label.setEnabled(is_manual)
         self.k3_input.setEnabled(is_manual)
 
-        # Enable/disable optimized mode percentiles
-        is_optimized = self.optimized_mode.isChecked()
-        self.percentile_label.setEnabled(is_optimized)
-        self.percentile_lower_label.setEnabled(is_optimized)
-        self.percentile_lower_input.setEnabled(is_optimized)
-        self.percentile_upper_label.setEnabled(is_optimized)
-        self.percentile_upper_input.setEnabled(is_optimized)
-
-    def normalize_data(self, data):
-        """Normalize data to range [0,1] using min-max scaling"""
-        return (data - data.min()) / (data.max() - data.min())
+        # Enable/disable percentiles of the fitted (optimized and regional) modes
+        is_fitted = not is_manual
+        self.percentile_label.setEnabled(is_fitted)
+        self.percentile_lower_label.setEnabled(is_fitted)
+        self.percentile_lower_input.setEnabled(is_fitted)
+        self.percentile_upper_label.setEnabled(is_fitted)
+        self.percentile_upper_input.setEnabled(is_fitted)
+        self.exact_percentiles_checkbox.setEnabled(is_fitted)
+        self.cache_checkbox.setEnabled(self.optimized_mode.isChecked())
+        self.validation_checkbox.setEnabled(self.optimized_mode.isChecked())
+        for widget in self.validation_widgets():
+            widget.setEnabled(self.optimized_mode.isChecked() and self.validation_checkbox.isChecked())
+        use_sketch = is_fitted and not self.exact_percentiles_checkbox.isChecked()
+        self.quantile_error_label.setEnabled(use_sketch)
+        self.quantile_error_input.setEnabled(use_sketch)
+
+        # Enable/disable the tile grid settings
+        is_regional = self.regional_mode.isChecked()
+        for widget in (self.tile_size_label, self.tile_size_input, self.min_tile_samples_label,
+                       self.min_tile_samples_input, self.borrow_rings_label, self.borrow_rings_input):
+            widget.setEnabled(is_regional)
+
+    def collect_parameters(self):
+        """Build HardnessParameters from the dialog widgets (raises ValueError on invalid input)"""
+        params = HardnessParameters(
+            field_names={key: combo.currentText() for key, combo in self.field_combos.items()},
+            mode=MODE_MANUAL if self.manual_mode.isChecked() else MODE_REGIONAL if self.regional_mode.isChecked() else MODE_OPTIMIZED,
+            linearize=self.linearize_checkbox.isChecked(),
+            streaming=self.streaming_checkbox.isChecked(),
+            incremental=self.incremental_checkbox.isChecked(),
+            coded_confidence=self.coded_confidence_checkbox.isChecked(),
+            profile=self.profile_checkbox.isChecked(),
+        )
+        try:
+            params.write_batch_size = int(self.write_batch_input.text())
+        except ValueError:
+            raise ValueError("Please enter a whole number of features for the write batch size.")
+        if params.streaming:
+            try:
+                params.chunk_size = int(self.chunk_size_input.text())
+            except ValueError:
+                raise ValueError("Please enter a whole number of features for the chunk size.")
+        if params.mode == MODE_MANUAL:
+            try:
+                params.k1 = float(self.k1_input.text())
+                params.k2 = float(self.k2_input.text())
+                params.k3 = float(self.k3_input.text())
+            except ValueError:
+                raise ValueError("Please enter valid numeric values for k1, k2, and k3.")
+        else:
+            try:
+                params.lower_percentile = float(self.percentile_lower_input.text()) / 100
+                params.upper_percentile = float(self.percentile_upper_input.text()) / 100
+            except ValueError:
+                raise ValueError("Please enter valid numeric values for the percentiles.")
+            params.exact_quantiles = self.exact_percentiles_checkbox.isChecked()
+            if not params.exact_quantiles:
+                try:
+                    params.quantile_error = float(self.quantile_error_input.text()) / 100
+                except ValueError:
+                    raise ValueError("Please enter a valid numeric value for the percentile sketch error.")
+        if params.mode == MODE_OPTIMIZED and self.validation_checkbox.isChecked():
+            params.validation = True
+            try:
+                params.bootstrap_samples = int(self.bootstrap_input.text())
+                params.folds = int(self.folds_input.text())
+                params.interval_level = float(self.interval_level_input.text()) / 100
+                params.max_relative_interval = float(self.max_interval_input.text()) / 100
+            except ValueError:
+                raise ValueError("Please enter valid numeric values for the validation settings.")
+        if params.mode == MODE_REGIONAL:
+            try:
+                params.tile_size = float(self.tile_size_input.text())
+                params.min_tile_samples = int(self.min_tile_samples_input.text())
+                params.borrow_rings = int(self.borrow_rings_input.text())
+            except ValueError:
+                raise ValueError("Please enter valid numeric values for the tile grid settings.")
+        if self.grid_checkbox.isChecked():
+            params.grid = True
+            params.grid_median = self.grid_median_checkbox.isChecked()
+            params.grid_idw = self.grid_idw_checkbox.isChecked()
+            try:
+                params.grid_cell_size = float(self.grid_cell_size_input.text())
+                if params.grid_idw:
+                    params.idw_neighbors = int(self.idw_neighbors_input.text())
+                    params.idw_power = float(self.idw_power_input.text())
+                    params.idw_radius = float(self.idw_radius_input.text())
+            except ValueError:
+                raise ValueError("Please enter valid numeric values for the hardness grid settings.")
+        params.validate()
+        return params
 
-    def write_to_log(self, log_path, content):
-        """Write content to log file with timestamp"""
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        with open(log_path, 'a', encoding='utf-8') as f:
-            f.write(f"[{timestamp}] {content}\n")
+    def selected_layer(self):
+        """The layer chosen in the layer combo, or None after warning the user"""
+        layers = QgsProject.instance().mapLayersByName(self.layer_combo.currentText())
+        if not layers:
+            QMessageBox.warning(self, "Error", "Please select a layer.")
+            return None
+        return layers[0]
+
+    def start_task(self, task):
+        """Run a HardnessTask or SweepTask in the background, tracking its progress"""
+        self.task = task
+        self.task.progressChanged.connect(lambda progress: self.progress_bar.setValue(int(progress)))
+        self.progress_bar.setValue(0)
+        self.calculate_button.setEnabled(False)
+        self.batch_button.setEnabled(False)
+        self.sweep_button.setEnabled(False)
+        self.preview_button.setEnabled(False)
+        self.preview_apply_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        QgsApplication.taskManager().addTask(self.task)
+
+    def task_done(self):
+        self.task = None
+        self.calculate_button.setEnabled(True)
+        self.batch_button.setEnabled(True)
+        self.sweep_button.setEnabled(True)
+        self.preview_button.setEnabled(True)
+        self.preview_apply_button.setEnabled(self.preview is not None)
+        self.cancel_button.setEnabled(False)
 
     def calculate_hardness(self):
         # Retrieve layer and field selections
-        layer_name = self.layer_combo.currentText()
-        layer = QgsProject.instance().mapLayersByName(layer_name)[0]
-        
-        # Get layer path and create log path
-        layer_path = layer.source()
-        log_path = layer_path.replace('.shp', '_hardness_processing.txt')
-        
-        # Initialize log file with header
-        with open(log_path, 'w', encoding='utf-8') as f:
-            f.write(f"Hardness Calculator Processing Log\n")
-            f.write(f"===================================\n\n")
-
-        # Log basic information
-        self.write_to_log(log_path, f"Processing layer: {layer_name}")
-        self.write_to_log(log_path, f"Layer path: {layer_path}")
-        self.write_to_log(log_path, f"Linearization: {'Enabled' if self.linearize_checkbox.isChecked() else 'Disabled'}")
+        layer = self.selected_layer()
+        if layer is None:
+            return
 
-        field_names = {key: combo.currentText() for key, combo in self.field_combos.items()}
-        self.write_to_log(log_path, f"Selected fields:")
-        for key, value in field_names.items():
-            self.write_to_log(log_path, f"  {key}: {value}")
+        try:
+            params = self.collect_parameters()
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
 
-        # Extract data from layer
-        data = []
-        features = list(layer.getFeatures())
-        total_features = len(features)
-        self.write_to_log(log_path, f"\nTotal features in layer: {total_features}")
+        # Run extraction, fitting and writing in the background
+        cache = FitCache(plugin_cache_dir()) if self.cache_checkbox.isChecked() and params.mode == MODE_OPTIMIZED else None
+        self.start_task(HardnessTask(layer, params, self.log_level_combo.currentData(), self.calculation_finished, cache))
+
+    def checked_batch_layers(self):
+        """Layers checked in the batch list that are still in the project"""
+        project = QgsProject.instance()
+        layers = []
+        for row in range(self.batch_list.count()):
+            item = self.batch_list.item(row)
+            layer = project.mapLayer(item.data(Qt.UserRole))
+            if item.checkState() == Qt.Checked and layer is not None:
+                layers.append(layer)
+        return layers
+
+    def calculate_batch(self):
+        layers = self.checked_batch_layers()
+        if len(layers) < 2:
+            QMessageBox.warning(self, "Error", "Please check at least two layers for the batch.")
+            return
 
-        use_linearized = self.linearize_checkbox.isChecked()
+        try:
+            params = self.collect_parameters()
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
+        if params.mode == MODE_REGIONAL:
+            QMessageBox.warning(self, "Error", "Regional Mode is not available for batches. Use Manual or Optimized Mode.")
+            return
+        missing = [layer.name() for layer in layers
+                   if any(layer.fields().indexOf(name) < 0 for name in params.field_names.values())]
+        if missing:
+            QMessageBox.warning(self, "Error", f"The selected E1/E2/PeakSV/Depth fields do not exist in: {', '.join(missing)}")
+            return
+        # Layers of one GeoPackage are distinct, but two entries of one layer would share their logs and grid
+        if len({output_stem(layer.source()) for layer in layers}) < len(layers):
+            QMessageBox.warning(self, "Error", "The same data source is checked more than once.")
+            return
 
-        for index, feature in enumerate(features):
-            try:
-                e1 = float(feature[field_names["E1"]])
-                e2 = float(feature[field_names["E2"]])
-                peak_sv = float(feature[field_names["PeakSV"]])
-                depth = float(feature[field_names["Depth"]])
-
-                if e1 > 0 and peak_sv > 0:
-                    if use_linearized:
-                        e1_e2_ratio = np.power(10, (e1 - e2) / 10) if e2 > 0 else None
-                    else:
-                        e1_e2_ratio = e1 / e2 if e2 > 0 else None
-                    
-                    if e1_e2_ratio is not None:
-                        data.append([e1, e1_e2_ratio, peak_sv, depth])
-            except (ValueError, KeyError):
-                continue
-
-            progress = int((index + 1) / total_features * 100)
-            self.progress_bar.setValue(progress)
-            time.sleep(0.001)
-
-        if not data:
-            QMessageBox.warning(self, "Error", "No valid data found in the selected fields.")
+        self.start_task(BatchHardnessTask(layers, params, self.log_level_combo.currentData(), self.batch_finished))
+
+    def batch_finished(self, task, result):
+        self.task_done()
+        if result:
+            k1, k2, k3 = task.coefficients
+            kind = "Pooled" if task.fit is not None else "Manual"
+            self.result_field.setText(f"{kind} k1: {k1:.4f}, k2: {k2:.4f}, k3: {k3:.4f} ({len(task.members)} layers)")
+            self.progress_bar.setValue(100)
+            reports = [f"{member.layer_name}: {member.write_report}" for member in task.members if member.write_failed]
+            if reports:
+                QMessageBox.warning(self, "Warning", "Some changes could not be applied:\n" + "\n".join(reports))
+            else:
+                QMessageBox.information(self, "Success", f"Hardness calculated for {len(task.members)} layers. "
+                                        f"See {task.log_path} for the combined log.")
+        elif task.error:
+            self.progress_bar.setValue(0)
+            QMessageBox.warning(self, "Error", task.error)
+        else:
+            self.progress_bar.setValue(0)
+            QMessageBox.information(self, "Canceled", "Batch calculation was canceled. Layers finished before the cancel "
+                                    "keep their results; the others were not modified.")
+
+    def run_parameter_sweep(self):
+        layer = self.selected_layer()
+        if layer is None:
             return
 
-        df = pd.DataFrame(data, columns=["E1", "E1_E2_ratio", "PeakSV", "Depth"])
-        self.write_to_log(log_path, f"Valid features for processing: {len(df)}")
+        try:
+            params = self.collect_parameters()
+            configs = sweep_configs([False, True] if self.sweep_linearize_checkbox.isChecked() else [params.linearize],
+                                    parse_percentile_pairs(self.sweep_percentiles_input.text()),
+                                    parse_bounds(self.sweep_bounds_input.text()))
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
+
+        self.start_task(SweepTask(layer, params, configs, self.log_level_combo.currentData(), self.sweep_finished))
+
+    def sweep_finished(self, task, result):
+        self.task_done()
+        if not result:
+            self.progress_bar.setValue(0)
+            if task.error:
+                QMessageBox.warning(self, "Error", task.error)
+            else:
+                QMessageBox.information(self, "Canceled", "Parameter sweep was canceled.")
+            return
+
+        self.progress_bar.setValue(100)
+        dialog = SweepResultsDialog(task.results, self)
+        if not dialog.exec_() or dialog.selected is None:
+            return
+
+        # Show the chosen configuration in the dialog and write it with the fit from the sweep
+        config = dialog.selected.config
+        self.optimized_mode.setChecked(True)
+        self.linearize_checkbox.setChecked(config.linearize)
+        self.percentile_lower_input.setText(f"{config.lower_percentile * 100:g}")
+        self.percentile_upper_input.setText(f"{config.upper_percentile * 100:g}")
+        self.exact_percentiles_checkbox.setChecked(True)
+        self.validation_checkbox.setChecked(False)
+        self.incremental_checkbox.setChecked(False)
+        layer = self.selected_layer()
+        if layer is None:
+            return
+        params = replace(config.parameters(task.params), validation=False, incremental=False)
+        self.start_task(HardnessTask(layer, params, self.log_level_combo.currentData(), self.calculation_finished,
+                                     fit=dialog.selected.fit))
 
-        if self.manual_mode.isChecked():
+    def load_preview_sample(self):
+        layer = self.selected_layer()
+        if layer is None:
+            return
+        try:
+            size = int(self.preview_size_input.text())
+        except ValueError:
+            size = 0
+        if size <= 0:
+            QMessageBox.warning(self, "Error", "Please enter a positive whole number of features for the sample size.")
+            return
+
+        field_names = {key: combo.currentText() for key, combo in self.field_combos.items()}
+        self.start_task(PreviewSampleTask(layer, field_names, size, self.preview_stratified_checkbox.isChecked(),
+                                          self.preview_sample_loaded))
+
+    def preview_sample_loaded(self, task, result):
+        if not result:
+            self.task_done()
+            self.progress_bar.setValue(0)
+            if task.error:
+                QMessageBox.warning(self, "Error", task.error)
+            return
+
+        # Replace any earlier preview layer; the sample is shown on top of the source layer
+        self.remove_preview()
+        preview_layer = create_preview_layer(task.layer, task.columns, task.geometries)
+        QgsProject.instance().addMapLayer(preview_layer)
+        self.preview = HardnessPreview(preview_layer, task.columns)
+        self.task_done()
+        self.progress_bar.setValue(100)
+
+        for spin, k_input in zip(self.preview_spins, (self.k1_input, self.k2_input, self.k3_input)):
+            spin.blockSignals(True)
             try:
-                k1 = float(self.k1_input.text())
-                k2 = float(self.k2_input.text())
-                k3 = float(self.k3_input.text())
-                
-                self.write_to_log(log_path, "\nManual Mode Selected")
-                self.write_to_log(log_path, f"User defined parameters:")
-                self.write_to_log(log_path, f"  k1: {k1:.4f}")
-                self.write_to_log(log_path, f"  k2: {k2:.4f}")
-                self.write_to_log(log_path, f"  k3: {k3:.4f}")
-                
+                spin.setValue(float(k_input.text()))
             except ValueError:
-                QMessageBox.warning(self, "Error", "Please enter valid numeric values for k1, k2, and k3.")
-                return
+                pass
+            spin.blockSignals(False)
+            spin.setEnabled(True)
+        self.update_preview()
+
+    def update_preview(self):
+        """Re-evaluate the sample and the preview symbology for the current spin box values"""
+        if self.preview is not None and QgsProject.instance().mapLayer(self.preview.layer_id) is None:
+            self.remove_preview()  # the preview layer was removed from the project
+        if self.preview is None:
+            return
+        start = time.perf_counter()
+        self.preview.update(*(spin.value() for spin in self.preview_spins), self.linearize_checkbox.isChecked())
+        self.preview_summary.setText(f"{self.preview.describe()} (updated in {(time.perf_counter() - start) * 1000:.0f} ms)")
 
-        elif self.optimized_mode.isChecked():
-            try:
-                self.write_to_log(log_path, "\nOptimized Mode Selected")
-                
-                lower_percentile = float(self.percentile_lower_input.text()) / 100
-                upper_percentile = float(self.percentile_upper_input.text()) / 100
-                
-                self.write_to_log(log_path, f"Percentile settings:")
-                self.write_to_log(log_path, f"  Lower: {lower_percentile*100}%")
-                self.write_to_log(log_path, f"  Upper: {upper_percentile*100}%")
-
-                if not (0 <= lower_percentile < upper_percentile <= 1):
-                    QMessageBox.warning(self, "Error", "Percentiles must be between 0 and 100, with lower < upper.")
-                    return
-
-                # Remove outliers
-                Q_low = df.quantile(lower_percentile)
-                Q_high = df.quantile(upper_percentile)
-                df_filtered = df[(df >= Q_low) & (df <= Q_high)].dropna()
-                
-                self.write_to_log(log_path, f"\nData points after outlier removal: {len(df_filtered)}")
-                self.write_to_log(log_path, f"Outliers removed: {len(df) - len(df_filtered)}")
-
-                # Correlation matrix
-                correlation_matrix = df_filtered[['E1', 'E1_E2_ratio', 'PeakSV', 'Depth']].corr()
-                self.write_to_log(log_path, f"\nCorrelation Matrix:")
-                self.write_to_log(log_path, f"{correlation_matrix.round(3).to_string()}")
-
-                # Normalize variables for regression
-                X_e1 = self.normalize_data(df_filtered["E1"])
-                X_ratio = self.normalize_data(df_filtered["E1_E2_ratio"]).fillna(0)
-                X_peak = self.normalize_data(df_filtered["PeakSV"])
-                y_normalized = self.normalize_data(df_filtered["Depth"])
-
-                X_normalized = pd.concat([X_e1, X_ratio, X_peak], axis=1).to_numpy()
-
-                # Unbounded regression
-                reg = LinearRegression()
-                reg.fit(X_normalized, y_normalized)
-                unbounded_k1, unbounded_k2, unbounded_k3 = reg.coef_
-                
-                self.write_to_log(log_path, f"\nUnbounded Regression Results:")
-                self.write_to_log(log_path, f"  k1: {unbounded_k1:.4f}")
-                self.write_to_log(log_path, f"  k2: {unbounded_k2:.4f}")
-                self.write_to_log(log_path, f"  k3: {unbounded_k3:.4f}")
-                self.write_to_log(log_path, f"  Intercept: {reg.intercept_:.4f}")
-
-                # Bounded regression
-                if self.linearize_checkbox.isChecked():
-                    bounds_low = [0.5, 0.01, 0.2]
-                    bounds_high = [1.5, 0.05, 0.5]
-                else:
-                    bounds_low = [0.5, 0.1, 0.2]
-                    bounds_high = [1.5, 0.7, 0.5]
-
-                result = lsq_linear(X_normalized, y_normalized, bounds=(bounds_low, bounds_high))
-                k1, k2, k3 = result.x
-                
-                self.write_to_log(log_path, f"\nBounded Regression Results (Final Parameters):")
-                self.write_to_log(log_path, f"  k1: {k1:.4f}")
-                self.write_to_log(log_path, f"  k2: {k2:.4f}")
-                self.write_to_log(log_path, f"  k3: {k3:.4f}")
-
-            except Exception as e:
-                QMessageBox.warning(self, "Error", f"An error occurred during regression: {e}")
-                return
-
-        # Write results back to the layer
-        with edit(layer):
-            existing_fields = [field.name() for field in layer.fields()]
-            hardness_field_name = "Hardness"
-            confidence_field_name = "Confidence"
-
-            counter = 1
-            while hardness_field_name in existing_fields:
-                hardness_field_name = f"Hardness_{counter}"
-                counter += 1
-
-            counter = 1
-            while confidence_field_name in existing_fields:
-                confidence_field_name = f"Confidence_{counter}"
-                counter += 1
-
-            self.write_to_log(log_path, f"\nCreated fields:")
-            self.write_to_log(log_path, f"  Hardness field: {hardness_field_name}")
-            self.write_to_log(log_path, f"  Confidence field: {confidence_field_name}")
-
-            # Adiciona os novos campos
-            layer.dataProvider().addAttributes([
-                QgsField(hardness_field_name, QVariant.Double),
-                QgsField(confidence_field_name, QVariant.String),
-            ])
-            layer.updateFields()
-
-            # Obtém os índices dos campos
-            hardness_idx = layer.fields().indexOf(hardness_field_name)
-            confidence_idx = layer.fields().indexOf(confidence_field_name)
-
-            # Dicionário para armazenar todas as mudanças
-            changes_dict = {}
-                        
-            # Prepara a barra de progresso para a fase de cálculo
-            total_features = layer.featureCount()
-            self.write_to_log(log_path, f"\nStarting hardness calculation for {total_features} features")
-            
-            # Contador para atualização da barra de progresso
-            feature_count = 0
-            update_interval = max(1, min(1000, total_features // 100))  # Atualiza a cada 1% ou 1000 features
-
-            # Debug: Imprime os valores de k antes do loop
-            self.write_to_log(log_path, f"\nDebug - Using k values in calculation:")
-            self.write_to_log(log_path, f"k1: {k1}, k2: {k2}, k3: {k3}")
-
-            use_linearized = self.linearize_checkbox.isChecked()
-
-            for feature in layer.getFeatures():
-                try:
-                    # Use valores originais (não normalizados) da tabela
-                    e1 = float(feature[field_names["E1"]])
-                    e2 = float(feature[field_names["E2"]])
-                    peak_sv = float(feature[field_names["PeakSV"]])
-
-                    # Debug: Imprime valores de entrada
-                    self.write_to_log(log_path, f"\nDebug - Feature {feature.id()}:")
-                    self.write_to_log(log_path, f"Input values - e1: {e1}, e2: {e2}, peak_sv: {peak_sv}")
-
-                    if e1 > 0 and peak_sv > 0:
-                        if e2 > 0:
-                            if use_linearized:
-                                # Fórmula linearizada
-                                e1_e2_term = np.power(10, (e1 - e2) / 10)
-                                self.write_to_log(log_path, f"Debug - Using linearized formula with 10^((E1-E2)/10)")
-                            else:
-                                # Fórmula original
-                                e1_e2_term = e1 / e2
-                                self.write_to_log(log_path, f"Debug - Using original formula with E1/E2")
-
-                            hardness = k1 * e1 + k2 * e1_e2_term + k3 * peak_sv
-                            self.write_to_log(log_path, f"Debug - Full formula result: {hardness}")
-                            confidence = "High"
-                        else:
-                            # Fórmula simplificada com valores originais
-                            hardness = k1 * e1 + k3 * peak_sv
-                            self.write_to_log(log_path, f"Debug - Simplified formula: {k1} * {e1} + {k3} * {peak_sv} = {hardness}")
-                            confidence = "Low"
-
-                        # Verificação e conversão do valor de hardness
-                        if hardness is not None:
-                            try:
-                                hardness = float(hardness)
-                                if not np.isfinite(hardness):  # Verifica se não é inf ou nan
-                                    self.write_to_log(log_path, f"Debug - Invalid hardness value (inf/nan) for feature {feature.id()}")
-                                    hardness = None
-                                else:
-                                    self.write_to_log(log_path, f"Debug - Valid hardness value: {hardness}")
-                            except (ValueError, TypeError) as e:
-                                self.write_to_log(log_path, f"Debug - Could not convert hardness to float for feature {feature.id()}: {e}")
-                                hardness = None
-                    else:
-                        hardness = None
-                        confidence = None
-                        self.write_to_log(log_path, f"Debug - Invalid input values, setting NULL")
-
-                    # Debug: Verifica os valores antes de armazenar
-                    self.write_to_log(log_path, f"Debug - Pre-storage check - hardness type: {type(hardness)}, value: {hardness}")
-
-                    # Armazena as mudanças no dicionário
-                    changes_dict[feature.id()] = {
-                        hardness_idx: hardness,
-                        confidence_idx: confidence
-                    }
-
-                    # Debug: Confirma o armazenamento no dicionário
-                    self.write_to_log(log_path, f"Debug - Stored in changes_dict - feature_id: {feature.id()}, values: {changes_dict[feature.id()]}")
-
-                    # Atualiza o progresso periodicamente
-                    feature_count += 1
-                    if feature_count % update_interval == 0:
-                        progress = (feature_count / total_features) * 100
-                        self.progress_bar.setValue(int(progress))
-                        self.write_to_log(log_path, f"Progress: {progress:.1f}% ({feature_count}/{total_features} features)")
-
-                except (ValueError, KeyError) as e:
-                    self.write_to_log(log_path, f"Warning: Error processing feature {feature.id()}: {str(e)}")
-                    continue
-
-            # Debug: Verifica o dicionário final
-            self.write_to_log(log_path, f"\nDebug - Final changes_dict size: {len(changes_dict)}")
-            self.write_to_log(log_path, f"Debug - Sample of final changes_dict (first 5 entries):")
-            sample_entries = list(changes_dict.items())[:5]
-            for feature_id, values in sample_entries:
-                self.write_to_log(log_path, f"Feature {feature_id}: {values}")
-
-            # Aplica todas as mudanças de uma vez
-            self.write_to_log(log_path, "\nApplying changes to layer...")
-            success = layer.dataProvider().changeAttributeValues(changes_dict)
-            
-            # Debug: Verifica o resultado da operação de escrita
-            self.write_to_log(log_path, f"Debug - Write operation success: {success}")
-
-            if not success:
-                self.write_to_log(log_path, "Warning: Some changes might not have been applied successfully")
-                QMessageBox.warning(self, "Warning", "Some changes might not have been applied successfully")
-            else:
-                self.write_to_log(log_path, "All changes applied successfully")
+    def apply_preview(self):
+        """Copy the previewed coefficients to the Manual inputs and run the real calculation"""
+        self.manual_mode.setChecked(True)
+        for spin, k_input in zip(self.preview_spins, (self.k1_input, self.k2_input, self.k3_input)):
+            k_input.setText(f"{spin.value():g}")
+        self.calculate_hardness()
 
-        self.result_field.setText(f"k1: {k1:.4f}, k2: {k2:.4f}, k3: {k3:.4f}")
-        QMessageBox.information(self, "Success", "Hardness calculation completed and updated in the layer.")
-        self.write_to_log(log_path, "\nProcessing completed successfully.")
-        
-        self.progress_bar.setValue(100)
\ No newline at end of file
+    def remove_preview(self):
+        if self.preview is None:
+            return
+        QgsProject.instance().removeMapLayer(self.preview.layer_id)
+        self.preview = None
+        self.preview_summary.clear()
+        self.preview_apply_button.setEnabled(False)
+        for spin in self.preview_spins:
+            spin.setEnabled(False)
+
+    def cancel_calculation(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def calculation_finished(self, task, result):
+        self.task_done()
+
+        if result:
+            k1, k2, k3 = task.coefficients
+            if task.regional is not None:
+                grid = task.regional.grid
+                self.result_field.setText(f"Global k1: {k1:.4f}, k2: {k2:.4f}, k3: {k3:.4f} "
+                                          f"({grid.nx} x {grid.ny} tiles, see the processing log)")
+            elif task.fit is not None and task.fit.validation is not None:
+                self.result_field.setText(task.fit.validation.describe(task.coefficients))
+            else:
+                self.result_field.setText(f"k1: {k1:.4f}, k2: {k2:.4f}, k3: {k3:.4f}")
+            self.progress_bar.setValue(100)
+            if task.write_failed:
+                QMessageBox.warning(self, "Warning", f"Some changes could not be applied: {task.write_report} "
+                                    "See the processing log for the failed batches.")
+            elif task.grid_error is not None:
+                QMessageBox.warning(self, "Warning", "Hardness calculation completed and updated in the layer, but the "
+                                    f"hardness grid could not be written: {task.grid_error}")
+            else:
+                grid = f" Hardness grid written to {task.grid_path}." if task.grid_path is not None else ""
+                QMessageBox.information(self, "Success", f"Hardness calculation completed and updated in the layer.{grid}")
+        elif task.error:
+            self.progress_bar.setValue(0)
+            QMessageBox.warning(self, "Error", task.error)
+        else:
+            self.progress_bar.setValue(0)
+            if task.params.incremental:
+                message = "Hardness update was canceled. Features updated so far keep their new values."
+            else:
+                message = "Hardness calculation was canceled. The layer was not modified."
+            QMessageBox.information(self, "Canceled", message)
+
+    def closeEvent(self, event):
+        # A running task keeps going in the task manager; it only needs this dialog for reporting
+        if self.task is not None:
+            self.task.on_finished = None
+        self.remove_preview()
+        super().closeEvent(event)
@@ -0,0 +1,174 @@
+import json
+import os
+from dataclasses import dataclass, replace
+
+import numpy as np
+from .cache import output_stem
+
+# Bump when the state file layout changes
+STATE_VERSION = 1
+
+# Digest recorded for rows whose results could not be written, so the next incremental run recomputes them
+UNWRITTEN_DIGEST = np.uint64(0)
+
+
+def state_path_for(layer_path):
+    """Path of the incremental-run state file next to the layer source"""
+    return f"{output_stem(layer_path)}_hardness_state.npz"
+
+
+@dataclass
+class RunState:
+    """What the last run wrote: its fields, coefficients and the inputs of every processed row.
+
+    fids are sorted; digests holds the input_digest() of each row at the
+    time it was written. validation is the ValidationResult whose bootstrap
+    intervals downgraded High confidence wider than max_relative_interval
+    of hardness, or None if the run applied no such rule.
+    """
+    hardness_field: str
+    confidence_field: str
+    coefficients: tuple
+    linearize: bool
+    field_names: dict
+    fids: np.ndarray
+    digests: np.ndarray
+    validation: object = None
+    max_relative_interval: float = 0.0
+
+    def _lookup(self, fids):
+        """Positions of fids in the recorded fids and the mask of those that are recorded"""
+        if len(self.fids) == 0:
+            return np.zeros(len(fids), dtype=np.intp), np.zeros(len(fids), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.fids, fids), len(self.fids) - 1)
+        return positions, self.fids[positions] == fids
+
+    def known(self, fids):
+        """Mask of rows recorded by the last run"""
+        return self._lookup(fids)[1]
+
+    def changed(self, fids, digests):
+        """Mask of rows that are new or whose inputs changed since the recorded run"""
+        if len(self.fids) == 0:
+            return np.ones(len(fids), dtype=bool)
+        positions, known = self._lookup(fids)
+        return ~known | (self.digests[positions] != digests)
+
+
+class StateRecorder:
+    """Row inputs of a run, appended chunk by chunk to temporary files next to the state file.
+
+    Memory stays bounded by the chunk size whatever the number of rows:
+    append() writes the fids and digests of every chunk straight to disk and
+    save() reads them back memory-mapped. Only if the chunks did not arrive
+    in ascending fid order are they loaded and sorted in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fids_path = f"{path}.fids.tmp"
+        self.digests_path = f"{path}.digests.tmp"
+        self.n = 0
+        self.ordered = True
+        self.last_fid = None
+        self.fids_file = open(self.fids_path, "wb")
+        try:
+            self.digests_file = open(self.digests_path, "wb")
+        except OSError:
+            self.fids_file.close()
+            os.remove(self.fids_path)
+            raise
+
+    def append(self, fids, digests):
+        fids = np.ascontiguousarray(fids, dtype=np.int64)
+        if len(fids) == 0:
+            return
+        if self.ordered and ((self.last_fid is not None and fids[0] <= self.last_fid) or np.any(fids[1:] <= fids[:-1])):
+            self.ordered = False
+        self.last_fid = fids[-1]
+        fids.tofile(self.fids_file)
+        np.ascontiguousarray(digests, dtype=np.uint64).tofile(self.digests_file)
+        self.n += len(fids)
+
+    def _close(self):
+        self.fids_file.close()
+        self.digests_file.close()
+
+    def _arrays(self):
+        """Recorded fids and digests, sorted by fid"""
+        if self.n == 0:
+            return np.empty(0, np.int64), np.empty(0, np.uint64)
+        if self.ordered:
+            return (np.memmap(self.fids_path, dtype=np.int64, mode="r", shape=(self.n,)),
+                    np.memmap(self.digests_path, dtype=np.uint64, mode="r+", shape=(self.n,)))
+        fids = np.fromfile(self.fids_path, dtype=np.int64)
+        order = np.argsort(fids, kind="stable")
+        return fids[order], np.fromfile(self.digests_path, dtype=np.uint64)[order]
+
+    def save(self, state, unwritten=()):
+        """Write state with the recorded rows as its fids and digests, then remove the temporary files.
+
+        Rows in unwritten (fids whose results could not be written) get
+        UNWRITTEN_DIGEST, so the next incremental run treats them as changed.
+        """
+        self._close()
+        try:
+            fids, digests = self._arrays()
+            if len(unwritten) and len(fids):
+                positions = np.minimum(np.searchsorted(fids, unwritten), len(fids) - 1)
+                digests[positions[fids[positions] == unwritten]] = UNWRITTEN_DIGEST
+            save_state(self.path, replace(state, fids=fids, digests=digests))
+            # Release the memory maps before the files are removed
+            del fids, digests
+        finally:
+            self.discard()
+
+    def discard(self):
+        """Drop the recorded rows (canceled or failed run)"""
+        self._close()
+        for path in (self.fids_path, self.digests_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def save_state(path, state):
+    """Write a RunState atomically; state.fids must be sorted"""
+    meta = {
+        "version": STATE_VERSION,
+        "hardness_field": state.hardness_field,
+        "confidence_field": state.confidence_field,
+        "coefficients": list(state.coefficients),
+        "linearize": state.linearize,
+        "field_names": state.field_names,
+        "validation": state.validation.to_dict() if state.validation is not None else None,
+        "max_relative_interval": state.max_relative_interval,
+    }
+    temporary = f"{path}.tmp.npz"
+    np.savez(temporary, meta=np.array(json.dumps(meta)), fids=state.fids, digests=state.digests)
+    os.replace(temporary, path)
+
+
+def load_state(path):
+    """RunState stored at path, or None if there is none or it cannot be read"""
+    from .validation import ValidationResult
+
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("version") != STATE_VERSION:
+                return None
+            return RunState(
+                meta["hardness_field"],
+                meta["confidence_field"],
+                tuple(meta["coefficients"]),
+                meta["linearize"],
+                meta["field_names"],
+                data["fids"],
+                data["digests"],
+                ValidationResult.from_dict(meta["validation"]) if meta.get("validation") else None,
+                meta.get("max_relative_interval", 0.0),
+            )
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
@@ -0,0 +1,191 @@
+import cProfile
+import json
+import os
+import platform
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+from .cache import output_stem
+
+# Phases in report order; any other phase is listed after them
+PHASES = ("extract", "filter", "correlation", "fit", "validate", "evaluate", "write", "grid")
+
+# Row-by-row phases that run under the profiler when a profile is requested
+PROFILED_PHASES = ("extract", "filter", "evaluate", "write")
+
+
+def timing_path_for(layer_path):
+    """Path of the JSON timing sidecar next to the layer source"""
+    return f"{output_stem(layer_path)}_hardness_timing.json"
+
+
+def profile_path_for(layer_path):
+    """Path of the cProfile dump next to the layer source"""
+    return f"{output_stem(layer_path)}_hardness_profile.prof"
+
+
+def peak_rss():
+    """High-water mark of the process resident set size in bytes, or None where it cannot be read"""
+    try:
+        import resource
+    except ImportError:
+        return _windows_peak_rss()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _windows_peak_rss():
+    try:
+        import ctypes
+        from ctypes import wintypes
+    except ImportError:
+        return None
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    try:
+        kernel32 = ctypes.windll.kernel32
+        psapi = ctypes.windll.psapi
+    except AttributeError:
+        return None
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters), wintypes.DWORD]
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    if not psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+        return None
+    return counters.PeakWorkingSetSize
+
+
+@dataclass
+class PhaseStats:
+    """Accumulated measurements of one phase"""
+    name: str
+    wall: float = 0.0
+    cpu: float = 0.0
+    rows: int = 0
+    peak_rss: int = None
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.wall if self.rows and self.wall > 0 else None
+
+    def to_dict(self):
+        return {
+            "phase": self.name,
+            "wall_seconds": self.wall,
+            "cpu_seconds": self.cpu,
+            "peak_rss_bytes": self.peak_rss,
+            "rows": self.rows,
+            "rows_per_second": self.rows_per_second,
+        }
+
+
+class Instrumentation:
+    """Wall time, CPU time, peak RSS and rows per second of each phase of a run.
+
+    A phase entered repeatedly (chunk by chunk in streaming mode) adds up.
+    CPU time is that of the whole process, so it includes worker threads
+    (and anything else the process does meanwhile); peak RSS is the process
+    high-water mark at the end of the phase. With profile set, the phases
+    of PROFILED_PHASES also run under a cProfile profiler, saved with
+    save_profile().
+    """
+
+    def __init__(self, profile=False):
+        self.phases = {}
+        self.profiler = cProfile.Profile() if profile else None
+        self._profiling = False
+        self.started = datetime.now()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    @contextmanager
+    def phase(self, name, rows=0):
+        """Measure the enclosed block as (part of) phase name; rows can also be added to the yielded PhaseStats"""
+        stats = self.phases.setdefault(name, PhaseStats(name))
+        profile = self.profiler is not None and name in PROFILED_PHASES and not self._profiling
+        if profile:
+            self._profiling = True
+            self.profiler.enable()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield stats
+        finally:
+            stats.wall += time.perf_counter() - wall
+            stats.cpu += time.process_time() - cpu
+            stats.rows += rows
+            stats.peak_rss = peak_rss()
+            if profile:
+                self.profiler.disable()
+                self._profiling = False
+
+    def chunks(self, name, iterable):
+        """Yield the SurveyColumns chunks of iterable, timing each step (the read) as phase name"""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name) as stats:
+                chunk = next(iterator, None)
+                if chunk is not None:
+                    stats.rows += len(chunk)
+            if chunk is None:
+                return
+            yield chunk
+
+    def ordered(self):
+        """PhaseStats in PHASES order, then any other phase in the order first entered"""
+        known = [self.phases[name] for name in PHASES if name in self.phases]
+        return known + [stats for name, stats in self.phases.items() if name not in PHASES]
+
+    def to_dict(self, **run):
+        """Measurements as a JSON-ready dict; run holds descriptive fields of the run (layer, mode, ...)"""
+        return {
+            **run,
+            "started": self.started.isoformat(timespec="seconds"),
+            "wall_seconds": time.perf_counter() - self._wall,
+            "cpu_seconds": time.process_time() - self._cpu,
+            "peak_rss_bytes": peak_rss(),
+            "phases": [stats.to_dict() for stats in self.ordered()],
+            "environment": {
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+        }
+
+    def save_json(self, path, **run):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(**run), f, indent=2)
+
+    def save_profile(self, path):
+        self.profiler.dump_stats(path)
+
+    def log_summary(self, log):
+        """Per-phase timing table in the processing log"""
+        log.summary("\nPhase timing:")
+        log.summary(f"  {'phase':<12}{'wall s':>10}{'cpu s':>10}{'peak RSS MiB':>14}{'rows':>12}{'rows/s':>14}")
+        for stats in self.ordered():
+            rss = f"{stats.peak_rss / 2 ** 20:.1f}" if stats.peak_rss is not None else "n/a"
+            rate = f"{stats.rows_per_second:.0f}" if stats.rows_per_second is not None else ""
+            log.summary(f"  {stats.name:<12}{stats.wall:>10.3f}{stats.cpu:>10.3f}{rss:>14}"
+                        f"{stats.rows if stats.rows else '':>12}{rate:>14}")
+        log.summary(f"  {'total run':<12}{time.perf_counter() - self._wall:>10.3f}{time.process_time() - self._cpu:>10.3f}")
@@ -1,19 +1,31 @@
 from qgis.PyQt.QtWidgets import QAction, QMenu, QMessageBox
-from qgis.core import QgsVectorLayer, QgsWkbTypes
+from qgis.core import QgsApplication, QgsVectorLayer, QgsWkbTypes
 from .hardness import HardnessDialog
+from .processing_provider import HardnessProvider
 
 class HardnessPlugin:
     def __init__(self, iface):
         self.iface = iface
         self.action = None
+        self.dialog = None
+        self.provider = None
+
+    def initProcessing(self):
+        self.provider = HardnessProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
 
     def initGui(self):
+        self.initProcessing()
         self.action = QAction("Hardness Calculator", self.iface.mainWindow())
         self.action.triggered.connect(self.run)
         self.iface.addPluginToMenu("&Hardness Calculator", self.action)
 
     def unload(self):
         self.iface.removePluginMenu("&Hardness Calculator", self.action)
+        QgsApplication.processingRegistry().removeProvider(self.provider)
+        if self.dialog is not None:
+            self.dialog.close()
+            self.dialog = None
         # Note: we are not adding a toolbar icon, so no need to remove it here.
 
     def run(self):
@@ -37,6 +49,10 @@ class HardnessPlugin:
             )
             return
 
-        # 3) Everything is OK → open the dialog
-        dialog = HardnessDialog(self.iface)
-        dialog.exec_()
\ No newline at end of file
+        # 3) Everything is OK → open the dialog (non-modal, the calculation runs as a background task)
+        if self.dialog is not None and self.dialog.isVisible():
+            self.dialog.raise_()
+            self.dialog.activateWindow()
+            return
+        self.dialog = HardnessDialog(self.iface)
+        self.dialog.show()
\ No newline at end of file
@@ -0,0 +1,97 @@
+import sys
+
+import numpy as np
+from qgis.core import (
+    QgsExpression, QgsFeature, QgsField, QgsMarkerSymbol, QgsProperty, QgsSingleSymbolRenderer, QgsSymbolLayer,
+    QgsVectorLayer, QgsWkbTypes,
+)
+from qgis.PyQt.QtCore import QVariant
+from .engine import CONFIDENCE_LOW, INPUT_KEYS, evaluate_hardness
+
+# Features kept in the preview sample by default
+PREVIEW_SAMPLE_SIZE = 50000
+
+# Strata per axis of the layer extent for a spatially stratified sample
+PREVIEW_STRATA_PER_AXIS = 32
+
+# Color ramp of the preview symbology, from soft (low hardness) to hard
+PREVIEW_RAMP = "Spectral"
+
+# Percentiles of the sampled hardness mapped to the ends of the color ramp
+PREVIEW_COLOR_PERCENTILES = (2, 98)
+
+
+def hardness_expression(k1, k2, k3, linearize):
+    """QGIS expression of the hardness formula on the E1/E2/PeakSV fields of the preview layer.
+
+    Mirrors evaluate_hardness(): NULL unless E1 > 0 and PeakSV > 0, the
+    E1/E2 term only where E2 > 0, and NULL where the result is not finite
+    (e.g. an overflowing 10^((E1-E2)/10)), which QGIS would return as
+    inf. Comparisons with NaN or inf are false, so the finiteness test is a
+    bound on abs().
+    """
+    k1, k2, k3 = (float(k) for k in (k1, k2, k3))
+    e1, e2, peak_sv = (QgsExpression.quotedColumnRef(key) for key in ("E1", "E2", "PeakSV"))
+    ratio = f"10 ^ (({e1} - {e2}) / 10)" if linearize else f"({e1} / {e2})"
+    hardness = f"{k1!r} * {e1} + {k3!r} * {peak_sv} + CASE WHEN {e2} > 0 THEN {k2!r} * {ratio} ELSE 0 END"
+    return (f"CASE WHEN {e1} > 0 AND {peak_sv} > 0 THEN with_variable('hardness', {hardness}, "
+            f"CASE WHEN abs(@hardness) <= {sys.float_info.max!r} THEN @hardness END) END")
+
+
+def create_preview_layer(layer, columns, geometries):
+    """Memory layer of the sampled features: geometry, source fid and the mapped inputs as doubles"""
+    preview = QgsVectorLayer(QgsWkbTypes.displayString(layer.wkbType()), f"{layer.name()} (hardness preview)", "memory")
+    preview.setCrs(layer.crs())
+    provider = preview.dataProvider()
+    provider.addAttributes([QgsField("source_fid", QVariant.LongLong)] + [QgsField(key, QVariant.Double) for key in INPUT_KEYS])
+    preview.updateFields()
+
+    inputs = np.column_stack([columns.e1, columns.e2, columns.peak_sv, columns.depth])
+    features = []
+    for fid, geometry, values in zip(columns.fids.tolist(), geometries, inputs.tolist()):
+        feature = QgsFeature(preview.fields())
+        feature.setGeometry(geometry)
+        feature.setAttributes([fid] + [None if np.isnan(value) else value for value in values])
+        features.append(feature)
+    provider.addFeatures(features)
+    preview.updateExtents()
+    return preview
+
+
+class HardnessPreview:
+    """Hardness of a sampled layer held in memory, re-evaluated for new coefficients.
+
+    update() evaluates the sample with NumPy for the summary and the color
+    limits, and sets a data-defined fill color on the preview layer, so the
+    map shows the new hardness without any attribute being written.
+    """
+
+    def __init__(self, layer, columns):
+        self.layer = layer
+        self.layer_id = layer.id()
+        self.columns = columns
+        self.hardness = None
+        self.confidence = None
+
+    def update(self, k1, k2, k3, linearize):
+        self.hardness, self.confidence = evaluate_hardness(self.columns, k1, k2, k3, linearize)
+        finite = self.hardness[np.isfinite(self.hardness)]
+        low, high = (float(value) for value in np.percentile(finite, PREVIEW_COLOR_PERCENTILES)) if len(finite) else (0.0, 1.0)
+        if not high > low:
+            high = low + 1.0
+
+        color = (f"coalesce(ramp_color('{PREVIEW_RAMP}', scale_linear({hardness_expression(k1, k2, k3, linearize)}, "
+                 f"{low!r}, {high!r}, 0, 1)), '128,128,128,0')")
+        symbol = QgsMarkerSymbol.createSimple({"size": "1.2", "outline_style": "no"})
+        symbol.symbolLayer(0).setDataDefinedProperty(QgsSymbolLayer.PropertyFillColor, QgsProperty.fromExpression(color))
+        self.layer.setRenderer(QgsSingleSymbolRenderer(symbol))
+        self.layer.triggerRepaint()
+
+    def describe(self):
+        """One-line summary of the last update for the dialog"""
+        finite = self.hardness[np.isfinite(self.hardness)]
+        if len(finite) == 0:
+            return f"Preview on {len(self.columns)} sampled points: no valid hardness"
+        low_share = np.count_nonzero(self.confidence == CONFIDENCE_LOW) / len(self.columns) * 100
+        return (f"Preview on {len(self.columns)} sampled points: hardness {finite.min():.3f} to {finite.max():.3f}, "
+                f"median {np.median(finite):.3f}, Low confidence {low_share:.1f}%")
@@ -0,0 +1,258 @@
+from qgis.core import (
+    QgsFeature, QgsFeatureSink, QgsField, QgsFields, QgsProcessing, QgsProcessingAlgorithm, QgsProcessingException,
+    QgsProcessingMultiStepFeedback, QgsProcessingParameterBoolean, QgsProcessingParameterDefinition,
+    QgsProcessingParameterEnum, QgsProcessingParameterFeatureSink, QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterField, QgsProcessingParameterNumber, QgsProcessingParameterRasterDestination,
+)
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+import numpy as np
+from .engine import MODE_MANUAL, MODE_OPTIMIZED, MODE_REGIONAL, HardnessParameters, run_engine
+from .extraction import extract_columns
+from .instrumentation import Instrumentation
+from .processing_log import PHASE, SUMMARY, ProcessingLog
+from .raster import HardnessGrid, RasterGrid, write_geotiff
+from .task import unique_field_name
+from .writer import confidence_values
+
+MODES = [MODE_MANUAL, MODE_OPTIMIZED, MODE_REGIONAL]
+
+
+class FeedbackLog(ProcessingLog):
+    """ProcessingLog that reports to a processing feedback instead of a file"""
+
+    def __init__(self, feedback, level=PHASE, instrumentation=None):
+        super().__init__(None, level, instrumentation=instrumentation)
+        self.feedback = feedback
+
+    def enabled(self, level):
+        return level <= self.level
+
+    def write(self, content, level=SUMMARY):
+        if self.enabled(level):
+            self.feedback.pushInfo(content.strip("\n"))
+
+    def debug_rows(self, header, rows):
+        pass
+
+
+class HardnessAlgorithm(QgsProcessingAlgorithm):
+    INPUT = "INPUT"
+    FIELDS = {"E1": "E1_FIELD", "E2": "E2_FIELD", "PeakSV": "PEAKSV_FIELD", "Depth": "DEPTH_FIELD"}
+    MODE = "MODE"
+    LINEARIZE = "LINEARIZE"
+    K1 = "K1"
+    K2 = "K2"
+    K3 = "K3"
+    LOWER_PERCENTILE = "LOWER_PERCENTILE"
+    UPPER_PERCENTILE = "UPPER_PERCENTILE"
+    EXACT_PERCENTILES = "EXACT_PERCENTILES"
+    QUANTILE_ERROR = "QUANTILE_ERROR"
+    CODED_CONFIDENCE = "CODED_CONFIDENCE"
+    TILE_SIZE = "TILE_SIZE"
+    MIN_TILE_SAMPLES = "MIN_TILE_SAMPLES"
+    BORROW_RINGS = "BORROW_RINGS"
+    VALIDATION = "VALIDATION"
+    BOOTSTRAP_SAMPLES = "BOOTSTRAP_SAMPLES"
+    FOLDS = "FOLDS"
+    MAX_RELATIVE_INTERVAL = "MAX_RELATIVE_INTERVAL"
+    GRID_CELL_SIZE = "GRID_CELL_SIZE"
+    GRID_MEDIAN = "GRID_MEDIAN"
+    GRID_IDW = "GRID_IDW"
+    OUTPUT = "OUTPUT"
+    GRID = "GRID"
+
+    def tr(self, string):
+        return QCoreApplication.translate("HardnessAlgorithm", string)
+
+    def createInstance(self):
+        return HardnessAlgorithm()
+
+    def name(self):
+        return "hardness"
+
+    def displayName(self):
+        return self.tr("Calculate hardness")
+
+    def shortHelpString(self):
+        return self.tr(
+            "Computes a hardness index H = k1*E1 + k2*f(E1,E2) + k3*PeakSV for every point and writes it, "
+            "with a High/Low confidence flag, to a new output layer. In Optimized mode k1, k2 and k3 are "
+            "estimated by bounded regression on depth after percentile outlier removal; in Manual mode "
+            "the given values are used. Regional mode fits k1, k2 and k3 per tile of a square grid (tiles "
+            "with too few samples borrow from their neighbours) and blends them bilinearly between tile "
+            "centres. With linearization f(E1,E2) is 10^((E1-E2)/10) instead of E1/E2 "
+            "(use k2 around 0.03 in Manual mode). The optional hardness grid bins the hardness onto a "
+            "raster with the mean, count and optionally median and inverse distance weighted hardness per cell."
+        )
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.INPUT, self.tr("Input point layer"), [QgsProcessing.TypeVectorPoint]))
+        for key, name in self.FIELDS.items():
+            self.addParameter(QgsProcessingParameterField(
+                name, self.tr(f"{key} field"), key, self.INPUT, QgsProcessingParameterField.Any))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.MODE, self.tr("Calculation mode"),
+            [self.tr("Manual (User-defined k1, k2, k3)"), self.tr("Optimized (Regression-based)"),
+             self.tr("Regional (Tiled regression)")], defaultValue=0))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.LINEARIZE, self.tr("Use linearized E1/E2"), defaultValue=False))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.K1, self.tr("k1 (Manual mode)"), QgsProcessingParameterNumber.Double, 0.7))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.K2, self.tr("k2 (Manual mode)"), QgsProcessingParameterNumber.Double, 0.5))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.K3, self.tr("k3 (Manual mode)"), QgsProcessingParameterNumber.Double, 0.3))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.LOWER_PERCENTILE, self.tr("Lower percentile for outlier removal (%, Optimized mode)"),
+            QgsProcessingParameterNumber.Double, 5, minValue=0, maxValue=100))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.UPPER_PERCENTILE, self.tr("Upper percentile for outlier removal (%, Optimized mode)"),
+            QgsProcessingParameterNumber.Double, 95, minValue=0, maxValue=100))
+
+        exact = QgsProcessingParameterBoolean(self.EXACT_PERCENTILES, self.tr("Exact percentiles (off: quantile sketch in constant memory)"), defaultValue=True)
+        error = QgsProcessingParameterNumber(
+            self.QUANTILE_ERROR, self.tr("Percentile sketch rank error (%)"), QgsProcessingParameterNumber.Double,
+            0.1, minValue=0.001, maxValue=10)
+        coded = QgsProcessingParameterBoolean(
+            self.CODED_CONFIDENCE, self.tr("Write Confidence as an integer code (1 = High, 0 = Low)"), defaultValue=False)
+        tile_size = QgsProcessingParameterNumber(
+            self.TILE_SIZE, self.tr("Tile size (layer units, 0 = automatic, Regional mode)"),
+            QgsProcessingParameterNumber.Double, 0, minValue=0)
+        min_samples = QgsProcessingParameterNumber(
+            self.MIN_TILE_SAMPLES, self.tr("Minimum samples per tile (Regional mode)"),
+            QgsProcessingParameterNumber.Integer, 200, minValue=1)
+        rings = QgsProcessingParameterNumber(
+            self.BORROW_RINGS, self.tr("Neighbour rings to borrow samples from (Regional mode)"),
+            QgsProcessingParameterNumber.Integer, 2, minValue=0)
+        validation = QgsProcessingParameterBoolean(
+            self.VALIDATION, self.tr("Bootstrap confidence intervals and cross-validated R² (Optimized mode)"), defaultValue=False)
+        resamples = QgsProcessingParameterNumber(
+            self.BOOTSTRAP_SAMPLES, self.tr("Bootstrap resamples"), QgsProcessingParameterNumber.Integer, 1000, minValue=10)
+        folds = QgsProcessingParameterNumber(
+            self.FOLDS, self.tr("Cross-validation folds"), QgsProcessingParameterNumber.Integer, 5, minValue=2)
+        max_interval = QgsProcessingParameterNumber(
+            self.MAX_RELATIVE_INTERVAL, self.tr("Set Confidence to Low where the 95% hardness interval exceeds (% of hardness, 0 = off)"),
+            QgsProcessingParameterNumber.Double, 0, minValue=0)
+        cell_size = QgsProcessingParameterNumber(
+            self.GRID_CELL_SIZE, self.tr("Hardness grid cell size (layer units, 0 = automatic)"),
+            QgsProcessingParameterNumber.Double, 0, minValue=0)
+        median = QgsProcessingParameterBoolean(self.GRID_MEDIAN, self.tr("Add a median band to the hardness grid"), defaultValue=False)
+        idw = QgsProcessingParameterBoolean(
+            self.GRID_IDW, self.tr("Add an inverse distance weighted band to the hardness grid"), defaultValue=False)
+        for parameter in (exact, error, coded, tile_size, min_samples, rings, validation, resamples, folds, max_interval,
+                          cell_size, median, idw):
+            parameter.setFlags(parameter.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+            self.addParameter(parameter)
+
+        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT, self.tr("Hardness")))
+        self.addParameter(QgsProcessingParameterRasterDestination(
+            self.GRID, self.tr("Hardness grid"), optional=True, createByDefault=False))
+
+    def parameters_from(self, parameters, context, grid):
+        params = HardnessParameters(
+            field_names={key: self.parameterAsString(parameters, name, context) for key, name in self.FIELDS.items()},
+            mode=MODES[self.parameterAsEnum(parameters, self.MODE, context)],
+            linearize=self.parameterAsBool(parameters, self.LINEARIZE, context),
+            k1=self.parameterAsDouble(parameters, self.K1, context),
+            k2=self.parameterAsDouble(parameters, self.K2, context),
+            k3=self.parameterAsDouble(parameters, self.K3, context),
+            lower_percentile=self.parameterAsDouble(parameters, self.LOWER_PERCENTILE, context) / 100,
+            upper_percentile=self.parameterAsDouble(parameters, self.UPPER_PERCENTILE, context) / 100,
+            exact_quantiles=self.parameterAsBool(parameters, self.EXACT_PERCENTILES, context),
+            quantile_error=self.parameterAsDouble(parameters, self.QUANTILE_ERROR, context) / 100,
+            coded_confidence=self.parameterAsBool(parameters, self.CODED_CONFIDENCE, context),
+            tile_size=self.parameterAsDouble(parameters, self.TILE_SIZE, context),
+            min_tile_samples=self.parameterAsInt(parameters, self.MIN_TILE_SAMPLES, context),
+            borrow_rings=self.parameterAsInt(parameters, self.BORROW_RINGS, context),
+            validation=self.parameterAsBool(parameters, self.VALIDATION, context),
+            bootstrap_samples=self.parameterAsInt(parameters, self.BOOTSTRAP_SAMPLES, context),
+            folds=self.parameterAsInt(parameters, self.FOLDS, context),
+            max_relative_interval=self.parameterAsDouble(parameters, self.MAX_RELATIVE_INTERVAL, context) / 100,
+            grid=grid,
+            grid_cell_size=self.parameterAsDouble(parameters, self.GRID_CELL_SIZE, context),
+            grid_median=self.parameterAsBool(parameters, self.GRID_MEDIAN, context),
+            grid_idw=self.parameterAsBool(parameters, self.GRID_IDW, context),
+        )
+        try:
+            params.validate()
+        except ValueError as e:
+            raise QgsProcessingException(str(e))
+        return params
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source = self.parameterAsSource(parameters, self.INPUT, context)
+        if source is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
+        grid_path = self.parameterAsOutputLayer(parameters, self.GRID, context)
+        params = self.parameters_from(parameters, context, bool(grid_path))
+        steps = QgsProcessingMultiStepFeedback(2, feedback)
+
+        # Extract and compute
+        log = FeedbackLog(feedback, instrumentation=Instrumentation())
+        with log.timed("extract") as phase:
+            columns = extract_columns(source, source.fields(), params.field_names, source.featureCount(), steps,
+                                      params.mode == MODE_REGIONAL or params.grid)
+            phase.rows += len(columns) if columns is not None else 0
+        if columns is None or feedback.isCanceled():
+            return {}
+        try:
+            result = run_engine(columns, params, log)
+        except ValueError as e:
+            raise QgsProcessingException(str(e))
+        k1, k2, k3 = result.coefficients
+        feedback.pushInfo(f"{'Global ' if result.regional is not None else ''}k1: {k1:.4f}, k2: {k2:.4f}, k3: {k3:.4f}")
+        if result.fit is not None and result.fit.validation is not None:
+            feedback.pushInfo(result.fit.validation.describe(result.coefficients))
+        for reason, n in result.diagnostics.items():
+            feedback.pushInfo(f"{reason}: {n}")
+
+        # Copy the input with the two result fields appended
+        fields = QgsFields(source.fields())
+        existing_fields = fields.names()
+        fields.append(QgsField(unique_field_name(existing_fields, "Hardness"), QVariant.Double))
+        fields.append(QgsField(unique_field_name(existing_fields, "Confidence"), QVariant.Int if params.coded_confidence else QVariant.String))
+        sink, dest_id = self.parameterAsSink(parameters, self.OUTPUT, context, fields, source.wkbType(), source.sourceCrs())
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        steps.setCurrentStep(1)
+        order = np.argsort(result.fids)
+        sorted_fids = result.fids[order]
+        hardness = result.hardness[order]
+        labels = confidence_values(result.confidence, params.coded_confidence)[order]
+        total = max(1, len(sorted_fids))
+        update_interval = max(1, total // 100)
+        with log.timed("write", len(sorted_fids)):
+            for count, feature in enumerate(source.getFeatures()):
+                if feedback.isCanceled():
+                    break
+                position = int(np.searchsorted(sorted_fids, feature.id()))
+                if position < len(sorted_fids) and sorted_fids[position] == feature.id():
+                    value, label = hardness[position], labels[position]
+                else:
+                    value, label = np.nan, None
+
+                output = QgsFeature(fields)
+                output.setGeometry(feature.geometry())
+                output.setAttributes(feature.attributes() + [None if np.isnan(value) else float(value), label])
+                sink.addFeature(output, QgsFeatureSink.FastInsert)
+                if count % update_interval == 0:
+                    steps.setProgress(count / total * 100)
+        results = {self.OUTPUT: dest_id}
+
+        if params.grid and not feedback.isCanceled():
+            extent = source.sourceExtent()
+            with log.timed("grid", len(columns)):
+                grid = HardnessGrid(RasterGrid.covering(extent.xMinimum(), extent.yMinimum(), extent.xMaximum(),
+                                                        extent.yMaximum(), params.grid_cell_size), params.grid_median)
+                grid.update(columns.x, columns.y, result.hardness)
+                try:
+                    write_geotiff(grid_path, grid.grid, grid.bands(params), source.sourceCrs().toWkt())
+                except OSError as e:
+                    raise QgsProcessingException(str(e))
+            feedback.pushInfo(f"Hardness grid: {grid.describe()}")
+            results[self.GRID] = grid_path
+        log.instrumentation.log_summary(log)
+
+        return results
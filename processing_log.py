@@ -0,0 +1,107 @@
+from collections import OrderedDict
+from contextlib import nullcontext
+from datetime import datetime
+
+from .cache import output_stem
+from .instrumentation import PhaseStats
+
+# Log levels, from least to most verbose
+SUMMARY = 0
+PHASE = 1
+DEBUG = 2
+LEVEL_NAMES = OrderedDict([
+    (SUMMARY, "Summary"),
+    (PHASE, "Per-phase"),
+    (DEBUG, "Per-feature debug"),
+])
+
+HEADER = "Hardness Calculator Processing Log\n===================================\n\n"
+
+
+def log_path_for(layer_path):
+    """Processing log path next to the layer source"""
+    return f"{output_stem(layer_path)}_hardness_processing.txt"
+
+
+class ProcessingLog:
+    """Leveled processing log backed by a single buffered file handle.
+
+    Messages above the configured level are dropped before formatting.
+    Per-feature diagnostics are accumulated with count() and written as one
+    aggregate block by write_counts() instead of one line per feature.
+    With path None nothing is written, which suits headless callers that do
+    not want a log. An attached Instrumentation receives the phases entered
+    with timed(); without one, timed() costs nothing.
+    """
+
+    def __init__(self, path, level=PHASE, buffer_size=1 << 16, instrumentation=None):
+        self.path = path
+        self.level = level
+        self.instrumentation = instrumentation
+        self.counts = OrderedDict()
+        self._file = None
+        if path is not None:
+            self._file = open(path, 'w', encoding='utf-8', buffering=buffer_size)
+            self._file.write(HEADER)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def enabled(self, level):
+        """Whether messages of the given level are written"""
+        return self._file is not None and level <= self.level
+
+    def write(self, content, level=SUMMARY):
+        """Write a timestamped message if level is enabled"""
+        if not self.enabled(level):
+            return
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._file.write(f"[{timestamp}] {content}\n")
+
+    def summary(self, content):
+        self.write(content, SUMMARY)
+
+    def phase(self, content):
+        self.write(content, PHASE)
+
+    def debug(self, content):
+        self.write(content, DEBUG)
+
+    def debug_rows(self, header, rows):
+        """Write an untimestamped block of per-feature rows at DEBUG level"""
+        if not self.enabled(DEBUG):
+            return
+        self._file.write(header + "\n")
+        self._file.writelines("\t".join(str(value) for value in row) + "\n" for row in rows)
+
+    def timed(self, phase, rows=0):
+        """Context manager measuring a phase in the attached Instrumentation, if any; yields its PhaseStats"""
+        if self.instrumentation is None:
+            return nullcontext(PhaseStats(phase))
+        return self.instrumentation.phase(phase, rows)
+
+    def timed_chunks(self, phase, chunks):
+        """Iterate SurveyColumns chunks, timing each read as phase in the attached Instrumentation, if any"""
+        if self.instrumentation is None:
+            return chunks
+        return self.instrumentation.chunks(phase, chunks)
+
+    def count(self, reason, n=1):
+        """Accumulate n occurrences of a per-feature diagnostic"""
+        self.counts[reason] = self.counts.get(reason, 0) + int(n)
+
+    def write_counts(self, title, level=SUMMARY):
+        """Write and reset the accumulated diagnostic counts"""
+        if self.counts:
+            self.write(title, level)
+            for reason, n in self.counts.items():
+                self.write(f"  {reason}: {n}", level)
+        self.counts = OrderedDict()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
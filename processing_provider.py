@@ -0,0 +1,21 @@
+import os
+
+from qgis.core import QgsProcessingProvider
+from qgis.PyQt.QtGui import QIcon
+from .processing_algorithm import HardnessAlgorithm
+
+
+class HardnessProvider(QgsProcessingProvider):
+    """Processing provider exposing the hardness calculation to the toolbox, batch mode and model builder"""
+
+    def loadAlgorithms(self):
+        self.addAlgorithm(HardnessAlgorithm())
+
+    def id(self):
+        return "hardnesscalculator"
+
+    def name(self):
+        return "Hardness Calculator"
+
+    def icon(self):
+        return QIcon(os.path.join(os.path.dirname(__file__), "icons", "icon.png"))
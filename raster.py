@@ -0,0 +1,240 @@
+import math
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+from .cache import output_stem
+
+# Cells along the longer side of the extent when no cell size is given
+AUTO_CELLS_PER_AXIS = 1000
+
+# Upper limit on the number of cells; smaller cell sizes are enlarged to respect it
+MAX_CELLS = 16_000_000
+
+# Points binned at a time, which bounds the temporary arrays of update()
+GRID_CHUNK_SIZE = 1_000_000
+
+# Cell centres interpolated at a time by the IDW neighbour search
+IDW_BLOCK_SIZE = 262144
+
+# IDW search radius in cells when none is given
+IDW_RADIUS_CELLS = 5
+
+# Value of empty cells in the GeoTIFF bands
+GRID_NODATA = -9999.0
+
+
+def _sortable(values):
+    """uint32 keys that sort in the order of the float32-rounded values"""
+    bits = values.astype(np.float32).view(np.uint32)
+    return bits ^ np.where(bits >> 31 == 1, np.uint32(0xFFFFFFFF), np.uint32(0x80000000))
+
+
+def _from_sortable(keys):
+    """float32 values of the keys of _sortable()"""
+    keys = keys.astype(np.uint32)
+    return (keys ^ np.where(keys >> 31 == 1, np.uint32(0x80000000), np.uint32(0xFFFFFFFF))).view(np.float32)
+
+
+def grid_path_for(layer_path):
+    """Path of the hardness GeoTIFF next to the layer source"""
+    return f"{output_stem(layer_path)}_hardness_grid.tif"
+
+
+@dataclass
+class RasterGrid:
+    """North-up grid of square cells of side size, nx columns by ny rows, with (x_min, y_max) as upper left corner.
+
+    Cells are numbered row by row from the top, as the pixels of a GeoTIFF
+    band: cell = row * nx + column.
+    """
+    x_min: float
+    y_max: float
+    size: float
+    nx: int
+    ny: int
+
+    @classmethod
+    def covering(cls, x_min, y_min, x_max, y_max, size=0.0):
+        """Grid covering an extent (its right and bottom edges included), with an automatic cell size when size is 0"""
+        width = max(x_max - x_min, 0.0)
+        height = max(y_max - y_min, 0.0)
+        if size <= 0:
+            size = max(width, height) / AUTO_CELLS_PER_AXIS or 1.0
+        nx = int(width // size) + 1
+        ny = int(height // size) + 1
+        if nx * ny > MAX_CELLS:
+            # Smallest size with (width / size + 1) * (height / size + 1) <= MAX_CELLS, the edge cells included
+            size = max(size, (width + height + math.sqrt((width + height) ** 2 + 4 * (MAX_CELLS - 1) * width * height))
+                       / (2 * (MAX_CELLS - 1)) * 1.001)
+            nx = int(width // size) + 1
+            ny = int(height // size) + 1
+        return cls(float(x_min), float(y_max), float(size), nx, ny)
+
+    @classmethod
+    def covering_points(cls, x, y, size=0.0):
+        """Grid covering the finite coordinates of x and y"""
+        finite = np.isfinite(x) & np.isfinite(y)
+        if not finite.any():
+            raise ValueError("No point coordinates available for the hardness grid.")
+        return cls.covering(x[finite].min(), y[finite].min(), x[finite].max(), y[finite].max(), size)
+
+    def __len__(self):
+        return self.nx * self.ny
+
+    def cell_ids(self, x, y):
+        """Cell of every point, -1 for missing coordinates or points outside the grid"""
+        with np.errstate(invalid="ignore"):
+            column = np.floor((x - self.x_min) / self.size)
+            row = np.floor((self.y_max - y) / self.size)
+            inside = (column >= 0) & (column < self.nx) & (row >= 0) & (row < self.ny)
+        return np.where(inside, row * self.nx + column, -1).astype(np.int64)
+
+    def centres(self, cells):
+        """(n, 2) coordinates of the centres of cells"""
+        row, column = np.divmod(cells, self.nx)
+        return np.column_stack([self.x_min + (column + 0.5) * self.size, self.y_max - (row + 0.5) * self.size])
+
+    def geotransform(self):
+        """GDAL geotransform of the grid"""
+        return (self.x_min, self.size, 0.0, self.y_max, 0.0, -self.size)
+
+
+class HardnessGrid:
+    """Per-cell statistics of hardness values, binned chunk by chunk.
+
+    update() assigns points to cells arithmetically and adds their count,
+    hardness and coordinates to per-cell sums with np.bincount, so memory
+    depends on the grid size, not on the number of points. With median,
+    every point is also kept as one 64-bit key, its cell in the upper and
+    its float32 hardness (the precision of the GeoTIFF bands) in the lower
+    half, so a single np.sort at the end orders the values within each
+    cell. Points with NULL hardness or coordinates are skipped.
+    """
+
+    def __init__(self, grid, median=False):
+        self.grid = grid
+        self.count = np.zeros(len(grid), dtype=np.int64)
+        self.sum = np.zeros(len(grid))
+        self.sum_x = np.zeros(len(grid))
+        self.sum_y = np.zeros(len(grid))
+        self.keys = [] if median else None
+
+    @property
+    def n(self):
+        return int(self.count.sum())
+
+    def update(self, x, y, hardness):
+        """Add points with coordinates x, y and their hardness"""
+        cells_total = len(self.grid)
+        for start in range(0, len(hardness), GRID_CHUNK_SIZE):
+            stop = start + GRID_CHUNK_SIZE
+            cells = self.grid.cell_ids(x[start:stop], y[start:stop])
+            values = hardness[start:stop]
+            keep = (cells >= 0) & ~np.isnan(values)
+            cells = cells[keep]
+            values = values[keep]
+            self.count += np.bincount(cells, minlength=cells_total)
+            self.sum += np.bincount(cells, weights=values, minlength=cells_total)
+            self.sum_x += np.bincount(cells, weights=x[start:stop][keep], minlength=cells_total)
+            self.sum_y += np.bincount(cells, weights=y[start:stop][keep], minlength=cells_total)
+            if self.keys is not None:
+                self.keys.append((cells.astype(np.uint64) << np.uint64(32)) | _sortable(values))
+
+    def mean(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(self.count > 0, self.sum / self.count, np.nan)
+
+    def median(self):
+        """Per-cell median hardness (NaN for empty cells)"""
+        result = np.full(len(self.grid), np.nan)
+        keys = np.concatenate(self.keys) if self.keys else np.empty(0, np.uint64)
+        if len(keys) == 0:
+            return result
+        keys.sort()
+        self.keys = [keys]
+        cells = (keys >> np.uint64(32)).astype(np.int64)
+        values = _from_sortable(keys & np.uint64(0xFFFFFFFF)).astype(np.float64)
+        starts = np.flatnonzero(np.concatenate([[True], cells[1:] != cells[:-1]]))
+        counts = np.diff(np.append(starts, len(cells)))
+        result[cells[starts]] = (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2
+        return result
+
+    def idw(self, neighbors, power, radius=0.0, workers=-1):
+        """Inverse distance weighted hardness at every cell centre.
+
+        The data points are the hardness means of the occupied cells, placed
+        at the centroid of their points, so the search runs over at most one
+        point per cell. Each centre takes its neighbors nearest data points
+        within radius (IDW_RADIUS_CELLS cell sizes when 0), found with a
+        cKDTree in blocks of IDW_BLOCK_SIZE cells; centres without any stay
+        NaN. workers is the number of query threads (-1 = all cores).
+        """
+        from scipy.spatial import cKDTree
+
+        result = np.full(len(self.grid), np.nan)
+        occupied = np.flatnonzero(self.count)
+        if len(occupied) == 0:
+            return result
+        count = self.count[occupied]
+        tree = cKDTree(np.column_stack([self.sum_x[occupied] / count, self.sum_y[occupied] / count]))
+        values = self.sum[occupied] / count
+        k = min(neighbors, len(occupied))
+        radius = radius or IDW_RADIUS_CELLS * self.grid.size
+        # Distances below this count as a hit on the data point itself
+        nearest = self.grid.size * 1e-9
+
+        for start in range(0, len(self.grid), IDW_BLOCK_SIZE):
+            cells = np.arange(start, min(start + IDW_BLOCK_SIZE, len(self.grid)))
+            distance, index = tree.query(self.grid.centres(cells), k=k, distance_upper_bound=radius, workers=workers)
+            if k == 1:
+                distance, index = distance[:, None], index[:, None]
+            found = np.isfinite(distance)
+            weights = np.where(found, 1.0 / np.maximum(distance, nearest) ** power, 0.0)
+            total = weights.sum(axis=1)
+            weighted = (weights * values[np.where(found, index, 0)]).sum(axis=1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                result[cells] = np.where(total > 0, weighted / total, np.nan)
+        return result
+
+    def bands(self, params):
+        """Output bands (name -> per-cell values) for the grid settings of HardnessParameters"""
+        bands = OrderedDict([("mean", self.mean())])
+        if self.keys is not None:
+            bands["median"] = self.median()
+        bands["count"] = self.count.astype(np.float64)
+        if params.grid_idw:
+            bands["idw"] = self.idw(params.idw_neighbors, params.idw_power, params.idw_radius, params.workers or -1)
+        return bands
+
+    def describe(self):
+        grid = self.grid
+        occupied = int(np.count_nonzero(self.count))
+        return (f"{grid.nx} x {grid.ny} cells of {grid.size:g} layer units, "
+                f"{self.n} points in {occupied} cells ({occupied / len(grid):.1%} of the grid)")
+
+
+def write_geotiff(path, grid, bands, crs_wkt=None):
+    """Write bands (name -> per-cell values in grid order) as a float32 GeoTIFF, NaN as GRID_NODATA.
+
+    The file is tiled and DEFLATE compressed; every band is described with
+    its name. crs_wkt is the coordinate reference system of the grid, if
+    known. Needs GDAL's Python bindings.
+    """
+    from osgeo import gdal
+
+    driver = gdal.GetDriverByName("GTiff")
+    dataset = driver.Create(path, grid.nx, grid.ny, len(bands), gdal.GDT_Float32,
+                            options=["TILED=YES", "COMPRESS=DEFLATE", "BIGTIFF=IF_SAFER"])
+    if dataset is None:
+        raise OSError(f"Cannot create {path}")
+    dataset.SetGeoTransform(grid.geotransform())
+    if crs_wkt:
+        dataset.SetProjection(crs_wkt)
+    for number, (name, values) in enumerate(bands.items(), 1):
+        band = dataset.GetRasterBand(number)
+        band.SetDescription(name)
+        band.SetNoDataValue(GRID_NODATA)
+        band.WriteArray(np.where(np.isnan(values), GRID_NODATA, values).astype(np.float32).reshape(grid.ny, grid.nx))
+    dataset.FlushCache()
+    dataset = None
@@ -0,0 +1,154 @@
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+from .dbf import DbfTable, PointShapes, dbf_path_for, sibling_path
+from .engine import INPUT_KEYS, SurveyColumns
+
+# Survey file formats readable without QGIS
+CSV_EXTENSIONS = (".csv", ".txt")
+OGR_EXTENSIONS = (".gpkg", ".shp")
+
+# Data rows parsed at a time from delimited text exports
+CSV_CHUNK_SIZE = 500000
+
+
+def _csv_delimiter(path):
+    """Delimiter of a survey export: "," for .csv, sniffed from the header line of .txt exports"""
+    if not path.lower().endswith(".txt"):
+        return ","
+    with open(path, newline="", encoding="utf-8", errors="replace") as f:
+        header = f.readline()
+    try:
+        return csv.Sniffer().sniff(header, delimiters=",;\t| ").delimiter
+    except csv.Error:
+        return ","
+
+
+def iter_csv_chunks(path, field_names, chunk_size=CSV_CHUNK_SIZE, coordinate_fields=None):
+    """Yield SurveyColumns of at most chunk_size data rows of a delimited text survey export.
+
+    Only the mapped columns (and coordinate_fields, the (x, y) columns, if
+    given) are parsed, by the C parser straight to float64. Should a column
+    hold text after all, the rest of the file is parsed untyped and
+    converted value by value, empty or non-numeric values becoming NaN.
+    Feature ids are the 0-based data row numbers.
+    """
+    usecols = [field_names[key] for key in INPUT_KEYS] + list(coordinate_fields or ())
+    delimiter = _csv_delimiter(path)
+    start = 0
+    typed = True
+    while True:
+        dtype = dict.fromkeys(usecols, np.float64) if typed else None
+        try:
+            with pd.read_csv(path, sep=delimiter, usecols=usecols, dtype=dtype, chunksize=chunk_size,
+                             skiprows=range(1, start + 1)) as reader:
+                for frame in reader:
+                    values = [pd.to_numeric(frame[name], errors="coerce").to_numpy(dtype=float) for name in usecols]
+                    yield SurveyColumns(np.arange(start, start + len(frame), dtype=np.int64), *values)
+                    start += len(frame)
+            return
+        except ValueError:
+            if not typed:
+                raise
+            typed = False
+
+
+def read_csv_columns(path, field_names, coordinate_fields=None):
+    """Read the mapped columns of a delimited text survey export.
+
+    Feature ids are the 0-based data row numbers. Empty or non-numeric
+    values become NaN. coordinate_fields names the (x, y) columns to read
+    as point coordinates, if any.
+    """
+    chunks = list(iter_csv_chunks(path, field_names, coordinate_fields=coordinate_fields))
+    names = ["fids", "e1", "e2", "peak_sv", "depth"] + (["x", "y"] if coordinate_fields else [])
+    if not chunks:
+        return SurveyColumns(np.empty(0, np.int64), *(np.empty(0) for _ in names[1:]))
+    return SurveyColumns(*(np.concatenate([getattr(chunk, name) for chunk in chunks]) for name in names))
+
+
+def read_ogr_columns(path, field_names, layer_name=None, with_coordinates=False):
+    """Read the mapped fields of a GeoPackage/shapefile layer with GDAL/OGR.
+
+    Unmapped fields are ignored, and so is the geometry unless
+    with_coordinates is set. Feature ids are the OGR FIDs, which are also
+    the ids QGIS uses for these formats.
+    """
+    from osgeo import ogr
+
+    dataset = ogr.Open(path)
+    if dataset is None:
+        raise ValueError(f"Cannot open {path}")
+    layer = dataset.GetLayerByName(layer_name) if layer_name else dataset.GetLayer(0)
+    definition = layer.GetLayerDefn()
+
+    indices = []
+    for key in INPUT_KEYS:
+        index = definition.GetFieldIndex(field_names[key])
+        if index < 0:
+            raise ValueError(f"Field '{field_names[key]}' selected for {key} does not exist in {path}.")
+        indices.append(index)
+    wanted = {field_names[key] for key in INPUT_KEYS}
+    ignored = [definition.GetFieldDefn(i).GetName() for i in range(definition.GetFieldCount())]
+    layer.SetIgnoredFields([name for name in ignored if name not in wanted] + ([] if with_coordinates else ["OGR_GEOMETRY"]))
+
+    total = layer.GetFeatureCount()
+    fids = np.zeros(total, dtype=np.int64)
+    values = np.full((len(INPUT_KEYS) + (2 if with_coordinates else 0), total), np.nan)
+    count = 0
+    for feature in layer:
+        fids[count] = feature.GetFID()
+        for column, index in enumerate(indices):
+            if feature.IsFieldSetAndNotNull(index):
+                values[column, count] = feature.GetFieldAsDouble(index)
+        if with_coordinates:
+            geometry = feature.GetGeometryRef()
+            if geometry is not None and geometry.GetGeometryCount() > 0:
+                geometry = geometry.GetGeometryRef(0)
+            if geometry is not None and not geometry.IsEmpty():
+                values[4, count], values[5, count] = geometry.GetX(), geometry.GetY()
+        count += 1
+    return SurveyColumns(fids[:count], *values[:, :count])
+
+
+def read_survey(path, field_names, coordinate_fields=None):
+    """Read a survey file into SurveyColumns, choosing the reader by extension.
+
+    With coordinate_fields (the x and y column names of CSV surveys) the
+    point coordinates are read as well; OGR formats take them from the
+    geometry. A point shapefile is read straight from its .dbf (and .shp
+    for the coordinates), without OGR.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in CSV_EXTENSIONS:
+        return read_csv_columns(path, field_names, coordinate_fields)
+    if extension == ".shp" and dbf_path_for(path) is not None:
+        try:
+            points = PointShapes(path) if coordinate_fields is not None else None
+        except ValueError:
+            pass  # not a point shapefile: OGR reads the first point of each geometry
+        else:
+            return DbfTable(dbf_path_for(path), points).read_columns(field_names, with_coordinates=points is not None)
+    if extension in OGR_EXTENSIONS:
+        return read_ogr_columns(path, field_names, with_coordinates=coordinate_fields is not None)
+    raise ValueError(f"Unsupported survey format: {path}")
+
+
+def read_crs_wkt(path):
+    """WKT of the coordinate reference system of a survey file, or None if it has none (e.g. CSV exports)"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".shp":
+        prj_path = sibling_path(path, ".prj")
+        if prj_path is None:
+            return None
+        with open(prj_path, encoding="latin-1") as f:
+            return f.read().strip() or None
+    if extension in OGR_EXTENSIONS:
+        from osgeo import ogr
+
+        dataset = ogr.Open(path)
+        srs = dataset.GetLayer(0).GetSpatialRef() if dataset is not None else None
+        return srs.ExportToWkt() if srs is not None else None
+    return None
@@ -0,0 +1,289 @@
+import math
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from .engine import (
+    Moments, fit_from_moments, fit_rows, normalized_statistics, percentile_bounds, percentile_estimator, within_bounds,
+    SKETCH_BATCH_SIZE,
+)
+from .validation import batched_bounded_solve
+
+# Tiles along the longer side of the extent when no tile size is given
+AUTO_TILES_PER_AXIS = 8
+
+# Upper limit on the number of tiles; smaller tile sizes are enlarged to respect it
+MAX_TILES = 4096
+
+# TileFit.ring value of tiles that fall back to the global coefficients
+RING_GLOBAL = -1
+
+
+@dataclass
+class TileGrid:
+    """Square tiles of side size, nx columns by ny rows, with (x_min, y_min) as lower left corner.
+
+    Tiles are numbered row by row: tile = row * nx + column.
+    """
+    x_min: float
+    y_min: float
+    size: float
+    nx: int
+    ny: int
+
+    @classmethod
+    def covering(cls, x_min, y_min, x_max, y_max, size=0.0):
+        """Grid covering an extent, with an automatic tile size when size is 0"""
+        width = max(x_max - x_min, 0.0)
+        height = max(y_max - y_min, 0.0)
+        if size <= 0:
+            size = max(width, height) / AUTO_TILES_PER_AXIS or 1.0
+        nx = max(1, int(np.ceil(width / size)))
+        ny = max(1, int(np.ceil(height / size)))
+        if nx * ny > MAX_TILES:
+            size *= np.sqrt(nx * ny / MAX_TILES) * 1.001
+            nx = max(1, int(np.ceil(width / size)))
+            ny = max(1, int(np.ceil(height / size)))
+        return cls(float(x_min), float(y_min), float(size), nx, ny)
+
+    @classmethod
+    def covering_points(cls, x, y, size=0.0):
+        """Grid covering the finite coordinates of x and y"""
+        finite = np.isfinite(x) & np.isfinite(y)
+        if not finite.any():
+            raise ValueError("No point coordinates available for the regional fit.")
+        return cls.covering(x[finite].min(), y[finite].min(), x[finite].max(), y[finite].max(), size)
+
+    def __len__(self):
+        return self.nx * self.ny
+
+    def tile_ids(self, x, y):
+        """Tile of every point (points outside the grid go to the nearest edge tile), -1 for missing coordinates"""
+        finite = np.isfinite(x) & np.isfinite(y)
+        column = np.zeros(len(x), dtype=np.int64)
+        row = np.zeros(len(x), dtype=np.int64)
+        column[finite] = np.clip(np.floor((x[finite] - self.x_min) / self.size), 0, self.nx - 1)
+        row[finite] = np.clip(np.floor((y[finite] - self.y_min) / self.size), 0, self.ny - 1)
+        return np.where(finite, row * self.nx + column, -1)
+
+    def tile_id(self, x, y):
+        """tile_ids() for a single point, without array overhead"""
+        if not (math.isfinite(x) and math.isfinite(y)):
+            return -1
+        column = min(max(int((x - self.x_min) // self.size), 0), self.nx - 1)
+        row = min(max(int((y - self.y_min) // self.size), 0), self.ny - 1)
+        return row * self.nx + column
+
+    def ring(self, tile, distance):
+        """Tiles at Chebyshev distance exactly distance from tile"""
+        row, column = divmod(tile, self.nx)
+        tiles = []
+        for r in range(max(0, row - distance), min(self.ny, row + distance + 1)):
+            for c in range(max(0, column - distance), min(self.nx, column + distance + 1)):
+                if max(abs(r - row), abs(c - column)) == distance:
+                    tiles.append(r * self.nx + c)
+        return tiles
+
+
+def accumulate_tile_moments(tile_moments, values, tile_ids):
+    """Merge the rows of an (n, 4) array into a dict of per-tile Moments; rows with tile -1 are skipped"""
+    order = np.argsort(tile_ids, kind="stable")
+    sorted_ids = tile_ids[order]
+    for group in np.split(order, np.flatnonzero(np.diff(sorted_ids)) + 1):
+        if len(group) == 0 or tile_ids[group[0]] < 0:
+            continue
+        tile_moments.setdefault(int(tile_ids[group[0]]), Moments(values.shape[1])).update(values[group])
+
+
+@dataclass
+class TileFit:
+    """Coefficients of one tile and where its samples came from"""
+    tile: int
+    n: int
+    pooled: int
+    ring: int
+    coefficients: tuple
+    rmse: float
+    note: str = ""
+
+    @property
+    def source(self):
+        if self.ring == RING_GLOBAL:
+            return "global"
+        return "own" if self.ring == 0 else f"ring {self.ring}"
+
+
+@dataclass
+class RegionalFit:
+    """Per-tile coefficients on a TileGrid, blended bilinearly between tile centres"""
+    grid: TileGrid
+    tiles: list
+    global_fit: object
+    seconds: float = 0.0
+    solve_seconds: float = 0.0
+
+    def coefficient_grid(self):
+        """(ny, nx, 3) array of the tile coefficients"""
+        return np.array([tile.coefficients for tile in self.tiles]).reshape(self.grid.ny, self.grid.nx, 3)
+
+    def coefficients_at(self, x, y):
+        """(k1, k2, k3) arrays for the points x, y; the global coefficients where a coordinate is missing.
+
+        Each coefficient is interpolated bilinearly between the centres of the
+        four nearest tiles (clamped at the grid edges), so it changes
+        continuously across tile boundaries. The blend is a convex
+        combination, so it stays within the regression bounds.
+        """
+        grid = self.grid
+        values = self.coefficient_grid()
+        finite = np.isfinite(x) & np.isfinite(y)
+        u = np.clip((np.where(finite, x, grid.x_min) - grid.x_min) / grid.size - 0.5, 0, grid.nx - 1)
+        v = np.clip((np.where(finite, y, grid.y_min) - grid.y_min) / grid.size - 0.5, 0, grid.ny - 1)
+        c0 = np.minimum(np.floor(u).astype(np.int64), max(grid.nx - 2, 0))
+        r0 = np.minimum(np.floor(v).astype(np.int64), max(grid.ny - 2, 0))
+        c1 = np.minimum(c0 + 1, grid.nx - 1)
+        r1 = np.minimum(r0 + 1, grid.ny - 1)
+        fu = (u - c0)[:, None]
+        fv = (v - r0)[:, None]
+        blended = ((1 - fu) * (1 - fv) * values[r0, c0] + fu * (1 - fv) * values[r0, c1]
+                   + (1 - fu) * fv * values[r1, c0] + fu * fv * values[r1, c1])
+        blended[~finite] = self.global_fit.coefficients
+        return blended[:, 0], blended[:, 1], blended[:, 2]
+
+    def counts(self):
+        """Number of tiles per sample source (own, ring n, global)"""
+        counts = {}
+        for tile in self.tiles:
+            counts[tile.source] = counts.get(tile.source, 0) + 1
+        return counts
+
+
+def pool_tile(grid, tile_moments, tile, params):
+    """(pooled Moments, ring) of a tile: its own rows plus those of whole rings of neighbours until there are enough"""
+    pooled = Moments()
+    if tile in tile_moments:
+        pooled.merge(tile_moments[tile])
+    ring = 0
+    while pooled.n < params.min_tile_samples and ring < params.borrow_rings:
+        ring += 1
+        for neighbour in grid.ring(tile, ring):
+            if neighbour in tile_moments:
+                pooled.merge(tile_moments[neighbour])
+    return pooled, ring
+
+
+def fit_tiles(grid, tile_moments, global_fit, params):
+    """Fit every tile of grid; returns the TileFit list in tile order and the seconds of the batched solve.
+
+    A tile with fewer than params.min_tile_samples rows borrows the rows of
+    the surrounding rings of tiles, up to params.borrow_rings rings; if that
+    is still not enough, or the pooled rows cannot be fitted, it uses the
+    global coefficients. The bounded regressions of all tiles are solved
+    together by batched_bounded_solve on their stacked normalized Gram
+    matrices, so the cost is a few vectorized NumPy calls instead of one
+    lsq_linear per tile. The batch is small (at most MAX_TILES 3 x 3
+    problems), so it is solved in the calling thread.
+    """
+    pooled_tiles = []
+    fitted = []
+    grams = []
+    notes = {}
+    for tile in range(len(grid)):
+        pooled, ring = pool_tile(grid, tile_moments, tile, params)
+        if pooled.n < params.min_tile_samples:
+            notes[tile] = f"{pooled.n} samples within {ring} rings"
+        else:
+            try:
+                gram = normalized_statistics(pooled)[2]
+                if not np.isfinite(gram).all():
+                    raise ValueError("Non-finite regression statistics.")
+                grams.append(gram)
+                fitted.append(tile)
+            except ValueError as e:
+                notes[tile] = str(e)
+        pooled_tiles.append((pooled, ring))
+
+    start = time.perf_counter()
+    coefficients = {}
+    if grams:
+        grams = np.array(grams)
+        solved = batched_bounded_solve(grams[:, :3, :3], grams[:, :3, 3], params.bounds)
+        sse = (np.einsum("bi,bij,bj->b", solved, grams[:, :3, :3], solved)
+               - 2 * np.einsum("bi,bi->b", solved, grams[:, :3, 3]) + grams[:, 3, 3])
+        counts = np.array([pooled_tiles[tile][0].n for tile in fitted])
+        rmse = np.sqrt(np.maximum(sse, 0.0) / counts)
+        coefficients = {tile: (tuple(float(k) for k in k_tile), float(error))
+                        for tile, k_tile, error in zip(fitted, solved, rmse)}
+    solve_seconds = time.perf_counter() - start
+
+    tiles = []
+    for tile, (pooled, ring) in enumerate(pooled_tiles):
+        own = tile_moments.get(tile)
+        n = own.n if own is not None else 0
+        if tile in coefficients:
+            k, rmse = coefficients[tile]
+            tiles.append(TileFit(tile, n, pooled.n, ring, k, rmse))
+        else:
+            tiles.append(TileFit(tile, n, pooled.n, RING_GLOBAL, global_fit.coefficients, global_fit.rmse, notes[tile]))
+    return tiles, solve_seconds
+
+
+def regional_fit_from_moments(grid, tile_moments, global_moments, outlier_bounds, params, log):
+    """RegionalFit from the global and per-tile Moments of the outlier-filtered rows"""
+    with log.timed("fit", global_moments.n):
+        global_fit = fit_from_moments(global_moments, params.bounds, log)
+        global_fit.outlier_bounds = outlier_bounds
+
+        start = time.perf_counter()
+        tiles, solve_seconds = fit_tiles(grid, tile_moments, global_fit, params)
+    regional = RegionalFit(grid, tiles, global_fit, time.perf_counter() - start, solve_seconds)
+    log_regional_fit(log, regional)
+    return regional
+
+
+def fit_regional(columns, params, log, extent=None):
+    """Regional (tiled) fit of an in-memory SurveyColumns with x and y.
+
+    Outliers are removed with global percentile bounds, as in Optimized
+    mode. extent is (x_min, y_min, x_max, y_max) of the grid; by default it
+    covers the points.
+    """
+    if columns.x is None:
+        raise ValueError("Regional mode needs the point coordinates.")
+    with log.timed("filter", len(columns)):
+        values = fit_rows(columns, params.linearize, with_coordinates=True)
+        if len(values) == 0:
+            raise ValueError("No valid data found in the selected fields.")
+
+        estimator = percentile_estimator(params)
+        for start in range(0, len(values), SKETCH_BATCH_SIZE):
+            estimator.update(values[start:start + SKETCH_BATCH_SIZE, :4])
+        low, high = percentile_bounds(estimator, params)
+        filtered = values[within_bounds(values[:, :4], low, high)]
+    log.phase(f"\nPercentile bounds: {estimator.describe()}")
+    log.phase(f"\nData points after outlier removal: {len(filtered)}")
+    log.phase(f"Outliers removed: {len(values) - len(filtered)}")
+
+    with log.timed("correlation", len(filtered)):
+        grid = TileGrid.covering(*extent, params.tile_size) if extent is not None \
+            else TileGrid.covering_points(columns.x, columns.y, params.tile_size)
+        tile_moments = {}
+        accumulate_tile_moments(tile_moments, filtered[:, :4], grid.tile_ids(filtered[:, 4], filtered[:, 5]))
+        global_moments = Moments.from_values(filtered[:, :4])
+    return regional_fit_from_moments(grid, tile_moments, global_moments, (low, high), params, log)
+
+
+def log_regional_fit(log, regional):
+    """Summary of a RegionalFit, its timing and its per-tile coefficients"""
+    grid = regional.grid
+    log.summary(f"\nRegional fit: {grid.nx} x {grid.ny} tiles of {grid.size:.6g} layer units")
+    log.summary("Tile sample sources: " + ", ".join(f"{source}: {n}" for source, n in sorted(regional.counts().items())))
+    solved = sum(tile.ring != RING_GLOBAL for tile in regional.tiles)
+    log.summary(f"Tile fits: {regional.seconds:.3f} s, of which {regional.solve_seconds:.3f} s in one batched solve "
+                f"of {solved} tiles")
+    log.phase("\ntile\tcolumn\trow\tn\tpooled\tsource\tk1\tk2\tk3\trmse\tnote")
+    for tile in regional.tiles:
+        row, column = divmod(tile.tile, grid.nx)
+        k1, k2, k3 = tile.coefficients
+        log.phase(f"{tile.tile}\t{column}\t{row}\t{tile.n}\t{tile.pooled}\t{tile.source}\t"
+                  f"{k1:.4f}\t{k2:.4f}\t{k3:.4f}\t{tile.rmse:.4f}\t{tile.note}")
@@ -0,0 +1,158 @@
+import math
+
+import numpy as np
+
+# Empirical KLL constant: a sketch of size k has a normalized rank error of about KLL_ERROR_CONSTANT / k
+KLL_ERROR_CONSTANT = 1.7
+
+
+def k_for_error(epsilon):
+    """Sketch size parameter giving a normalized rank error of about epsilon"""
+    return max(8, int(math.ceil(KLL_ERROR_CONSTANT / epsilon)))
+
+
+class KLLSketch:
+    """Mergeable streaming quantile sketch for one column (Karnin, Lang, Liberty 2016).
+
+    Items are kept in levels; an item at level h stands for 2**h input
+    values. When a level outgrows its capacity it is sorted and every other
+    item (from a random offset) is promoted to the next level. Memory stays
+    around 3*k items regardless of the number of values seen. The exact
+    minimum and maximum are tracked separately, so the 0 and 1 quantiles
+    are exact.
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - 1 - level
+        return max(2, int(math.ceil(self.k * (2.0 / 3.0) ** depth)))
+
+    def update(self, values):
+        """Add a batch of values (NaN values are ignored)"""
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.n += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other):
+        """Add all values summarized by another KLLSketch"""
+        if other.n == 0:
+            return
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # Keep one item at this level if the count is odd
+                keep = items[:len(items) % 2]
+                pairs = items[len(keep):]
+                promoted = pairs[self._rng.integers(2)::2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def quantile(self, q):
+        """Approximate q-quantile (0 <= q <= 1), NaN if no values were seen"""
+        if self.n == 0:
+            return np.nan
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(items)
+        items = items[order]
+        cumulative = np.cumsum(weights[order])
+        position = min(np.searchsorted(cumulative, q * cumulative[-1], side="left"), len(items) - 1)
+        return float(np.clip(items[position], self.min, self.max))
+
+
+class ColumnSketches:
+    """One KLLSketch per column of (n, width) batches"""
+
+    def __init__(self, width=4, epsilon=0.001, seed=0):
+        self.epsilon = epsilon
+        self.sketches = [KLLSketch(k_for_error(epsilon), seed=seed + column) for column in range(width)]
+
+    @property
+    def n(self):
+        return self.sketches[0].n
+
+    def describe(self):
+        return f"approximate (KLL sketch, rank error about {self.epsilon:.2%})"
+
+    def update(self, values):
+        for column, sketch in enumerate(self.sketches):
+            sketch.update(values[:, column])
+
+    def merge(self, other):
+        for sketch, other_sketch in zip(self.sketches, other.sketches):
+            sketch.merge(other_sketch)
+
+    def quantile(self, q):
+        return np.array([sketch.quantile(q) for sketch in self.sketches])
+
+
+class ExactQuantiles:
+    """Same interface as ColumnSketches, keeping every value for exact quantiles.
+
+    Matches pandas' DataFrame.quantile() (linear interpolation). Memory grows
+    with the number of rows.
+    """
+
+    def __init__(self, width=4):
+        self.width = width
+        self.batches = []
+
+    @property
+    def n(self):
+        return sum(len(batch) for batch in self.batches)
+
+    def describe(self):
+        return "exact"
+
+    def update(self, values):
+        if len(values):
+            self.batches.append(np.asarray(values, dtype=float))
+
+    def merge(self, other):
+        self.batches.extend(other.batches)
+
+    def quantile(self, q):
+        if not self.batches:
+            return np.full(self.width, np.nan)
+        if len(self.batches) > 1:
+            self.batches = [np.concatenate(self.batches)]
+        return np.quantile(self.batches[0], q, axis=0)
+
+
+def quantile_estimator(exact, epsilon, width=4):
+    """ExactQuantiles if exact, otherwise ColumnSketches with the given rank error"""
+    if exact:
+        return ExactQuantiles(width)
+    return ColumnSketches(width, epsilon)
@@ -0,0 +1,254 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+
+import numpy as np
+import pandas as pd
+from .engine import (
+    BOUNDS_LINEARIZED, BOUNDS_STANDARD, MODE_OPTIMIZED, Moments, fit_from_moments, ratio_term, within_bounds,
+)
+from .cache import output_stem
+from .processing_log import ProcessingLog
+
+
+def sweep_log_path_for(layer_path):
+    """Path of the sweep comparison log next to the layer source"""
+    return f"{output_stem(layer_path)}_hardness_sweep.txt"
+
+
+@dataclass
+class SweepConfig:
+    """One fit configuration of a parameter sweep"""
+    linearize: bool
+    lower_percentile: float
+    upper_percentile: float
+    bounds: tuple
+
+    def label(self):
+        (k1_low, k2_low, k3_low), (k1_high, k2_high, k3_high) = self.bounds
+        return (f"{'linearized' if self.linearize else 'standard'}, "
+                f"{self.lower_percentile * 100:g}-{self.upper_percentile * 100:g}%, "
+                f"k1 {k1_low:g}-{k1_high:g} k2 {k2_low:g}-{k2_high:g} k3 {k3_low:g}-{k3_high:g}")
+
+    def parameters(self, params):
+        """Copy of params set up to apply this configuration in Optimized mode"""
+        default = BOUNDS_LINEARIZED if self.linearize else BOUNDS_STANDARD
+        return replace(params, mode=MODE_OPTIMIZED, linearize=self.linearize,
+                       lower_percentile=self.lower_percentile, upper_percentile=self.upper_percentile,
+                       exact_quantiles=True, k_bounds=None if self.bounds == default else self.bounds)
+
+
+def sweep_configs(linearize_options, percentile_pairs, extra_bounds=()):
+    """Every combination of the given settings, with the default k bounds of each formulation plus extra_bounds"""
+    configs = []
+    for linearize in linearize_options:
+        for lower, upper in percentile_pairs:
+            for bounds in [BOUNDS_LINEARIZED if linearize else BOUNDS_STANDARD, *extra_bounds]:
+                configs.append(SweepConfig(linearize, lower, upper, bounds))
+    return configs
+
+
+def parse_percentile_pairs(text):
+    """(lower, upper) fractions from percent pairs such as "5-95, 1-99" (raises ValueError)"""
+    pairs = []
+    for item in text.replace(";", ",").split(","):
+        if not item.strip():
+            continue
+        try:
+            lower, upper = (float(value) / 100 for value in item.split("-"))
+        except ValueError:
+            raise ValueError(f"Cannot read the percentile pair '{item.strip()}'; use lower-upper, e.g. 5-95.")
+        if not (0 <= lower < upper <= 1):
+            raise ValueError(f"Percentile pair '{item.strip()}' must satisfy 0 <= lower < upper <= 100.")
+        pairs.append((lower, upper))
+    if not pairs:
+        raise ValueError("Enter at least one lower-upper percentile pair.")
+    return pairs
+
+
+def parse_bounds(text):
+    """k bound sets from "k1min k1max k2min k2max k3min k3max" groups separated by ";" (raises ValueError)"""
+    options = []
+    for item in text.split(";"):
+        if not item.strip():
+            continue
+        try:
+            values = [float(value) for value in item.replace(",", " ").split()]
+        except ValueError:
+            values = []
+        if len(values) != 6 or any(low > high for low, high in zip(values[::2], values[1::2])):
+            raise ValueError(f"Cannot read the k bounds '{item.strip()}'; use k1min k1max k2min k2max k3min k3max.")
+        options.append((values[::2], values[1::2]))
+    return options
+
+
+class SortedColumns:
+    """Regression rows of one E1/E2 formulation with every column sorted once.
+
+    Exact percentiles at any level are then an index lookup (linear
+    interpolation, as np.quantile and pandas), so all percentile settings
+    of a sweep share a single sort.
+    """
+
+    def __init__(self, values):
+        self.values = values
+        self.sorted = np.sort(values, axis=0)
+
+    def quantile(self, q):
+        position = q * (len(self.sorted) - 1)
+        below = int(np.floor(position))
+        above = min(below + 1, len(self.sorted) - 1)
+        fraction = position - below
+        return self.sorted[below] * (1 - fraction) + self.sorted[above] * fraction
+
+
+@dataclass
+class SweepResult:
+    """Outcome of one SweepConfig.
+
+    r2 is on the configuration's own retained and normalized rows, so it
+    only compares configurations that share them. depth_rmse is in depth
+    units on the compared rows that every fitted configuration retains,
+    so it ranks all configurations on the same footing.
+    """
+    config: SweepConfig
+    fit: object
+    retained: int
+    r2: float
+    seconds: float
+    error: str = ""
+    depth_rmse: float = float("nan")
+    compared: int = 0
+
+
+def regression_columns(columns, linearize):
+    """(n, 4) FIT_COLUMNS of every columns.fit_mask row, non-finite values kept so both formulations stay row-aligned"""
+    fit_mask = columns.fit_mask
+    e1 = columns.e1[fit_mask]
+    return np.column_stack([e1, ratio_term(e1, columns.e2[fit_mask], linearize),
+                            columns.peak_sv[fit_mask], columns.depth[fit_mask]])
+
+
+def depth_rmse(fit, values):
+    """RMSE in depth units of a fit's predictions for rows of FIT_COLUMNS, with the normalization of its own rows"""
+    if len(values) == 0:
+        return float("nan")
+    moments = fit.moments
+    value_range = moments.max - moments.min
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = np.where(value_range > 0, 1.0 / value_range, 0.0)
+    predicted = ((values[:, :3] - moments.min[:3]) * scale[:3]) @ np.asarray(fit.coefficients)
+    residual = moments.min[3] + predicted * value_range[3] - values[:, 3]
+    return float(np.sqrt(np.mean(residual ** 2)))
+
+
+def r_squared(fit):
+    """R² of a bounded fit (no intercept) against the variance of normalized depth"""
+    moments = fit.moments
+    value_range = moments.max[3] - moments.min[3]
+    total = moments.comoment[3, 3] / value_range ** 2 if value_range > 0 else 0.0
+    return float(1 - fit.rmse ** 2 * fit.n / total) if total > 0 else float("nan")
+
+
+def run_sweep(columns, configs, workers=0):
+    """Fit every SweepConfig on the same SurveyColumns; returns SweepResults in config order.
+
+    The regression rows of each formulation are built and sorted once;
+    configurations that differ only in their k bounds share the filtered
+    Moments. Groups of configurations are fitted in parallel threads.
+    Each fit normalizes by its own retained rows, so RMSE and R² differ in
+    scale between configurations; every fitted result therefore also gets
+    its depth_rmse on the rows that all fitted configurations retain.
+    """
+    quiet = ProcessingLog(None)
+    aligned = {linearize: regression_columns(columns, linearize) for linearize in {c.linearize for c in configs}}
+    finite = {linearize: np.isfinite(values).all(axis=1) for linearize, values in aligned.items()}
+    data = {linearize: SortedColumns(values[finite[linearize]]) for linearize, values in aligned.items()}
+    groups = {}
+    for index, config in enumerate(configs):
+        groups.setdefault((config.linearize, config.lower_percentile, config.upper_percentile), []).append(index)
+
+    def fit_group(key):
+        linearize, lower, upper = key
+        start = time.perf_counter()
+        rows = data[linearize]
+        if len(rows.values) == 0:
+            return [(index, SweepResult(configs[index], None, 0, float("nan"), 0.0, "No valid data"))
+                    for index in groups[key]]
+        low, high = rows.quantile(lower), rows.quantile(upper)
+        moments = Moments.from_values(rows.values[within_bounds(rows.values, low, high)])
+        shared = time.perf_counter() - start
+
+        results = []
+        for index in groups[key]:
+            start = time.perf_counter()
+            try:
+                fit = fit_from_moments(moments, configs[index].bounds, quiet)
+                fit.outlier_bounds = (low, high)
+                result = SweepResult(configs[index], fit, moments.n, r_squared(fit), 0.0)
+            except (ValueError, np.linalg.LinAlgError) as e:
+                result = SweepResult(configs[index], None, moments.n, float("nan"), 0.0, str(e))
+            result.seconds = shared + time.perf_counter() - start
+            results.append((index, result))
+        return results
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        results = dict(pair for group in executor.map(fit_group, groups) for pair in group)
+    results = [results[index] for index in range(len(configs))]
+
+    common = np.logical_and.reduce(list(finite.values()))
+    for result in results:
+        if result.fit is not None:
+            with np.errstate(invalid="ignore"):
+                common &= within_bounds(aligned[result.config.linearize], *result.fit.outlier_bounds)
+    for result in results:
+        if result.fit is not None:
+            result.depth_rmse = depth_rmse(result.fit, aligned[result.config.linearize][common])
+            result.compared = int(np.count_nonzero(common))
+    return results
+
+
+def best_result(results):
+    """Fitted SweepResult with the lowest depth_rmse on the common rows, None if there is none to rank"""
+    ranked = [result for result in results if result.fit is not None and np.isfinite(result.depth_rmse)]
+    return min(ranked, key=lambda result: result.depth_rmse, default=None)
+
+
+def comparison_table(results):
+    """DataFrame comparing SweepResults, one row per configuration"""
+    rows = []
+    for number, result in enumerate(results, 1):
+        config = result.config
+        (k1_low, k2_low, k3_low), (k1_high, k2_high, k3_high) = config.bounds
+        k1, k2, k3 = result.fit.coefficients if result.fit is not None else (np.nan,) * 3
+        rows.append({
+            "#": number,
+            "E1/E2": "linearized" if config.linearize else "standard",
+            "Lower %": config.lower_percentile * 100,
+            "Upper %": config.upper_percentile * 100,
+            "k bounds": f"{k1_low:g}-{k1_high:g}, {k2_low:g}-{k2_high:g}, {k3_low:g}-{k3_high:g}",
+            "k1": k1,
+            "k2": k2,
+            "k3": k3,
+            "RMSE": result.fit.rmse if result.fit is not None else np.nan,
+            "R²": result.r2,
+            "Depth RMSE": result.depth_rmse,
+            "Retained": result.retained,
+            "Time (ms)": result.seconds * 1000,
+            "Note": result.error,
+        })
+    return pd.DataFrame(rows).set_index("#")
+
+
+def log_sweep(log, results):
+    """Comparison table of a sweep"""
+    table = comparison_table(results)
+    log.summary(f"\nParameter sweep: {len(results)} configurations")
+    log.summary(table.round({"k1": 4, "k2": 4, "k3": 4, "RMSE": 4, "R²": 4, "Depth RMSE": 4, "Time (ms)": 1}).to_string())
+    compared = max((result.compared for result in results), default=0)
+    log.summary("RMSE and R² are on each configuration's own min-max normalized rows; Depth RMSE compares all "
+                f"configurations in depth units on the {compared} rows that every fitted configuration retains.")
+    best = best_result(results)
+    if best is not None:
+        log.summary(f"Lowest Depth RMSE: {best.depth_rmse:.4f} with {best.config.label()}")
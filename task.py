@@ -0,0 +1,924 @@
+from qgis.core import QgsApplication, QgsTask, QgsField, QgsVectorLayerFeatureSource
+from qgis.PyQt.QtCore import QVariant
+import numpy as np
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import replace
+from .cache import change_stamp, fit_cache_key, output_stem, source_path
+from .dbf import DbfTable, PointShapes
+from .extraction import direct_dbf_path, extract_columns, iter_column_chunks, sample_features
+from .engine import (
+    CONFIDENCE_HIGH, CONFIDENCE_LOW, MODE_MANUAL, MODE_OPTIMIZED, MODE_REGIONAL, Moments, confidence_labels,
+    evaluate_hardness, fit_coefficients, fit_from_moments, fit_pooled, fit_rows, input_diagnostics, input_digest, percentile_bounds,
+    percentile_estimator, within_bounds,
+)
+from .incremental import RunState, StateRecorder, load_state, state_path_for
+from .instrumentation import PROFILED_PHASES, Instrumentation, profile_path_for, timing_path_for
+from .preview import PREVIEW_STRATA_PER_AXIS
+from .processing_log import DEBUG, LEVEL_NAMES, ProcessingLog, log_path_for
+from .raster import HardnessGrid, RasterGrid, grid_path_for, write_geotiff
+from .regional import TileGrid, accumulate_tile_moments, fit_regional, regional_fit_from_moments
+from .validation import BlockGrams, interval_confidence, log_validation, validate_fit
+from .sweep import log_sweep, run_sweep, sweep_log_path_for
+from .writer import BatchWriter
+
+
+class PhaseFeedback:
+    """Map the 0-100 progress of one phase onto a [start, end] slice of a task"""
+
+    def __init__(self, task, start, end):
+        self.task = task
+        self.start = start
+        self.end = end
+
+    def isCanceled(self):
+        return self.task.isCanceled()
+
+    def setProgress(self, progress):
+        self.task.setProgress(self.start + (self.end - self.start) * progress / 100)
+
+
+def open_direct_table(dbf_path, field_names, log, shp_path=None):
+    """DbfTable to read the mapped fields (and with shp_path the points) from directly, or None to read them through the data provider"""
+    if dbf_path is None:
+        return None
+    try:
+        table = DbfTable(dbf_path, PointShapes(shp_path) if shp_path is not None else None)
+        table.mapped_fields(field_names)
+    except (OSError, ValueError) as e:
+        log.phase(f"Reading through the data provider, the attribute table cannot be read directly: {e}")
+        return None
+    log.phase(f"Reading attributes directly from {dbf_path}")
+    return table
+
+
+def batch_log_path_for(layer_path):
+    """Path of the combined log of a batch, next to the source of its first layer"""
+    return f"{output_stem(layer_path)}_hardness_batch.txt"
+
+
+def plugin_cache_dir():
+    """Directory of the persistent fit cache inside the QGIS profile"""
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), "hardness_calculator", "fit_cache")
+
+
+def unique_field_name(existing_fields, base_name):
+    """First of base_name, base_name_1, base_name_2, ... not in existing_fields"""
+    name = base_name
+    counter = 1
+    while name in existing_fields:
+        name = f"{base_name}_{counter}"
+        counter += 1
+    return name
+
+
+class HardnessTask(QgsTask):
+    """Extract, fit, evaluate and write hardness for one layer in the background.
+
+    Everything that touches the layer object itself is done in __init__ and
+    finished(), which run on the main thread; run() only uses a feature
+    source snapshot and the data provider. on_finished is called with the
+    task once it completes, fails or is canceled. With a FitCache, Optimized
+    runs on an unchanged file-based layer reuse the stored fit; a fit given
+    directly (a configuration chosen from a parameter sweep) is used as is.
+    A task created for a BatchHardnessTask is not scheduled itself: the
+    batch calls its steps and its progress and cancelation follow the batch.
+    """
+
+    def __init__(self, layer, params, log_level, on_finished=None, cache=None, fit=None, batch=None):
+        super().__init__(f"Hardness Calculator: {layer.name()}", QgsTask.CanCancel)
+        self.layer = layer
+        self.params = params
+        self.log_level = log_level
+        self.on_finished = on_finished
+
+        self.layer_name = layer.name()
+        self.layer_path = layer.source()
+        self.fields = layer.fields()
+        self.feature_count = layer.featureCount()
+        extent = layer.extent()
+        self.extent = (extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum())
+        self.source = QgsVectorLayerFeatureSource(layer)
+        self.provider = layer.dataProvider()
+        self.dbf_path = direct_dbf_path(layer)
+        self.crs_wkt = layer.crs().toWkt()
+
+        self.coefficients = None
+        self.error = None
+        self.write_failed = False
+        self.write_report = None
+        self.grid_path = None
+        self.grid_error = None
+        self.writer = None
+        self.layer_changed = False
+        self.linearize = params.linearize
+        self.hardness_field_name = None
+        self.confidence_field_name = None
+        self.hardness_idx = -1
+        self.confidence_idx = -1
+
+        # The cache key needs the layer state, so it is computed here on the main thread
+        self.cache = cache
+        self.cache_key = self.current_cache_key() if cache is not None and params.mode == MODE_OPTIMIZED and not params.incremental else None
+        self.cached_fit = None
+        self.given_fit = fit
+        self.fit_origin = "the parameter sweep"
+        self.fit = None
+        self.regional = None
+        # Bootstrap intervals and maximum relative width that downgrade High confidence, if applied
+        self.interval_validation = None
+        self.max_relative_interval = 0.0
+        self.batch = batch
+
+    def isCanceled(self):
+        # A layer of a batch is never scheduled itself; it follows the batch task
+        if self.batch is not None:
+            return self.batch.isCanceled()
+        return super().isCanceled()
+
+    def setProgress(self, progress):
+        if self.batch is not None:
+            self.batch.member_progress(self, progress)
+        else:
+            super().setProgress(progress)
+
+    def current_cache_key(self):
+        """Fit cache key for the layer as it is now, or None if its content cannot be fingerprinted"""
+        if self.layer.isModified():
+            return None
+        stamp = change_stamp(self.layer_path)
+        if stamp is None:
+            return None
+        return fit_cache_key(self.layer_path, self.layer.featureCount(), stamp, self.params)
+
+    def run(self):
+        instrumentation = Instrumentation(self.params.profile)
+        try:
+            with ProcessingLog(log_path_for(self.layer_path), self.log_level, instrumentation=instrumentation) as log:
+                try:
+                    return self.process(log)
+                finally:
+                    self.report_timing(log, instrumentation)
+        except Exception as e:
+            self.error = str(e)
+            return False
+
+    def report_timing(self, log, instrumentation):
+        """Phase timing table in the log, JSON sidecar and, if requested, the cProfile dump"""
+        params = self.params
+        instrumentation.log_summary(log)
+        try:
+            instrumentation.save_json(timing_path_for(self.layer_path), layer=self.layer_path, mode=params.mode,
+                                      linearize=params.linearize, streaming=params.streaming,
+                                      incremental=params.incremental, features=self.feature_count)
+            log.phase(f"Timing written to {timing_path_for(self.layer_path)}")
+            if instrumentation.profiler is not None:
+                instrumentation.save_profile(profile_path_for(self.layer_path))
+                log.summary(f"Profile of the {', '.join(PROFILED_PHASES)} phases written to {profile_path_for(self.layer_path)}")
+        except OSError as e:
+            log.summary(f"Warning: could not save the timing files: {e}")
+
+    def process(self, log):
+        params = self.params
+        log.summary(f"Processing layer: {self.layer_name}")
+        log.summary(f"Layer path: {self.layer_path}")
+        log.summary(f"Linearization: {'Enabled' if params.linearize else 'Disabled'}")
+        log.summary(f"Log level: {LEVEL_NAMES[log.level]}")
+        if params.streaming:
+            log.summary(f"Streaming mode: chunks of {params.chunk_size} features")
+        log.summary("Selected fields:")
+        for key, value in params.field_names.items():
+            log.summary(f"  {key}: {value}")
+
+        if params.incremental:
+            return self.process_incremental(log)
+
+        if self.given_fit is not None:
+            self.cached_fit = self.given_fit
+        elif self.cache_key is not None:
+            self.cached_fit = self.cache.get(self.cache_key)
+            log.summary(f"Fit cache: {'hit' if self.cached_fit is not None else 'miss'} (key {self.cache_key[:12]})")
+        elif self.cache is not None and params.mode == MODE_OPTIMIZED:
+            log.summary("Fit cache: not used (layer has unsaved edits or is not file based)")
+
+        if params.streaming:
+            return self.process_streaming(log)
+        return self.process_in_memory(log)
+
+    def process_in_memory(self, log):
+        params = self.params
+        columns = self.read_columns(log, PhaseFeedback(self, 0, 60))
+        if columns is None:
+            return self.canceled(log)
+        log.summary(f"\nTotal features in layer: {len(columns)}")
+
+        n_valid = int(np.count_nonzero(columns.fit_mask))
+        if n_valid == 0:
+            return self.failed(log, "No valid data found in the selected fields.")
+        log.summary(f"Valid features for processing: {n_valid}")
+
+        if params.mode == MODE_REGIONAL:
+            fit = lambda: fit_regional(columns, params, log, self.extent)
+        else:
+            fit = lambda: fit_coefficients(columns, params, log)
+        if not self.resolve_coefficients(log, fit):
+            return False
+        self.setProgress(70)
+        if self.isCanceled():
+            return self.canceled(log)
+        return self.evaluate_and_write(log, columns)
+
+    @property
+    def with_coordinates(self):
+        """Whether the point coordinates are read: for the regional fit or the hardness grid of a full run"""
+        params = self.params
+        return not params.incremental and (params.mode == MODE_REGIONAL or params.grid)
+
+    def direct_table(self, log):
+        """open_direct_table() for this layer, with its points when the coordinates are read"""
+        return open_direct_table(self.dbf_path, self.params.field_names, log,
+                                 source_path(self.layer_path) if self.with_coordinates else None)
+
+    def read_columns(self, log, feedback):
+        """Extract the mapped attributes into columnar arrays (geometry only for the regional fit or grid); None if canceled"""
+        params = self.params
+        with_coordinates = self.with_coordinates
+        table = self.direct_table(log)
+        with log.timed("extract") as phase:
+            if table is not None:
+                columns = table.read_columns(params.field_names, feedback, with_coordinates)
+            else:
+                columns = extract_columns(self.source, self.fields, params.field_names, self.feature_count,
+                                          feedback, with_coordinates)
+            phase.rows += len(columns) if columns is not None else 0
+        return columns
+
+    def evaluate_and_write(self, log, columns):
+        """Evaluate the formula over the extracted columns, write the result fields and record the run"""
+        total_features = len(columns)
+        log.phase(f"\nStarting hardness calculation for {total_features} features")
+        hardness, confidence = self.evaluate(log, columns)
+        log.write_counts("\nRow diagnostics:")
+        self.setProgress(75)
+        if self.isCanceled():
+            return self.canceled(log)
+
+        # Write results back in batches
+        self.add_result_fields(log)
+        log.phase(f"\nApplying {total_features} changes to layer...")
+        completed = False
+        try:
+            with log.timed("write", total_features):
+                completed = self.writer.write(columns.fids, hardness, confidence, PhaseFeedback(self, 75, 100))
+        finally:
+            if not completed:
+                self.remove_result_fields(log)
+        if not completed:
+            return self.canceled(log)
+        recorder = self.new_state_recorder(log)
+        if recorder is not None:
+            recorder.append(columns.fids, input_digest(columns))
+        grid = self.new_grid()
+        if grid is not None:
+            with log.timed("grid", len(columns)):
+                grid.update(columns.x, columns.y, hardness)
+            self.save_grid(log, grid)
+        return self.completed(log, recorder)
+
+    def process_streaming(self, log):
+        """Three chunked passes over the layer with memory bounded by the chunk size"""
+        params = self.params
+
+        chunks = self.chunks
+        evaluate_start = 0
+        if params.mode != MODE_MANUAL and self.cached_fit is None:
+            # Pass 1: quantile sketch of the regression columns for the percentile bounds
+            estimator = percentile_estimator(params)
+            for chunk in log.timed_chunks("extract", chunks(log, 0, 30)):
+                with log.timed("filter", len(chunk)):
+                    estimator.update(fit_rows(chunk, params.linearize))
+            if self.isCanceled():
+                return self.canceled(log)
+            n_valid = estimator.n
+            if n_valid == 0:
+                return self.failed(log, "No valid data found in the selected fields.")
+            log.summary(f"\nValid features for processing: {n_valid}")
+            log.phase(f"Percentile bounds: {estimator.describe()}")
+            low, high = percentile_bounds(estimator, params)
+
+            # Pass 2: sufficient statistics of the rows within the bounds, per tile in regional mode
+            moments = Moments()
+            regional = params.mode == MODE_REGIONAL
+            grid = TileGrid.covering(*self.extent, params.tile_size) if regional else None
+            tile_moments = {}
+            block_grams = BlockGrams() if params.validation and params.mode == MODE_OPTIMIZED else None
+            for chunk in log.timed_chunks("extract", chunks(log, 30, 60)):
+                with log.timed("correlation", len(chunk)):
+                    values = fit_rows(chunk, params.linearize, regional)
+                    values = values[within_bounds(values[:, :4], low, high)]
+                    moments.update(values[:, :4])
+                    if block_grams is not None:
+                        block_grams.update(values)
+                    if regional:
+                        accumulate_tile_moments(tile_moments, values[:, :4], grid.tile_ids(values[:, 4], values[:, 5]))
+            if self.isCanceled():
+                return self.canceled(log)
+            log.phase(f"\nData points after outlier removal: {moments.n}")
+            log.phase(f"Outliers removed: {n_valid - moments.n}")
+            evaluate_start = 60
+
+        def fit():
+            if params.mode == MODE_REGIONAL:
+                return regional_fit_from_moments(grid, tile_moments, moments, (low, high), params, log)
+            with log.timed("fit", moments.n):
+                fit = fit_from_moments(moments, params.bounds, log)
+            fit.outlier_bounds = (low, high)
+            if block_grams is not None:
+                with log.timed("validate", moments.n):
+                    fit.validation = validate_fit(block_grams, moments, params, params.workers)
+            return fit
+
+        if not self.resolve_coefficients(log, fit):
+            return False
+
+        # Pass 3: evaluate and write chunk by chunk, binning the hardness onto the grid if requested
+        self.add_result_fields(log)
+        log.phase("\nStarting chunked hardness calculation and write")
+        grid = self.new_grid()
+        recorder = self.new_state_recorder(log)
+        completed = False
+        total_features = 0
+        try:
+            for chunk in log.timed_chunks("extract", chunks(log, evaluate_start, 100)):
+                hardness, confidence = self.evaluate(log, chunk)
+                with log.timed("write", len(chunk)):
+                    self.writer.write(chunk.fids, hardness, confidence)
+                if grid is not None:
+                    with log.timed("grid", len(chunk)):
+                        grid.update(chunk.x, chunk.y, hardness)
+                total_features += len(chunk)
+                if recorder is not None:
+                    recorder.append(chunk.fids, input_digest(chunk))
+            completed = not self.isCanceled()
+        finally:
+            if not completed:
+                self.remove_result_fields(log)
+                if recorder is not None:
+                    recorder.discard()
+        if not completed:
+            return self.canceled(log)
+
+        log.summary(f"\nTotal features in layer: {total_features}")
+        log.write_counts("\nRow diagnostics:")
+        if grid is not None:
+            self.save_grid(log, grid)
+        return self.completed(log, recorder)
+
+    def process_incremental(self, log):
+        """Update the fields of the recorded run for new or edited features only"""
+        params = self.params
+        state = load_state(state_path_for(self.layer_path))
+        if state is None:
+            return self.failed(log, "No previous hardness run is recorded for this layer. Run a full calculation first.")
+        if state.field_names != params.field_names:
+            return self.failed(log, "The selected E1/E2/PeakSV/Depth fields differ from the recorded run. Run a full calculation instead.")
+
+        provider_fields = self.provider.fields()
+        self.hardness_field_name = state.hardness_field
+        self.confidence_field_name = state.confidence_field
+        self.hardness_idx = provider_fields.indexOf(state.hardness_field)
+        self.confidence_idx = provider_fields.indexOf(state.confidence_field)
+        if self.hardness_idx < 0 or self.confidence_idx < 0:
+            return self.failed(log, f"The recorded fields {state.hardness_field}/{state.confidence_field} no longer exist. Run a full calculation instead.")
+        # Keep the recorded Confidence field's representation, whatever the dialog asks for
+        coded = provider_fields.field(self.confidence_idx).type() != QVariant.String
+        self.writer = BatchWriter(self.provider, self.hardness_idx, self.confidence_idx, params.write_batch_size, coded)
+
+        self.coefficients = state.coefficients
+        self.linearize = state.linearize
+        # Recomputed rows get Confidence by the rule of the recorded run, so the field keeps one definition
+        self.interval_validation = state.validation
+        self.max_relative_interval = state.max_relative_interval
+        k1, k2, k3 = self.coefficients
+        log.summary("\nIncremental Mode Selected")
+        log.summary(f"Updating fields: {state.hardness_field}, {state.confidence_field}")
+        log.summary(f"Recorded parameters (linearization {'Enabled' if state.linearize else 'Disabled'}):")
+        log.summary(f"  k1: {k1:.4f}")
+        log.summary(f"  k2: {k2:.4f}")
+        log.summary(f"  k3: {k3:.4f}")
+        if state.validation is not None:
+            log.summary(f"High confidence is downgraded where the recorded {state.validation.level:.0%} bootstrap "
+                        f"interval is wider than {state.max_relative_interval * 100:g}% of hardness, as in the recorded run")
+
+        total_features = 0
+        recomputed = 0
+        still_recorded = 0
+        recorder = self.new_state_recorder(log)
+        completed = False
+        try:
+            for chunk in log.timed_chunks("extract", self.chunks(log, 0, 100)):
+                with log.timed("filter", len(chunk)):
+                    digests = input_digest(chunk)
+                    changed = state.changed(chunk.fids, digests)
+                    still_recorded += int(np.count_nonzero(state.known(chunk.fids)))
+                if changed.any():
+                    rows = chunk.subset(changed)
+                    hardness, confidence = self.evaluate(log, rows)
+                    with log.timed("write", len(rows)):
+                        self.writer.write(rows.fids, hardness, confidence)
+                    self.layer_changed = True
+                    recomputed += len(rows)
+                total_features += len(chunk)
+                if recorder is not None:
+                    recorder.append(chunk.fids, digests)
+            completed = not self.isCanceled()
+        finally:
+            if not completed and recorder is not None:
+                recorder.discard()
+        if not completed:
+            log.summary("Rows written so far are correct; the next incremental run will process them again.")
+            return self.canceled(log)
+
+        log.summary(f"\nTotal features in layer: {total_features}")
+        log.summary(f"New or modified features recomputed: {recomputed}")
+        log.summary(f"Unchanged features skipped: {total_features - recomputed}")
+        log.summary(f"Recorded features no longer in the layer: {len(state.fids) - still_recorded}")
+        log.write_counts("\nRow diagnostics (recomputed features):")
+        return self.completed(log, recorder)
+
+    def chunks(self, log, start, end):
+        """Chunked read of the mapped attributes, reporting progress in [start, end]"""
+        params = self.params
+        with_coordinates = self.with_coordinates
+        # Opened per pass: adding the result fields rewrites the table
+        table = self.direct_table(log)
+        if table is not None:
+            return table.iter_chunks(params.field_names, params.chunk_size, PhaseFeedback(self, start, end),
+                                     with_coordinates)
+        return iter_column_chunks(self.source, self.fields, params.field_names, params.chunk_size,
+                                  self.feature_count, PhaseFeedback(self, start, end), with_coordinates)
+
+    def new_grid(self):
+        """HardnessGrid over the layer extent if a hardness raster is requested, else None"""
+        params = self.params
+        if not params.grid:
+            return None
+        return HardnessGrid(RasterGrid.covering(*self.extent, params.grid_cell_size), params.grid_median)
+
+    def save_grid(self, log, grid):
+        """Write the hardness grid as a GeoTIFF next to the layer; a failure is logged but keeps the written fields"""
+        path = grid_path_for(self.layer_path)
+        try:
+            with log.timed("grid"):
+                write_geotiff(path, grid.grid, grid.bands(self.params), self.crs_wkt)
+        except (ImportError, OSError, RuntimeError) as e:
+            self.grid_error = str(e)
+            log.summary(f"\nWarning: the hardness grid could not be written: {e}")
+            return
+        self.grid_path = path
+        log.summary(f"\nHardness grid: {grid.describe()}")
+        log.summary(f"Grid written to {path}")
+
+    def new_state_recorder(self, log):
+        """StateRecorder for the rows of this run; None after a regional fit, which is not recorded"""
+        if self.regional is not None:
+            return None
+        try:
+            return StateRecorder(state_path_for(self.layer_path))
+        except OSError as e:
+            log.summary(f"Warning: could not save the run state for incremental updates: {e}")
+            return None
+
+    def save_run_state(self, log, recorder, unwritten):
+        """Record the fields, coefficients and row inputs of this run for later incremental runs.
+
+        The unwritten fids are recorded as changed so the next incremental run writes them again.
+        """
+        if self.regional is not None:
+            # Per-tile coefficients are not recorded; an older state would update other fields
+            try:
+                os.remove(state_path_for(self.layer_path))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                log.summary(f"Warning: could not remove the previous run state: {e}")
+            log.phase("Incremental updates are not available after a regional run")
+            return
+        if recorder is None:
+            return
+        state = RunState(self.hardness_field_name, self.confidence_field_name, tuple(self.coefficients),
+                         self.linearize, self.params.field_names, None, None, self.interval_validation,
+                         self.max_relative_interval)
+        try:
+            recorder.save(state, unwritten)
+            log.phase(f"Run state saved to {state_path_for(self.layer_path)}")
+        except OSError as e:
+            log.summary(f"Warning: could not save the run state for incremental updates: {e}")
+
+    def resolve_coefficients(self, log, fit):
+        """Take k1, k2, k3 from the parameters (Manual) or by calling fit() (Optimized)"""
+        params = self.params
+        if params.mode == MODE_MANUAL:
+            k1, k2, k3 = params.k1, params.k2, params.k3
+            log.summary("\nManual Mode Selected")
+            log.summary("User defined parameters:")
+        else:
+            log.summary(f"\n{'Regional' if params.mode == MODE_REGIONAL else 'Optimized'} Mode Selected")
+            log.summary("Percentile settings:")
+            log.summary(f"  Lower: {params.lower_percentile*100}%")
+            log.summary(f"  Upper: {params.upper_percentile*100}%")
+            log.summary(f"  Estimation: {percentile_estimator(params).describe()}")
+            if self.cached_fit is not None:
+                self.fit = self.cached_fit
+                origin = self.fit_origin if self.given_fit is not None else "cache"
+                log.summary(f"\nFit taken from {origin} ({self.fit.n} data points after outlier removal)")
+            else:
+                try:
+                    self.fit = fit()
+                except Exception as e:
+                    self.failed(log, f"An error occurred during regression: {e}")
+                    return False
+                if params.mode == MODE_REGIONAL:
+                    self.regional = self.fit
+                    self.fit = self.regional.global_fit
+                if self.cache_key is not None:
+                    try:
+                        self.cache.put(self.cache_key, self.fit)
+                        log.phase("Fit stored in cache")
+                    except OSError as e:
+                        log.summary(f"Warning: could not store the fit in the cache: {e}")
+            k1, k2, k3 = self.fit.coefficients
+            if self.regional is not None:
+                log.summary("\nGlobal Bounded Regression Results (fallback for tiles without enough samples):")
+            else:
+                log.summary("\nBounded Regression Results (Final Parameters):")
+        log.summary(f"  k1: {k1:.4f}")
+        log.summary(f"  k2: {k2:.4f}")
+        log.summary(f"  k3: {k3:.4f}")
+        if self.fit is not None and self.fit.validation is not None:
+            log_validation(log, self.fit)
+            if params.max_relative_interval > 0:
+                self.interval_validation = self.fit.validation
+                self.max_relative_interval = params.max_relative_interval
+        self.coefficients = (k1, k2, k3)
+        return True
+
+    def evaluate(self, log, columns):
+        """Evaluate hardness for a SurveyColumns and accumulate its diagnostics in log"""
+        with log.timed("evaluate", len(columns)):
+            if self.regional is not None:
+                k1, k2, k3 = self.regional.coefficients_at(columns.x, columns.y)
+            else:
+                k1, k2, k3 = self.coefficients
+            hardness, confidence = evaluate_hardness(columns, k1, k2, k3, self.linearize)
+            if self.interval_validation is not None:
+                log.count("High confidence downgraded (wide bootstrap interval)", interval_confidence(
+                    columns, hardness, confidence, self.interval_validation, self.linearize, self.max_relative_interval))
+
+            for reason, n in input_diagnostics(columns, hardness).items():
+                log.count(reason, n)
+            log.count("High confidence (full formula)", np.count_nonzero(confidence == CONFIDENCE_HIGH))
+            log.count("Low confidence (simplified formula)", np.count_nonzero(confidence == CONFIDENCE_LOW))
+            log.count("NULL hardness", np.count_nonzero(np.isnan(hardness)))
+
+            # The row lists are only built when they will be written
+            if log.enabled(DEBUG):
+                log.debug_rows(
+                    "\nfeature_id\tE1\tE2\tPeakSV\tDepth\thardness\tconfidence",
+                    zip(columns.fids.tolist(), columns.e1.tolist(), columns.e2.tolist(), columns.peak_sv.tolist(),
+                        columns.depth.tolist(), hardness.tolist(), confidence_labels(confidence).tolist())
+                )
+            return hardness, confidence
+
+    def add_result_fields(self, log):
+        """Add uniquely named Hardness/Confidence fields through the provider"""
+        existing_fields = [field.name() for field in self.fields]
+        hardness_field_name = unique_field_name(existing_fields, "Hardness")
+        confidence_field_name = unique_field_name(existing_fields, "Confidence")
+        self.hardness_field_name = hardness_field_name
+        self.confidence_field_name = confidence_field_name
+
+        log.summary("\nCreated fields:")
+        log.summary(f"  Hardness field: {hardness_field_name}")
+        log.summary(f"  Confidence field: {confidence_field_name}"
+                    f"{' (coded: 1 = High, 0 = Low)' if self.params.coded_confidence else ''}")
+
+        self.provider.addAttributes([
+            QgsField(hardness_field_name, QVariant.Double),
+            QgsField(confidence_field_name, QVariant.Int if self.params.coded_confidence else QVariant.String),
+        ])
+        self.layer_changed = True
+
+        # Provider indices, which differ from layer indices when the layer has joined or virtual fields
+        provider_fields = self.provider.fields()
+        self.hardness_idx = provider_fields.indexOf(hardness_field_name)
+        self.confidence_idx = provider_fields.indexOf(confidence_field_name)
+        self.writer = BatchWriter(self.provider, self.hardness_idx, self.confidence_idx,
+                                  self.params.write_batch_size, self.params.coded_confidence)
+
+    def remove_result_fields(self, log):
+        # Never leave half-written result fields behind
+        self.provider.deleteAttributes([self.hardness_idx, self.confidence_idx])
+        log.summary("Removed the partially written Hardness/Confidence fields.")
+
+    def completed(self, log, recorder):
+        """Retry the failed write batches, report what could not be written and record the run state"""
+        writer = self.writer
+        if writer.failed:
+            log.summary(f"\n{len(writer.failed)} of {writer.batches} write batches failed:")
+            for batch in writer.failed:
+                log.summary(f"  {batch.describe()}")
+            with log.timed("write"):
+                recovered = writer.retry()
+            log.summary(f"Retried: {recovered} features recovered")
+
+        unwritten = writer.unwritten_fids()
+        if not writer.success:
+            shown = ", ".join(str(fid) for fid in unwritten[:20].tolist())
+            self.write_failed = True
+            self.write_report = (f"{len(unwritten)} features could not be written, even on retry "
+                                 f"(fids {shown}{', ...' if len(unwritten) > 20 else ''}).")
+            log.summary(f"Warning: {self.write_report}")
+            log.debug(f"All unwritten fids: {unwritten.tolist()}")
+        else:
+            log.summary(f"All changes applied successfully ({writer.written} features in {writer.batches} batches)")
+        self.save_run_state(log, recorder, unwritten)
+        log.summary("\nProcessing completed successfully.")
+        return True
+
+    def failed(self, log, message):
+        self.error = message
+        log.summary(f"Error: {message}")
+        return False
+
+    def canceled(self, log):
+        log.summary("\nProcessing canceled by the user.")
+        return False
+
+    def finished(self, result):
+        # Back on the main thread: refresh the layer after provider-level changes
+        if self.layer_changed:
+            self.layer.updateFields()
+            self.layer.triggerRepaint()
+        # Writing the result fields changes the file stamp; keep the fit reachable for the next run
+        if result and self.fit is not None and self.cache is not None:
+            key = self.current_cache_key()
+            if key is not None and key != self.cache_key:
+                try:
+                    self.cache.put(key, self.fit)
+                except OSError:
+                    pass
+        if self.on_finished is not None:
+            self.on_finished(self, result)
+
+
+class BatchHardnessTask(QgsTask):
+    """Hardness for several layers with one set of coefficients, in one background task.
+
+    Every layer gets a HardnessTask member whose layer state is captured
+    here on the main thread. run() reads all layers concurrently, fits one
+    Optimized model with fit_pooled() from their merged statistics (Manual
+    mode uses k1, k2, k3 as given), then evaluates and writes every layer
+    concurrently, with params.workers threads. Layers of one file, such as
+    the layers of a GeoPackage, are written one after another, since
+    concurrent writers of one SQLite database fail with "database is
+    locked". Each layer keeps its own processing log and timing file; the
+    combined log next to the first layer holds the pooled fit and a table
+    of per-layer row counts, phase times and outcomes. Layers are read into
+    memory (no streaming), and Regional mode is not supported. Raises
+    ValueError for a layer listed twice.
+    """
+
+    def __init__(self, layers, params, log_level, on_finished=None):
+        super().__init__(f"Hardness Calculator batch: {len(layers)} layers", QgsTask.CanCancel)
+        self.params = replace(params, streaming=False, incremental=False)
+        self.log_level = log_level
+        self.on_finished = on_finished
+        self.members = [HardnessTask(layer, self.params, log_level, batch=self) for layer in layers]
+        if len({output_stem(member.layer_path) for member in self.members}) < len(self.members):
+            raise ValueError("The same data source is listed more than once.")
+        self.member_results = [False] * len(self.members)
+        self.progresses = {id(member): 0.0 for member in self.members}
+        self.log_path = batch_log_path_for(self.members[0].layer_path)
+        self.coefficients = None
+        self.fit = None
+        self.error = None
+
+    def member_progress(self, member, progress):
+        """Batch progress as the mean progress of the layers"""
+        self.progresses[id(member)] = progress
+        self.setProgress(sum(self.progresses.values()) / len(self.progresses))
+
+    def run(self):
+        try:
+            with ProcessingLog(self.log_path, self.log_level, instrumentation=Instrumentation()) as log, ExitStack() as stack:
+                member_logs = [stack.enter_context(ProcessingLog(log_path_for(member.layer_path), self.log_level,
+                                                                 instrumentation=Instrumentation()))
+                               for member in self.members]
+                try:
+                    return self.process(log, member_logs)
+                finally:
+                    self.log_members(log, member_logs)
+                    for member, member_log in zip(self.members, member_logs):
+                        member.report_timing(member_log, member_log.instrumentation)
+                    log.instrumentation.log_summary(log)
+        except Exception as e:
+            self.error = str(e)
+            return False
+
+    def process(self, log, member_logs):
+        params = self.params
+        members = self.members
+        log.summary(f"Batch of {len(members)} layers:")
+        for member in members:
+            log.summary(f"  {member.layer_name}: {member.layer_path}")
+        log.summary(f"Linearization: {'Enabled' if params.linearize else 'Disabled'}")
+        log.summary("Selected fields:")
+        for key, value in params.field_names.items():
+            log.summary(f"  {key}: {value}")
+        for member, member_log in zip(members, member_logs):
+            member_log.summary(f"Processing layer: {member.layer_name} (batch of {len(members)} layers, see {self.log_path})")
+            member_log.summary(f"Layer path: {member.layer_path}")
+            member_log.summary(f"Linearization: {'Enabled' if params.linearize else 'Disabled'}")
+
+        with ThreadPoolExecutor(max_workers=params.workers or os.cpu_count() or 1) as executor:
+            # Read every layer concurrently; the columns stay per layer
+            with log.timed("extract") as phase:
+                columns = list(executor.map(lambda member, member_log: member.read_columns(member_log, PhaseFeedback(member, 0, 40)),
+                                            members, member_logs))
+                phase.rows += sum(len(part) for part in columns if part is not None)
+            if self.isCanceled() or any(part is None for part in columns):
+                log.summary("\nBatch canceled by the user. No layer was modified.")
+                return False
+            for member_log, part in zip(member_logs, columns):
+                member_log.summary(f"\nTotal features in layer: {len(part)}")
+                member_log.summary(f"Valid features for processing: {int(np.count_nonzero(part.fit_mask))}")
+            log.summary(f"\nTotal features: {sum(len(part) for part in columns)}")
+
+            # One fit from the merged statistics of all layers
+            if params.mode == MODE_OPTIMIZED:
+                log.summary(f"\nOptimized Mode Selected, one fit pooled over {len(members)} layers")
+                log.summary(f"Percentile settings: {params.lower_percentile*100}% - {params.upper_percentile*100}%, "
+                            f"{percentile_estimator(params).describe()}")
+                try:
+                    self.fit = fit_pooled(columns, params, log)
+                except Exception as e:
+                    self.error = f"An error occurred during regression: {e}"
+                    log.summary(f"Error: {self.error}")
+                    return False
+                for member in members:
+                    member.given_fit = member.cached_fit = self.fit
+                    member.fit_origin = f"the fit pooled over {len(members)} layers"
+            for member, member_log in zip(members, member_logs):
+                member.resolve_coefficients(member_log, None)
+            self.coefficients = members[0].coefficients
+            k1, k2, k3 = self.coefficients
+            log.summary(f"\n{'Pooled bounded regression results' if self.fit is not None else 'User defined parameters'}:")
+            log.summary(f"  k1: {k1:.4f}")
+            log.summary(f"  k2: {k2:.4f}")
+            log.summary(f"  k3: {k3:.4f}")
+            if self.fit is not None and self.fit.validation is not None:
+                log_validation(log, self.fit)
+            if self.isCanceled():
+                log.summary("\nBatch canceled by the user. No layer was modified.")
+                return False
+
+            # Evaluate and write every file concurrently, the layers within one file in turn
+            files = {}
+            for index, member in enumerate(members):
+                files.setdefault(source_path(member.layer_path), []).append(index)
+
+            def write(indices):
+                for index in indices:
+                    member = members[index]
+                    try:
+                        self.member_results[index] = member.evaluate_and_write(member_logs[index], columns[index])
+                    except Exception as e:
+                        member.failed(member_logs[index], str(e))
+            list(executor.map(write, files.values()))
+
+        failed = [member for member in members if member.error is not None]
+        if failed:
+            self.error = (f"{len(failed)} of {len(members)} layers failed: "
+                          + "; ".join(f"{member.layer_name}: {member.error}" for member in failed))
+            log.summary(f"\nError: {self.error}")
+            return False
+        if self.isCanceled():
+            log.summary("\nBatch canceled by the user. Layers written before the cancel keep their results.")
+            return False
+        log.summary("\nBatch completed successfully.")
+        return True
+
+    def log_members(self, log, member_logs):
+        """Per-layer row counts, phase times and outcome in the combined log"""
+        log.summary("\nLayers:")
+        log.summary(f"  {'layer':<30}{'features':>12}{'extract s':>12}{'evaluate s':>12}{'write s':>10}  result")
+        for member, member_log, result in zip(self.members, member_logs, self.member_results):
+            phases = member_log.instrumentation.phases
+            times = [f"{phases[name].wall:.3f}" if name in phases else "" for name in ("extract", "evaluate", "write")]
+            if result:
+                outcome = member.write_report or f"{member.hardness_field_name}, {member.confidence_field_name}"
+            else:
+                outcome = member.error or "not written"
+            rows = phases["extract"].rows if "extract" in phases else ""
+            log.summary(f"  {member.layer_name[:29]:<30}{rows:>12}{times[0]:>12}{times[1]:>12}{times[2]:>10}  {outcome}")
+
+    def finished(self, result):
+        # Back on the main thread: refresh every layer that was changed
+        for member, member_result in zip(self.members, self.member_results):
+            member.finished(member_result)
+        if self.on_finished is not None:
+            self.on_finished(self, result)
+
+
+class SweepTask(QgsTask):
+    """Read a layer once and fit every configuration of a parameter sweep in the background.
+
+    Nothing is written to the layer; the comparison table goes to the sweep
+    log and the SweepResults are kept in results for the dialog.
+    """
+
+    def __init__(self, layer, params, configs, log_level, on_finished=None):
+        super().__init__(f"Hardness Calculator sweep: {layer.name()}", QgsTask.CanCancel)
+        self.layer_name = layer.name()
+        self.layer_path = layer.source()
+        self.fields = layer.fields()
+        self.feature_count = layer.featureCount()
+        self.source = QgsVectorLayerFeatureSource(layer)
+        self.dbf_path = direct_dbf_path(layer)
+        self.params = params
+        self.configs = configs
+        self.log_level = log_level
+        self.on_finished = on_finished
+        self.results = None
+        self.error = None
+
+    def run(self):
+        try:
+            with ProcessingLog(sweep_log_path_for(self.layer_path), self.log_level) as log:
+                log.summary(f"Parameter sweep on layer: {self.layer_name}")
+                log.summary(f"Layer path: {self.layer_path}")
+                table = open_direct_table(self.dbf_path, self.params.field_names, log)
+                if table is not None:
+                    columns = table.read_columns(self.params.field_names, PhaseFeedback(self, 0, 80))
+                else:
+                    columns = extract_columns(self.source, self.fields, self.params.field_names, self.feature_count,
+                                              PhaseFeedback(self, 0, 80))
+                if columns is None:
+                    log.summary("\nSweep canceled by the user.")
+                    return False
+                log.summary(f"\nTotal features in layer: {len(columns)}")
+                if not columns.fit_mask.any():
+                    self.error = "No valid data found in the selected fields."
+                    log.summary(f"Error: {self.error}")
+                    return False
+                self.results = run_sweep(columns, self.configs, self.params.workers)
+                log_sweep(log, self.results)
+                self.setProgress(100)
+                return not self.isCanceled()
+        except Exception as e:
+            self.error = str(e)
+            return False
+
+    def finished(self, result):
+        if self.on_finished is not None:
+            self.on_finished(self, result)
+
+
+class PreviewSampleTask(QgsTask):
+    """Read a random (or spatially stratified) sample of a layer in the background for the live preview"""
+
+    def __init__(self, layer, field_names, size, stratified, on_finished=None):
+        super().__init__(f"Hardness Calculator preview sample: {layer.name()}", QgsTask.CanCancel)
+        self.layer = layer  # only used from finished(), on the main thread
+        self.fields = layer.fields()
+        self.feature_count = layer.featureCount()
+        self.source = QgsVectorLayerFeatureSource(layer)
+        self.field_names = field_names
+        self.size = size
+        self.grid = None
+        if stratified:
+            extent = layer.extent()
+            self.grid = TileGrid.covering(extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum(),
+                                          max(extent.width(), extent.height()) / PREVIEW_STRATA_PER_AXIS)
+        self.on_finished = on_finished
+        self.columns = None
+        self.geometries = None
+        self.error = None
+
+    def run(self):
+        try:
+            sample = sample_features(self.source, self.fields, self.field_names, self.size, self.feature_count,
+                                     self.grid, self)
+            if sample is None:
+                return False
+            self.columns, self.geometries = sample
+            return True
+        except Exception as e:
+            self.error = str(e)
+            return False
+
+    def finished(self, result):
+        if self.on_finished is not None:
+            self.on_finished(self, result)
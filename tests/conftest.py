@@ -0,0 +1,17 @@
+"""Make the plugin folder importable as the package hardness_calculator, whatever the folder is called.
+
+The modules under test are the headless ones (engine, sketch, dbf, ...);
+nothing here needs QGIS.
+"""
+import importlib.util
+import os
+import sys
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if "hardness_calculator" not in sys.modules:
+    spec = importlib.util.spec_from_file_location("hardness_calculator", os.path.join(PLUGIN_DIR, "__init__.py"),
+                                                  submodule_search_locations=[PLUGIN_DIR])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["hardness_calculator"] = module
+    spec.loader.exec_module(module)
@@ -0,0 +1,114 @@
+import os
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from hardness_calculator.cache import FitCache, change_stamp, fit_cache_key, source_path
+from hardness_calculator.engine import HardnessParameters, Moments, fit_from_moments
+from hardness_calculator.processing_log import ProcessingLog
+
+FIELD_NAMES = {"E1": "E1", "E2": "E2", "PeakSV": "PeakSV", "Depth": "Depth"}
+
+
+def test_source_path_of_file_and_uri_sources():
+    assert source_path("/data/survey.shp") == "/data/survey.shp"
+    assert source_path("/data/survey.gpkg|layername=pings") == "/data/survey.gpkg"
+    assert source_path("file:///data/my%20survey.csv?delimiter=,&xField=X&yField=Y") == "/data/my survey.csv"
+    assert source_path("file:///C:/data/survey.txt?type=csv&detectTypes=yes") == "C:/data/survey.txt"
+
+
+def sample_fit(seed=0):
+    values = np.random.default_rng(seed).normal(size=(500, 4)) + 5.0
+    fit = fit_from_moments(Moments.from_values(values), ([0.0] * 3, [2.0] * 3), ProcessingLog(None))
+    fit.outlier_bounds = (values.min(axis=0), values.max(axis=0))
+    return fit
+
+
+def entry_names(cache):
+    return sorted(name[:-len(".json")] for name in os.listdir(cache.directory))
+
+
+def set_last_use(cache, key, seconds):
+    os.utime(cache._path(key), (seconds, seconds))
+
+
+def test_round_trip(tmp_path):
+    cache = FitCache(str(tmp_path / "cache"))
+    assert cache.get("missing") is None
+    fit = sample_fit()
+    cache.put("a", fit)
+    cached = cache.get("a")
+    assert cached.coefficients == fit.coefficients
+    assert cached.n == fit.n and cached.rmse == fit.rmse
+    np.testing.assert_array_equal(cached.moments.comoment, fit.moments.comoment)
+    np.testing.assert_array_equal(cached.outlier_bounds[1], fit.outlier_bounds[1])
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = FitCache(str(tmp_path), max_entries=3)
+    for number, key in enumerate("abc"):
+        cache.put(key, sample_fit(number))
+        set_last_use(cache, key, 1000 + number)
+    assert cache.get("a") is not None  # now the most recently used
+    cache.put("d", sample_fit(3))
+    assert entry_names(cache) == ["a", "c", "d"]
+
+
+def test_entries_are_evicted_beyond_the_byte_bound(tmp_path):
+    cache = FitCache(str(tmp_path))
+    cache.put("a", sample_fit(0))
+    size = os.path.getsize(cache._path("a"))
+    cache.max_bytes = int(size * 2.5)
+    set_last_use(cache, "a", 1000)
+    cache.put("b", sample_fit(1))
+    set_last_use(cache, "b", 1001)
+    cache.put("c", sample_fit(2))
+    assert entry_names(cache) == ["b", "c"]
+
+
+def test_corrupt_entries_are_misses(tmp_path):
+    cache = FitCache(str(tmp_path))
+    cache.put("a", sample_fit())
+    with open(cache._path("a"), "w", encoding="utf-8") as f:
+        f.write('{"fit": {"coefficients": [0.1')
+    assert cache.get("a") is None
+    with open(cache._path("a"), "w", encoding="utf-8") as f:
+        f.write('{"created": 0}')
+    assert cache.get("a") is None
+
+
+def test_key_changes_with_the_file_stamp(tmp_path):
+    shp = tmp_path / "survey.shp"
+    dbf = tmp_path / "survey.dbf"
+    shp.write_bytes(b"shp")
+    dbf.write_bytes(b"dbf")
+    params = HardnessParameters(field_names=FIELD_NAMES)
+    stamp = change_stamp(str(shp))
+    key = fit_cache_key(str(shp), 10, stamp, params)
+    assert fit_cache_key(str(shp), 10, change_stamp(str(shp)), params) == key
+
+    os.utime(dbf, ns=(0, 1_000_000_000))
+    changed = change_stamp(str(shp))
+    assert changed != stamp
+    assert fit_cache_key(str(shp), 10, changed, params) != key
+    dbf.unlink()
+    assert change_stamp(str(shp)) is None
+
+
+@pytest.mark.parametrize("changes", [
+    {"field_names": {**FIELD_NAMES, "Depth": "Depth_m"}},
+    {"linearize": True},
+    {"k_bounds": ([0.0] * 3, [1.0] * 3)},
+    {"lower_percentile": 0.01},
+    {"upper_percentile": 0.99},
+    {"exact_quantiles": False},
+    {"validation": True},
+])
+def test_key_changes_with_every_fit_setting(changes):
+    params = HardnessParameters(field_names=FIELD_NAMES)
+    key = fit_cache_key("/data/survey.shp", 10, "1:2", params)
+    assert fit_cache_key("/data/survey.shp", 10, "1:2", replace(params, **changes)) != key
+    assert fit_cache_key("/data/survey.shp", 11, "1:2", params) != key
+    # Settings that do not affect the fit share the entry
+    assert fit_cache_key("/data/survey.shp", 10, "1:2", replace(params, k1=0.1, workers=4)) == key
@@ -0,0 +1,162 @@
+import struct
+
+import numpy as np
+import pytest
+
+from hardness_calculator.dbf import DbfTable, PointShapes, dbf_path_for
+
+FIELD_NAMES = {"E1": "E1", "E2": "E2", "PeakSV": "PeakSV", "Depth": "Depth"}
+
+
+def write_dbf(path, fields, records, deleted=()):
+    """dBASE III table of fields (name, type, length, decimals) and records of raw field texts"""
+    record_length = 1 + sum(length for _, _, length, _ in fields)
+    header_length = 32 + 32 * len(fields) + 1
+    with open(path, "wb") as f:
+        f.write(struct.pack("<B3BIHH20x", 3, 126, 1, 1, len(records), header_length, record_length))
+        for name, field_type, length, decimals in fields:
+            f.write(struct.pack("<11sc4xBB14x", name.encode(), field_type.encode(), length, decimals))
+        f.write(b"\r")
+        for number, record in enumerate(records):
+            f.write(b"*" if number in deleted else b" ")
+            for (_, _, length, _), text in zip(fields, record):
+                f.write(text.encode().rjust(length)[:length])
+        f.write(b"\x1a")
+
+
+def write_points(stem, shapes):
+    """Point shapefile (.shp/.shx) of shapes: (x, y) for a point, None for a null shape, a list for a multipoint"""
+    contents = []
+    for shape in shapes:
+        if shape is None:
+            contents.append(struct.pack("<i", 0))
+        elif isinstance(shape, list):
+            xs, ys = zip(*shape)
+            content = struct.pack("<i4di", 8, min(xs), min(ys), max(xs), max(ys), len(shape))
+            contents.append(content + b"".join(struct.pack("<2d", x, y) for x, y in shape))
+        else:
+            contents.append(struct.pack("<i2d", 1, *shape))
+    body = b""
+    index = b""
+    offset = 50
+    for number, content in enumerate(contents, 1):
+        index += struct.pack(">2i", offset, len(content) // 2)
+        body += struct.pack(">2i", number, len(content) // 2) + content
+        offset += 4 + len(content) // 2
+
+    def header(length):
+        return struct.pack(">7i", 9994, 0, 0, 0, 0, 0, length) + struct.pack("<2i8d", 1000, 1, *([0.0] * 8))
+
+    with open(f"{stem}.shp", "wb") as f:
+        f.write(header(50 + len(body) // 2) + body)
+    with open(f"{stem}.shx", "wb") as f:
+        f.write(header(50 + len(index) // 2) + index)
+
+
+SURVEY_FIELDS = [("NAME", "C", 8, 0), ("E1", "N", 12, 4), ("E2", "N", 12, 4), ("PeakSV", "F", 10, 3),
+                 ("Depth", "C", 8, 0), ("DATE", "D", 8, 0)]
+
+
+def survey_table(path, deleted=()):
+    records = [
+        ["ping", "1.5", "0.75", "2.000", "12.5", "20240101"],
+        ["ping", "", "0.5", "3.000", "13", "20240101"],          # blank -> NULL
+        ["ping", "2.0", "************", "1.000", "14", "20240101"],  # overflow -> NULL
+        ["ping", "2.5", "1.0", "abc", "not num", "20240101"],    # invalid text -> NULL
+        ["ping", "-3.0", "1e1", "4.000", "-7.25", "20240101"],
+    ]
+    write_dbf(path, SURVEY_FIELDS, records, deleted)
+    return DbfTable(path)
+
+
+def test_decodes_blank_overflow_and_invalid_values_as_null(tmp_path):
+    columns = survey_table(str(tmp_path / "survey.dbf")).read_columns(FIELD_NAMES)
+    np.testing.assert_array_equal(columns.fids, np.arange(5))
+    np.testing.assert_array_equal(columns.e1, [1.5, np.nan, 2.0, 2.5, -3.0])
+    np.testing.assert_array_equal(columns.e2, [0.75, 0.5, np.nan, 1.0, 10.0])
+    np.testing.assert_array_equal(columns.peak_sv, [2.0, 3.0, 1.0, np.nan, 4.0])
+    np.testing.assert_array_equal(columns.depth, [12.5, 13.0, 14.0, np.nan, -7.25])
+
+
+def test_deleted_records_are_skipped_and_keep_their_record_numbers(tmp_path):
+    table = survey_table(str(tmp_path / "survey.dbf"), deleted={0, 3})
+    columns = table.read_columns(FIELD_NAMES)
+    np.testing.assert_array_equal(columns.fids, [1, 2, 4])
+    np.testing.assert_array_equal(columns.peak_sv, [3.0, 1.0, 4.0])
+
+    chunks = list(table.iter_chunks(FIELD_NAMES, 2))
+    assert [chunk.fids.tolist() for chunk in chunks] == [[1], [2], [4]]
+
+
+def test_rejects_missing_and_non_numeric_fields(tmp_path):
+    table = survey_table(str(tmp_path / "survey.dbf"))
+    with pytest.raises(ValueError, match="does not exist"):
+        table.field("Missing")
+    with pytest.raises(ValueError, match="type D"):
+        table.mapped_fields({**FIELD_NAMES, "Depth": "DATE"})
+
+    not_dbf = tmp_path / "survey.txt"
+    not_dbf.write_bytes(b"E1,E2\n")
+    with pytest.raises(ValueError, match="not a dBASE table"):
+        DbfTable(str(not_dbf))
+
+
+def test_truncated_table_reads_the_complete_records(tmp_path):
+    path = tmp_path / "survey.dbf"
+    survey_table(str(path))
+    data = path.read_bytes()
+    path.write_bytes(data[:-30])
+    table = DbfTable(str(path))
+    assert len(table) == 4
+    assert table.read_columns(FIELD_NAMES).fids.tolist() == [0, 1, 2, 3]
+
+
+def test_large_table_in_blocks(tmp_path):
+    rng = np.random.default_rng(0)
+    values = rng.uniform(-100, 100, (3000, 4)).round(3)
+    fields = [(name, "N", 12, 3) for name in FIELD_NAMES]
+    write_dbf(str(tmp_path / "big.dbf"), fields, [[f"{v:.3f}" for v in row] for row in values], deleted={10, 2999})
+    table = DbfTable(str(tmp_path / "big.dbf"))
+    columns = table.read_columns(FIELD_NAMES)
+    kept = np.setdiff1d(np.arange(3000), [10, 2999])
+    np.testing.assert_array_equal(columns.fids, kept)
+    np.testing.assert_array_equal(np.column_stack([columns.e1, columns.e2, columns.peak_sv, columns.depth]), values[kept])
+    assert sum(len(chunk) for chunk in table.iter_chunks(FIELD_NAMES, 700)) == len(kept)
+
+
+def test_point_shapes_with_null_and_multipoint_records(tmp_path):
+    stem = str(tmp_path / "survey")
+    write_points(stem, [(1.0, 2.0), None, [(3.0, 4.0), (5.0, 6.0)], (-7.5, 8.25), (9.0, 10.0)])
+    survey_table(f"{stem}.dbf", deleted={4})
+
+    points = PointShapes(f"{stem}.shp")
+    assert len(points) == 5
+    x, y = points.read(1, 4)
+    np.testing.assert_array_equal(x, [np.nan, 3.0, -7.5])
+    np.testing.assert_array_equal(y, [np.nan, 4.0, 8.25])
+
+    table = DbfTable(dbf_path_for(f"{stem}.shp"), points)
+    columns = table.read_columns(FIELD_NAMES, with_coordinates=True)
+    np.testing.assert_array_equal(columns.fids, [0, 1, 2, 3])
+    np.testing.assert_array_equal(columns.x, [1.0, np.nan, 3.0, -7.5])
+    np.testing.assert_array_equal(columns.y, [2.0, np.nan, 4.0, 8.25])
+
+
+def test_point_shapes_must_match_the_records(tmp_path):
+    stem = str(tmp_path / "survey")
+    write_points(stem, [(1.0, 2.0), (3.0, 4.0)])
+    survey_table(f"{stem}.dbf")
+    with pytest.raises(ValueError, match="2 shapes for 5 records"):
+        DbfTable(f"{stem}.dbf", PointShapes(f"{stem}.shp"))
+    with pytest.raises(ValueError, match="No point shapes"):
+        list(DbfTable(f"{stem}.dbf").iter_chunks(FIELD_NAMES, 10, with_coordinates=True))
+
+
+def test_point_shapes_reject_other_geometries(tmp_path):
+    stem = str(tmp_path / "lines")
+    write_points(stem, [(1.0, 2.0)])
+    with open(f"{stem}.shp", "r+b") as f:
+        f.seek(32)
+        f.write(struct.pack("<i", 3))  # polyline
+    with pytest.raises(ValueError, match="not points"):
+        PointShapes(f"{stem}.shp")
@@ -0,0 +1,144 @@
+import numpy as np
+from scipy.optimize import lsq_linear
+
+from hardness_calculator.benchmarks.synthetic import synthetic_survey
+from hardness_calculator.engine import (
+    BOUNDS_STANDARD, CONFIDENCE_HIGH, CONFIDENCE_LOW, CONFIDENCE_NONE, HardnessParameters, Moments, SurveyColumns, fit_coefficients, fit_from_moments, fit_pooled, fit_rows,
+    confidence_labels, evaluate_hardness, percentile_bounds, percentile_estimator, within_bounds,
+)
+from hardness_calculator.processing_log import ProcessingLog
+
+
+def regression_values(n=20000, seed=1):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(n, 4)) * [1.0, 2.0, 0.5, 3.0] + [5.0, 1.0, 2.0, 10.0]
+
+
+def as_float(value):
+    """Attribute value as float, NULL or invalid as NaN, as the extraction reads it"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def baseline_hardness(e1, e2, peak_sv, k1, k2, k3, linearize):
+    """The per-feature formula of the original plugin, with NULL or invalid values skipped as input errors"""
+    try:
+        e1, peak_sv = float(e1), float(peak_sv)
+    except (TypeError, ValueError):
+        return None, None
+    if not (e1 > 0 and peak_sv > 0):
+        return None, None
+    try:
+        e2 = float(e2)
+    except (TypeError, ValueError):
+        e2 = float("nan")
+    if e2 > 0:
+        with np.errstate(over="ignore"):
+            term = np.power(10, (e1 - e2) / 10) if linearize else e1 / e2
+        hardness, confidence = k1 * e1 + k2 * term + k3 * peak_sv, "High"
+    else:
+        hardness, confidence = k1 * e1 + k3 * peak_sv, "Low"
+    return (float(hardness) if np.isfinite(hardness) else None), confidence
+
+
+def test_vectorized_hardness_matches_the_per_feature_formula():
+    rng = np.random.default_rng(3)
+    n = 2000
+    e1 = rng.normal(20.0, 15.0, n).astype(object)
+    e2 = rng.normal(10.0, 12.0, n).astype(object)
+    peak_sv = rng.normal(5.0, 5.0, n).astype(object)
+    e1[::37] = None
+    e2[::11] = None
+    peak_sv[::53] = "n/a"
+    e2[::13] = 0.0
+    # 10^((E1-E2)/10) overflows to inf, which is written as NULL
+    e1[5], e2[5], peak_sv[5] = 4000.0, 1.0, 1.0
+
+    columns = SurveyColumns(np.arange(n), *(np.array([as_float(v) for v in values]) for values in (e1, e2, peak_sv)),
+                            np.zeros(n))
+    for linearize in (False, True):
+        hardness, confidence = evaluate_hardness(columns, 0.3, 0.05, 0.7, linearize)
+        expected = [baseline_hardness(a, b, c, 0.3, 0.05, 0.7, linearize) for a, b, c in zip(e1, e2, peak_sv)]
+
+        expected_hardness = np.array([np.nan if h is None else h for h, _ in expected])
+        np.testing.assert_allclose(hardness, expected_hardness, rtol=1e-12, equal_nan=True)
+        assert confidence_labels(confidence).tolist() == [c for _, c in expected]
+    assert np.isnan(hardness[5])
+    assert {CONFIDENCE_NONE, CONFIDENCE_LOW, CONFIDENCE_HIGH} <= set(confidence.tolist())
+
+
+def test_chunked_moments_equal_direct_statistics():
+    values = regression_values()
+    chunked = Moments()
+    for chunk in np.array_split(values, 7):
+        chunked.update(chunk)
+    merged = Moments.from_values(values[:1234])
+    merged.merge(Moments.from_values(values[1234:]))
+
+    centered = values - values.mean(axis=0)
+    for moments in (chunked, merged):
+        assert moments.n == len(values)
+        np.testing.assert_allclose(moments.mean, values.mean(axis=0))
+        np.testing.assert_allclose(moments.comoment, centered.T @ centered, rtol=1e-9)
+        np.testing.assert_array_equal(moments.min, values.min(axis=0))
+        np.testing.assert_array_equal(moments.max, values.max(axis=0))
+
+
+def test_merging_empty_moments_changes_nothing():
+    values = regression_values(100)
+    moments = Moments.from_values(values)
+    moments.merge(Moments())
+    moments.update(np.empty((0, 4)))
+    assert moments.n == 100
+    np.testing.assert_allclose(moments.mean, values.mean(axis=0))
+
+
+def test_fit_from_moments_matches_fit_on_design_matrix():
+    values = regression_values()
+    z = (values - values.min(axis=0)) / (values.max(axis=0) - values.min(axis=0))
+    expected = lsq_linear(z[:, :3], z[:, 3], bounds=BOUNDS_STANDARD).x
+
+    fit = fit_from_moments(Moments.from_values(values), BOUNDS_STANDARD, ProcessingLog(None))
+    np.testing.assert_allclose(fit.coefficients, expected, atol=1e-8)
+    residual = z[:, :3] @ expected - z[:, 3]
+    assert abs(fit.rmse - np.sqrt(np.mean(residual ** 2))) < 1e-8
+
+
+def test_streaming_accumulation_reproduces_in_memory_fit():
+    columns = synthetic_survey(50000)
+    params = HardnessParameters(exact_quantiles=True)
+    in_memory = fit_coefficients(columns, params, ProcessingLog(None))
+
+    # The three streaming passes: bounds from all chunks, then moments of the rows within them
+    chunks = [columns.subset(np.arange(start, min(start + 6000, len(columns)))) for start in range(0, len(columns), 6000)]
+    estimator = percentile_estimator(params)
+    for chunk in chunks:
+        estimator.update(fit_rows(chunk, params.linearize))
+    low, high = percentile_bounds(estimator, params)
+    moments = Moments()
+    for chunk in chunks:
+        values = fit_rows(chunk, params.linearize)
+        moments.update(values[within_bounds(values, low, high)])
+    streamed = fit_from_moments(moments, params.bounds, ProcessingLog(None))
+
+    assert streamed.n == in_memory.n
+    np.testing.assert_allclose(streamed.coefficients, in_memory.coefficients, atol=1e-10)
+
+
+def test_pooled_fit_equals_fit_of_concatenated_surveys():
+    columns = synthetic_survey(30000)
+    parts = [columns.subset(slice(0, 7000)), columns.subset(slice(7000, 19000)), columns.subset(slice(19000, None))]
+    concatenated = SurveyColumns(*(np.concatenate([getattr(part, name) for part in parts])
+                                   for name in ("fids", "e1", "e2", "peak_sv", "depth")))
+    for linearize in (False, True):
+        params = HardnessParameters(linearize=linearize, exact_quantiles=True, workers=2)
+        pooled = fit_pooled(parts, params, ProcessingLog(None))
+        single = fit_coefficients(concatenated, params, ProcessingLog(None))
+
+        for pooled_bound, single_bound in zip(pooled.outlier_bounds, single.outlier_bounds):
+            np.testing.assert_allclose(pooled_bound, single_bound, rtol=1e-12)
+        assert pooled.n == single.n
+        np.testing.assert_allclose(pooled.coefficients, single.coefficients, atol=1e-10)
+        np.testing.assert_allclose(pooled.rmse, single.rmse, rtol=1e-9)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from hardness_calculator.benchmarks.memory_layer import MemoryFeatureRequest, MemoryLayer
+from hardness_calculator.benchmarks.synthetic import synthetic_survey
+from hardness_calculator.engine import SurveyColumns
+from hardness_calculator.extraction import _attribute_request, extract_columns, iter_column_chunks
+
+FIELD_NAMES = {"E1": "E1", "E2": "E2", "PeakSV": "PeakSV", "Depth": "Depth"}
+
+
+def assert_same_columns(actual, expected):
+    np.testing.assert_array_equal(actual.fids, expected.fids)
+    for name in ("e1", "e2", "peak_sv", "depth"):
+        np.testing.assert_array_equal(getattr(actual, name), getattr(expected, name))
+
+
+def test_request_asks_for_the_mapped_attributes_only():
+    layer = MemoryLayer(synthetic_survey(10))
+    layer.dataProvider().addAttributes(["Hardness", "Confidence"])
+    request, indices = _attribute_request(layer.fields(), {**FIELD_NAMES, "E1": "E2", "E2": "E1"},
+                                          request_type=MemoryFeatureRequest)
+    assert indices == [1, 0, 2, 3]
+    assert request.attributes == indices and request.flags == MemoryFeatureRequest.NoGeometry
+    with pytest.raises(ValueError, match="'Depth_m' selected for Depth does not exist"):
+        _attribute_request(layer.fields(), {**FIELD_NAMES, "Depth": "Depth_m"}, request_type=MemoryFeatureRequest)
+
+
+def test_extract_columns_reads_every_feature_with_nulls_as_nan():
+    columns = synthetic_survey(3000)
+    layer = MemoryLayer(columns)
+    # An unknown total grows the arrays as features arrive
+    for total in (len(columns), -1):
+        extracted = extract_columns(layer, layer.fields(), FIELD_NAMES, total, request_type=MemoryFeatureRequest)
+        assert_same_columns(extracted, columns)
+
+
+def test_column_chunks_concatenate_to_the_columns():
+    columns = synthetic_survey(2500)
+    layer = MemoryLayer(columns)
+    chunks = list(iter_column_chunks(layer, layer.fields(), FIELD_NAMES, 1000, request_type=MemoryFeatureRequest))
+    assert [len(chunk) for chunk in chunks] == [1000, 1000, 500]
+    joined = SurveyColumns(*(np.concatenate([getattr(chunk, name) for chunk in chunks])
+                           for name in ("fids", "e1", "e2", "peak_sv", "depth")))
+    assert_same_columns(joined, columns)
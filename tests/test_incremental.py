@@ -0,0 +1,144 @@
+import os
+
+import numpy as np
+
+from hardness_calculator.benchmarks.synthetic import synthetic_survey
+from hardness_calculator.engine import (
+    MODE_OPTIMIZED, HardnessParameters, SurveyColumns, evaluate_hardness, fit_coefficients, input_digest,
+)
+from hardness_calculator.incremental import (
+    UNWRITTEN_DIGEST, RunState, StateRecorder, load_state, save_state, state_path_for,
+)
+from hardness_calculator.processing_log import ProcessingLog
+from hardness_calculator.validation import interval_confidence
+
+FIELD_NAMES = {"e1": "E1", "e2": "E2", "peak_sv": "PeakSV", "depth": "Depth"}
+
+
+def run_state(fids, digests):
+    return RunState("Hardness", "Confidence", (1.0, 2.0, 3.0), True, FIELD_NAMES, fids, digests)
+
+
+def test_digest_follows_the_formula_inputs_only():
+    columns = synthetic_survey(1000)
+    digests = input_digest(columns)
+    assert len(np.unique(digests)) == len(columns)
+
+    depth_changed = SurveyColumns(columns.fids, columns.e1, columns.e2, columns.peak_sv, columns.depth + 1.0)
+    np.testing.assert_array_equal(input_digest(depth_changed), digests)
+
+    for name in ("e1", "e2", "peak_sv"):
+        values = {key: getattr(columns, key).copy() for key in ("e1", "e2", "peak_sv")}
+        values[name][10] += 0.5
+        edited = SurveyColumns(columns.fids, values["e1"], values["e2"], values["peak_sv"], columns.depth)
+        assert np.flatnonzero(input_digest(edited) != digests).tolist() == [10]
+
+
+def test_digest_of_null_inputs_is_stable():
+    nulls = np.full(3, np.nan)
+    columns = SurveyColumns(np.arange(3), nulls, nulls, nulls, nulls)
+    assert len(set(input_digest(columns).tolist())) == 1
+
+
+def test_state_round_trip(tmp_path):
+    path = str(tmp_path / "survey_hardness_state.npz")
+    fids = np.array([2, 5, 7, 11], dtype=np.int64)
+    digests = np.array([10, 20, 30, 40], dtype=np.uint64)
+    save_state(path, run_state(fids, digests))
+
+    state = load_state(path)
+    assert (state.hardness_field, state.confidence_field) == ("Hardness", "Confidence")
+    assert state.coefficients == (1.0, 2.0, 3.0)
+    assert state.linearize is True
+    assert state.field_names == FIELD_NAMES
+    np.testing.assert_array_equal(state.fids, fids)
+    np.testing.assert_array_equal(state.digests, digests)
+    assert not os.path.exists(f"{path}.tmp.npz")
+    assert state.validation is None and state.max_relative_interval == 0.0
+
+
+def test_recorded_interval_rule_gives_the_same_confidence(tmp_path):
+    columns = synthetic_survey(5000)
+    params = HardnessParameters(mode=MODE_OPTIMIZED, validation=True, bootstrap_samples=50, workers=1)
+    fit = fit_coefficients(columns, params, ProcessingLog(None))
+    path = str(tmp_path / "survey_hardness_state.npz")
+    save_state(path, RunState("Hardness", "Confidence", fit.coefficients, False, FIELD_NAMES,
+                              np.empty(0, np.int64), np.empty(0, np.uint64), fit.validation, 0.001))
+
+    state = load_state(path)
+    assert state.max_relative_interval == 0.001
+    confidences = []
+    for validation in (fit.validation, state.validation):
+        hardness, confidence = evaluate_hardness(columns, *state.coefficients, state.linearize)
+        interval_confidence(columns, hardness, confidence, validation, state.linearize, state.max_relative_interval)
+        confidences.append(confidence)
+    np.testing.assert_array_equal(confidences[0], confidences[1])
+    # The rule does downgrade rows, so leaving it out would change the Confidence definition
+    assert (confidences[0] != evaluate_hardness(columns, *state.coefficients, state.linearize)[1]).any()
+
+
+def test_missing_or_corrupt_state_loads_as_none(tmp_path):
+    assert load_state(str(tmp_path / "missing.npz")) is None
+    corrupt = tmp_path / "corrupt.npz"
+    corrupt.write_bytes(b"not a state file")
+    assert load_state(str(corrupt)) is None
+
+
+def test_changed_marks_new_and_edited_rows():
+    state = run_state(np.array([2, 5, 7], dtype=np.int64), np.array([10, 20, 30], dtype=np.uint64))
+    fids = np.array([1, 2, 5, 7, 9], dtype=np.int64)
+    digests = np.array([0, 10, 21, 30, 0], dtype=np.uint64)
+    np.testing.assert_array_equal(state.changed(fids, digests), [True, False, True, False, True])
+    np.testing.assert_array_equal(state.known(fids), [False, True, True, True, False])
+
+    empty = run_state(np.empty(0, np.int64), np.empty(0, np.uint64))
+    assert empty.changed(fids, digests).all()
+    assert not empty.known(fids).any()
+
+
+def test_recorder_saves_chunks_in_fid_order(tmp_path):
+    path = str(tmp_path / "survey_hardness_state.npz")
+    rng = np.random.default_rng(3)
+    fids = np.arange(1000, dtype=np.int64)
+    digests = rng.integers(0, 2**63, 1000).astype(np.uint64)
+
+    for order in (np.arange(1000), rng.permutation(1000)):
+        recorder = StateRecorder(path)
+        for part in np.array_split(order, 7):
+            recorder.append(fids[part], digests[part])
+        recorder.save(run_state(None, None))
+
+        state = load_state(path)
+        np.testing.assert_array_equal(state.fids, fids)
+        np.testing.assert_array_equal(state.digests, digests)
+        assert sorted(os.listdir(tmp_path)) == ["survey_hardness_state.npz"]
+
+
+def test_recorder_without_rows_and_discard(tmp_path):
+    path = str(tmp_path / "survey_hardness_state.npz")
+    recorder = StateRecorder(path)
+    recorder.save(run_state(None, None))
+    assert len(load_state(path).fids) == 0
+
+    recorder = StateRecorder(str(tmp_path / "other_hardness_state.npz"))
+    recorder.append(np.arange(5), np.zeros(5, np.uint64))
+    recorder.discard()
+    assert sorted(os.listdir(tmp_path)) == ["survey_hardness_state.npz"]
+
+
+def test_state_path_per_geopackage_layer():
+    assert state_path_for("/data/survey.shp") == "/data/survey_hardness_state.npz"
+    assert state_path_for("/data/survey.gpkg|layername=pings") == "/data/survey_pings_hardness_state.npz"
+
+
+def test_recorder_marks_unwritten_rows_as_changed(tmp_path):
+    path = str(tmp_path / "survey_hardness_state.npz")
+    fids = np.arange(10, dtype=np.int64)
+    digests = np.arange(100, 110, dtype=np.uint64)
+    recorder = StateRecorder(path)
+    recorder.append(fids, digests)
+    recorder.save(run_state(None, None), np.array([3, 8, 42], dtype=np.int64))
+
+    state = load_state(path)
+    assert state.digests[3] == UNWRITTEN_DIGEST and state.digests[8] == UNWRITTEN_DIGEST
+    assert np.flatnonzero(state.changed(fids, digests)).tolist() == [3, 8]
@@ -0,0 +1,54 @@
+from hardness_calculator.incremental import state_path_for
+from hardness_calculator.processing_log import DEBUG, HEADER, PHASE, SUMMARY, ProcessingLog, log_path_for
+
+
+def test_output_paths_are_unique_per_geopackage_layer():
+    assert log_path_for("/data/survey.shp") == "/data/survey_hardness_processing.txt"
+    assert log_path_for("/data/survey.gpkg|layername=pings") == "/data/survey_pings_hardness_processing.txt"
+    assert log_path_for("/data/survey.gpkg|layername=line 2") == "/data/survey_line_2_hardness_processing.txt"
+    assert log_path_for("file:///data/survey.csv?delimiter=,") == "/data/survey_hardness_processing.txt"
+    assert state_path_for("/data/survey.gpkg|layername=pings") == "/data/survey_pings_hardness_state.npz"
+
+
+def test_levels_filter_messages(tmp_path):
+    path = tmp_path / "log.txt"
+    with ProcessingLog(str(path), PHASE) as log:
+        log.summary("summary line")
+        log.phase("phase line")
+        log.debug("debug line")
+        log.debug_rows("fid\tvalue", [(1, 2.0)])
+        assert log.enabled(PHASE) and not log.enabled(DEBUG)
+    text = path.read_text(encoding="utf-8")
+    assert text.startswith(HEADER)
+    assert "summary line" in text and "phase line" in text
+    assert "debug line" not in text and "fid\tvalue" not in text
+
+
+def test_counts_are_written_once_and_reset(tmp_path):
+    path = tmp_path / "log.txt"
+    with ProcessingLog(str(path), SUMMARY) as log:
+        log.count("NULL input", 3)
+        log.count("E2 <= 0")
+        log.count("NULL input", 2)
+        log.write_counts("Skipped features:")
+        assert not log.counts
+        log.write_counts("Not written when empty:")
+        log.write_counts("Hidden at this level:", DEBUG)
+    lines = [line.split("] ", 1)[-1] for line in path.read_text(encoding="utf-8").splitlines()]
+    assert lines[-3:] == ["Skipped features:", "  NULL input: 5", "  E2 <= 0: 1"]
+    assert not any("Not written" in line for line in lines)
+
+
+def test_log_without_path_writes_nothing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with ProcessingLog(None, DEBUG) as log:
+        assert not log.enabled(SUMMARY)
+        log.summary("nothing")
+        log.debug_rows("fid", [(1,)])
+        log.count("reason")
+        log.write_counts("Counts:")
+        with log.timed("fit") as stats:
+            assert stats.name == "fit"
+        chunks = [1, 2]
+        assert log.timed_chunks("extract", chunks) is chunks
+    assert list(tmp_path.iterdir()) == []
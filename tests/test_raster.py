@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+from hardness_calculator import raster
+from hardness_calculator.raster import HardnessGrid, RasterGrid, _from_sortable, _sortable
+
+
+def random_points(n=50000, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(0, 100, n)
+    y = rng.uniform(0, 50, n)
+    hardness = rng.normal(0.5, 0.2, n)
+    hardness[rng.random(n) < 0.05] = np.nan
+    x[rng.random(n) < 0.01] = np.nan
+    return x, y, hardness
+
+
+def groupby_cells(grid, x, y, hardness):
+    frame = pd.DataFrame({"cell": grid.cell_ids(x, y), "hardness": hardness})
+    frame = frame[(frame.cell >= 0) & frame.hardness.notna()]
+    return frame.groupby("cell").hardness
+
+
+def test_sortable_keys_keep_the_float32_order():
+    values = np.array([3.5, -0.0, 0.0, -1e-30, 1e-30, -2.25, np.inf, -np.inf, 1e38, -1e38])
+    keys = _sortable(values)
+    order = np.argsort(keys, kind="stable")
+    assert np.all(np.diff(values.astype(np.float32)[order]) >= 0)
+    np.testing.assert_array_equal(_from_sortable(keys), values.astype(np.float32))
+
+
+def test_cell_ids_of_edges_outside_and_missing_points():
+    grid = RasterGrid.covering(0.0, 0.0, 10.0, 5.0, 1.0)
+    assert (grid.nx, grid.ny) == (11, 6)
+    x = np.array([0.0, 10.0, 0.0, 10.0, 0.5, -0.1, 11.1, np.nan, 3.0])
+    y = np.array([5.0, 5.0, 0.0, 0.0, 4.5, 2.0, 2.0, 1.0, np.nan])
+    np.testing.assert_array_equal(grid.cell_ids(x, y), [0, 10, 55, 65, 0, -1, -1, -1, -1])
+    np.testing.assert_allclose(grid.centres(np.array([0, 65])), [[0.5, 4.5], [10.5, -0.5]])
+
+
+def test_covering_respects_max_cells(monkeypatch):
+    monkeypatch.setattr(raster, "MAX_CELLS", 1000)
+    grid = RasterGrid.covering(0.0, 0.0, 100.0, 50.0, 0.1)
+    assert grid.size > 0.1
+    assert len(grid) <= 1000
+    assert grid.cell_ids(np.array([100.0]), np.array([0.0]))[0] == len(grid) - 1
+
+
+def test_mean_and_count_match_a_groupby():
+    x, y, hardness = random_points()
+    grid = RasterGrid.covering_points(x, y, 7.5)
+    binned = HardnessGrid(grid)
+    binned.update(x[:20000], y[:20000], hardness[:20000])
+    binned.update(x[20000:], y[20000:], hardness[20000:])
+
+    groups = groupby_cells(grid, x, y, hardness)
+    count = np.zeros(len(grid))
+    count[groups.size().index] = groups.size()
+    mean = np.full(len(grid), np.nan)
+    mean[groups.mean().index] = groups.mean()
+    np.testing.assert_array_equal(binned.count, count)
+    np.testing.assert_allclose(binned.mean(), mean, rtol=1e-12)
+    assert binned.n == count.sum()
+
+
+def test_median_matches_a_groupby_at_float32_precision():
+    x, y, hardness = random_points(seed=1)
+    grid = RasterGrid.covering_points(x, y, 10.0)
+    binned = HardnessGrid(grid, median=True)
+    binned.update(x, y, hardness)
+
+    groups = groupby_cells(grid, x, y, hardness.astype(np.float32))
+    expected = np.full(len(grid), np.nan)
+    expected[groups.median().index] = groups.median()
+    np.testing.assert_allclose(binned.median(), expected, rtol=1e-6)
+    # median() can be called again after sorting the keys in place
+    np.testing.assert_allclose(binned.median(), expected, rtol=1e-6)
+    assert np.isnan(HardnessGrid(grid, median=True).median()).all()
+
+
+def test_median_of_single_even_and_odd_counts():
+    grid = RasterGrid.covering(0.0, 0.0, 2.0, 0.0, 1.0)
+    binned = HardnessGrid(grid, median=True)
+    binned.update(np.array([0.5, 1.5, 1.5, 2.5, 2.5, 2.5]), np.zeros(6), np.array([-0.25, 1.0, -2.0, 3.0, -1.0, 0.5]))
+    np.testing.assert_array_equal(binned.median(), [-0.25, -0.5, 0.5])
+
+
+def test_idw_is_exact_at_data_points_and_empty_beyond_the_radius():
+    grid = RasterGrid.covering(0.0, 0.0, 9.0, 9.0, 1.0)
+    binned = HardnessGrid(grid)
+    binned.update(np.array([0.25, 0.75, 4.5]), np.array([8.5, 8.5, 5.5]), np.array([1.0, 3.0, 6.0]))
+
+    values = binned.idw(neighbors=2, power=2.0, radius=3.0, workers=1)
+    assert values[0] == 2.0  # mean of the cell, at the centroid of its points
+    assert values[grid.cell_ids(np.array([4.5]), np.array([5.5]))[0]] == 6.0
+    between = values[grid.cell_ids(np.array([2.5]), np.array([7.0]))[0]]
+    assert 2.0 < between < 6.0
+    assert np.isnan(values[len(grid) - 1])  # centre (9.5, -0.5), over 5 units from the nearest data point
+
+
+def test_grid_path_is_unique_per_geopackage_layer():
+    assert raster.grid_path_for("/data/survey.shp") == "/data/survey_hardness_grid.tif"
+    assert raster.grid_path_for("/data/survey.gpkg|layername=a") != raster.grid_path_for("/data/survey.gpkg|layername=b")
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from hardness_calculator.readers import iter_csv_chunks, read_csv_columns, read_survey
+
+FIELD_NAMES = {"E1": "e1", "E2": "e2", "PeakSV": "sv", "Depth": "depth"}
+
+
+def write_survey(path, rows, delimiter=","):
+    lines = [delimiter.join(["line", "e1", "e2", "sv", "depth", "x", "y"])]
+    lines += [delimiter.join(str(value) for value in row) for row in rows]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def survey_rows(n=10):
+    return [[f"L{i}", 1.0 + i, 0.5 + i, 2.0 * i, 10.0 + i, 100.0 + i, 200.0 - i] for i in range(n)]
+
+
+def test_empty_values_are_null(tmp_path):
+    rows = survey_rows(4)
+    rows[1][2] = ""
+    rows[3][4] = ""
+    write_survey(tmp_path / "survey.csv", rows)
+    columns = read_csv_columns(str(tmp_path / "survey.csv"), FIELD_NAMES, ("x", "y"))
+    np.testing.assert_array_equal(columns.fids, np.arange(4))
+    np.testing.assert_array_equal(columns.e2, [0.5, np.nan, 2.5, 3.5])
+    np.testing.assert_array_equal(columns.depth, [10.0, 11.0, 12.0, np.nan])
+    np.testing.assert_array_equal(columns.x, [100.0, 101.0, 102.0, 103.0])
+
+
+@pytest.mark.parametrize("text_row", [1, 7])
+def test_text_in_a_numeric_column_falls_back_to_per_value_conversion(tmp_path, text_row):
+    rows = survey_rows(10)
+    rows[text_row][3] = "soft"
+    rows[8][1] = " "
+    write_survey(tmp_path / "survey.csv", rows)
+
+    # The text cell lies in the first or a later chunk; the untyped reread skips the rows already yielded
+    chunks = list(iter_csv_chunks(str(tmp_path / "survey.csv"), FIELD_NAMES, chunk_size=3))
+    fids = np.concatenate([chunk.fids for chunk in chunks])
+    peak_sv = np.concatenate([chunk.peak_sv for chunk in chunks])
+    e1 = np.concatenate([chunk.e1 for chunk in chunks])
+    np.testing.assert_array_equal(fids, np.arange(10))
+    expected = 2.0 * np.arange(10)
+    expected[text_row] = np.nan
+    np.testing.assert_array_equal(peak_sv, expected)
+    assert np.flatnonzero(np.isnan(e1)).tolist() == [8]
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3, 1]
+
+
+@pytest.mark.parametrize("delimiter", [";", "\t", "|"])
+def test_txt_delimiter_is_sniffed_from_the_header(tmp_path, delimiter):
+    rows = survey_rows(3)
+    rows[2][4] = "deep"
+    write_survey(tmp_path / "survey.txt", rows, delimiter)
+    columns = read_survey(str(tmp_path / "survey.txt"), FIELD_NAMES, ("x", "y"))
+    np.testing.assert_array_equal(columns.e1, [1.0, 2.0, 3.0])
+    np.testing.assert_array_equal(columns.depth, [10.0, 11.0, np.nan])
+    np.testing.assert_array_equal(columns.y, [200.0, 199.0, 198.0])
+
+
+def test_missing_column_raises(tmp_path):
+    write_survey(tmp_path / "survey.csv", survey_rows(2))
+    with pytest.raises(ValueError):
+        read_csv_columns(str(tmp_path / "survey.csv"), {**FIELD_NAMES, "Depth": "depth_m"})
@@ -0,0 +1,46 @@
+import numpy as np
+
+from hardness_calculator.benchmarks.synthetic import synthetic_survey
+from hardness_calculator.engine import HardnessParameters, Moments, fit_from_moments, fit_rows
+from hardness_calculator.processing_log import ProcessingLog
+from hardness_calculator.regional import RING_GLOBAL, TileGrid, accumulate_tile_moments, fit_tiles, pool_tile
+
+
+def tile_statistics(n=20000, tile_size=0.0):
+    columns = synthetic_survey(n)
+    values = fit_rows(columns, False, with_coordinates=True)
+    values = values[np.all(np.isfinite(values), axis=1)]
+    grid = TileGrid.covering_points(values[:, 4], values[:, 5], tile_size)
+    tile_moments = {}
+    accumulate_tile_moments(tile_moments, values[:, :4], grid.tile_ids(values[:, 4], values[:, 5]))
+    return grid, tile_moments, Moments.from_values(values[:, :4])
+
+
+def test_batched_tile_fits_match_per_tile_fits():
+    params = HardnessParameters(min_tile_samples=200, borrow_rings=1)
+    grid, tile_moments, global_moments = tile_statistics()
+    quiet = ProcessingLog(None)
+    global_fit = fit_from_moments(global_moments, params.bounds, quiet)
+
+    tiles, _ = fit_tiles(grid, tile_moments, global_fit, params)
+    assert [tile.tile for tile in tiles] == list(range(len(grid)))
+    assert any(tile.ring != RING_GLOBAL for tile in tiles)
+    for tile in tiles:
+        pooled, ring = pool_tile(grid, tile_moments, tile.tile, params)
+        assert tile.pooled == pooled.n
+        if tile.ring == RING_GLOBAL:
+            assert tile.coefficients == global_fit.coefficients
+            assert pooled.n < params.min_tile_samples
+            continue
+        expected = fit_from_moments(pooled, params.bounds, quiet)
+        np.testing.assert_allclose(tile.coefficients, expected.coefficients, atol=1e-6)
+        np.testing.assert_allclose(tile.rmse, expected.rmse, rtol=1e-6)
+
+
+def test_tiles_without_enough_samples_use_the_global_fit():
+    params = HardnessParameters(min_tile_samples=10 ** 9, borrow_rings=2)
+    grid, tile_moments, global_moments = tile_statistics(2000)
+    global_fit = fit_from_moments(global_moments, params.bounds, ProcessingLog(None))
+    tiles, _ = fit_tiles(grid, tile_moments, global_fit, params)
+    assert all(tile.ring == RING_GLOBAL and tile.coefficients == global_fit.coefficients for tile in tiles)
+    assert all("samples within" in tile.note for tile in tiles)
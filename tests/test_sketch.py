@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from hardness_calculator.sketch import ColumnSketches, ExactQuantiles, KLLSketch, k_for_error, quantile_estimator
+
+QUANTILES = np.linspace(0.01, 0.99, 99)
+
+
+def rank_errors(values, estimates):
+    """Normalized rank distance of each estimate from its requested quantile"""
+    ordered = np.sort(values)
+    ranks = (np.searchsorted(ordered, estimates, side="left") + np.searchsorted(ordered, estimates, side="right")) / 2
+    return np.abs(ranks / len(values) - QUANTILES)
+
+
+@pytest.mark.parametrize("epsilon", [0.01, 0.001])
+def test_kll_rank_error_within_bound(epsilon):
+    values = np.random.default_rng(2).lognormal(1.0, 0.8, 300000)
+    sketch = KLLSketch(k_for_error(epsilon), seed=0)
+    for batch in np.array_split(values, 30):
+        sketch.update(batch)
+    estimates = np.array([sketch.quantile(q) for q in QUANTILES])
+    assert rank_errors(values, estimates).max() <= 2 * epsilon
+
+
+def test_merged_sketches_keep_the_bound():
+    epsilon = 0.005
+    values = np.random.default_rng(3).normal(size=200000)
+    parts = [KLLSketch(k_for_error(epsilon), seed=part) for part in range(4)]
+    for sketch, batch in zip(parts, np.array_split(values, 4)):
+        sketch.update(batch)
+    merged = parts[0]
+    for other in parts[1:]:
+        merged.merge(other)
+    assert merged.n == len(values)
+    estimates = np.array([merged.quantile(q) for q in QUANTILES])
+    assert rank_errors(values, estimates).max() <= 2 * epsilon
+
+
+def test_sketch_memory_stays_bounded():
+    sketch = KLLSketch(200, seed=0)
+    for batch in np.array_split(np.random.default_rng(4).random(1000000), 100):
+        sketch.update(batch)
+    assert sum(len(items) for items in sketch.levels) < 4 * 200
+
+
+def test_extremes_are_exact_and_nan_is_ignored():
+    values = np.array([3.0, np.nan, -7.5, 12.25, 0.0])
+    sketch = KLLSketch(8, seed=0)
+    sketch.update(values)
+    assert sketch.n == 4
+    assert sketch.quantile(0) == -7.5
+    assert sketch.quantile(1) == 12.25
+    assert np.isnan(KLLSketch().quantile(0.5))
+
+
+def test_exact_quantiles_match_pandas():
+    values = np.random.default_rng(5).normal(size=(10001, 4))
+    exact = ExactQuantiles()
+    for batch in np.array_split(values, 3):
+        exact.update(batch)
+    frame = pd.DataFrame(values)
+    for q in (0.05, 0.5, 0.95):
+        np.testing.assert_allclose(exact.quantile(q), frame.quantile(q).to_numpy())
+
+
+def test_quantile_estimator_choice():
+    assert isinstance(quantile_estimator(True, 0.001), ExactQuantiles)
+    sketches = quantile_estimator(False, 0.001)
+    assert isinstance(sketches, ColumnSketches)
+    assert sketches.sketches[0].k == k_for_error(0.001)
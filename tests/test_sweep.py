@@ -0,0 +1,45 @@
+import numpy as np
+
+from hardness_calculator.benchmarks.synthetic import synthetic_survey
+from hardness_calculator.engine import BOUNDS_STANDARD, within_bounds
+from hardness_calculator.sweep import (
+    best_result, depth_rmse, parse_percentile_pairs, regression_columns, run_sweep, sweep_configs,
+)
+
+
+def test_depth_rmse_on_own_rows_is_the_rescaled_fit_rmse():
+    columns = synthetic_survey(20000)
+    (result,) = run_sweep(columns, sweep_configs([False], [(0.05, 0.95)]), workers=1)
+    values = regression_columns(columns, False)
+    retained = values[within_bounds(values, *result.fit.outlier_bounds)]
+    depth_range = result.fit.moments.max[3] - result.fit.moments.min[3]
+    np.testing.assert_allclose(depth_rmse(result.fit, retained), result.fit.rmse * depth_range, rtol=1e-9)
+
+
+def test_sweep_ranks_configurations_on_common_rows():
+    columns = synthetic_survey(20000)
+    configs = sweep_configs([False, True], parse_percentile_pairs("5-95, 1-99, 0-100"),
+                            [([0.0, 0.0, 0.0], [2.0, 2.0, 2.0])])
+    results = run_sweep(columns, configs, workers=2)
+    fitted = [result for result in results if result.fit is not None]
+    assert len(fitted) == len(configs)
+
+    # The common rows are those within the bounds of every configuration, a subset of the narrowest retained set
+    compared = {result.compared for result in fitted}
+    assert len(compared) == 1
+    assert 0 < compared.pop() <= min(result.retained for result in fitted)
+
+    best = best_result(results)
+    assert best.depth_rmse == min(result.depth_rmse for result in fitted)
+    # Normalized RMSE is not comparable across percentile pairs: the widest bounds normalize by the outliers
+    widest = [result for result in fitted if result.config.upper_percentile == 1.0]
+    assert min(result.fit.rmse for result in widest) < best.fit.rmse
+    assert best.config.upper_percentile < 1.0
+
+
+def test_best_result_skips_failed_configurations():
+    columns = synthetic_survey(1000)
+    results = run_sweep(columns, sweep_configs([False], [(0.05, 0.95)]), workers=1)
+    results[0].fit = None
+    assert best_result(results) is None
+    assert results[0].config.bounds == BOUNDS_STANDARD
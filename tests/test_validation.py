@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from scipy.optimize import lsq_linear
+
+from hardness_calculator.engine import BOUNDS_LINEARIZED, BOUNDS_STANDARD, HardnessParameters, MODE_OPTIMIZED, MODE_REGIONAL
+from hardness_calculator.validation import SOLVE_BATCH_SIZE, BlockGrams, batched_bounded_solve
+
+
+def random_problems(count, seed=0):
+    """count least-squares problems (X, y) of 50 rows whose solutions fall inside, on and beyond the bounds"""
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(0, 1, (count, 50, 3))
+    x[:, :, 1] += rng.uniform(-0.5, 0.5, (count, 1)) * x[:, :, 0]
+    k = rng.uniform(-0.5, 2.0, (count, 3))
+    y = np.einsum("bij,bj->bi", x, k) + rng.normal(0, 0.05, (count, 50))
+    return x, y
+
+
+@pytest.mark.parametrize("bounds", [BOUNDS_STANDARD, BOUNDS_LINEARIZED])
+def test_batched_solve_matches_lsq_linear(bounds):
+    x, y = random_problems(300)
+    grams = np.einsum("bij,bik->bjk", x, x)
+    moments = np.einsum("bij,bi->bj", x, y)
+    solved = batched_bounded_solve(grams, moments, bounds)
+
+    lower, upper = (np.asarray(bound) for bound in bounds)
+    assert ((solved >= lower) & (solved <= upper)).all()
+    for b in range(len(x)):
+        expected = lsq_linear(x[b], y[b], bounds=bounds, tol=1e-12).x
+        np.testing.assert_allclose(solved[b], expected, atol=1e-6)
+
+
+def test_batched_solve_with_workers_splits_the_batch():
+    x, y = random_problems(SOLVE_BATCH_SIZE + 100, seed=1)
+    grams = np.einsum("bij,bik->bjk", x, x)
+    moments = np.einsum("bij,bi->bj", x, y)
+    np.testing.assert_allclose(batched_bounded_solve(grams, moments, BOUNDS_STANDARD, workers=4),
+                               batched_bounded_solve(grams, moments, BOUNDS_STANDARD))
+
+
+def test_block_grams_add_up_to_the_full_gram():
+    rng = np.random.default_rng(2)
+    values = rng.uniform(1, 10, (5000, 4))
+    block_grams = BlockGrams(blocks=16)
+    for chunk in np.array_split(values, 3):
+        block_grams.update(chunk)
+    rows = np.column_stack([values, np.ones(len(values))])
+    assert block_grams.n == len(values)
+    np.testing.assert_allclose(block_grams.grams.sum(axis=0), rows.T @ rows)
+
+    minimum, maximum = values.min(axis=0), values.max(axis=0)
+    normalized = np.column_stack([(values - minimum) / (maximum - minimum), np.ones(len(values))])
+    np.testing.assert_allclose(block_grams.normalized(minimum, maximum).sum(axis=0), normalized.T @ normalized)
+
+
+def test_validation_is_only_accepted_in_optimized_mode():
+    HardnessParameters(mode=MODE_OPTIMIZED, validation=True).validate()
+    with pytest.raises(ValueError, match="Optimized mode"):
+        HardnessParameters(mode=MODE_REGIONAL, validation=True).validate()
@@ -0,0 +1,108 @@
+import numpy as np
+
+from hardness_calculator.engine import CONFIDENCE_HIGH, CONFIDENCE_LOW, CONFIDENCE_NONE
+from hardness_calculator.writer import MAX_RETRY_CALLS, BatchWriter
+
+HARDNESS_IDX = 5
+CONFIDENCE_IDX = 6
+
+
+class FakeProvider:
+    """Data provider that rejects every changeAttributeValues call touching a bad fid"""
+
+    def __init__(self, bad=()):
+        self.bad = set(bad)
+        self.calls = []
+        self.values = {}
+
+    def changeAttributeValues(self, changes):
+        self.calls.append(len(changes))
+        if self.bad & changes.keys():
+            return False
+        self.values.update(changes)
+        return True
+
+
+def rows(n):
+    fids = np.arange(n, dtype=np.int64)
+    hardness = np.linspace(0.0, 1.0, n)
+    confidence = np.full(n, CONFIDENCE_HIGH, dtype=np.int8)
+    return fids, hardness, confidence
+
+
+def test_write_in_batches():
+    provider = FakeProvider()
+    writer = BatchWriter(provider, HARDNESS_IDX, CONFIDENCE_IDX, 100)
+    fids, hardness, confidence = rows(1050)
+    hardness[3] = np.nan
+    confidence[4] = CONFIDENCE_LOW
+
+    assert writer.write(fids, hardness, confidence)
+    assert provider.calls == [100] * 10 + [50]
+    assert writer.batches == 11 and writer.written == 1050 and writer.success
+    assert provider.values[3] == {HARDNESS_IDX: None, CONFIDENCE_IDX: "High"}
+    assert provider.values[4][CONFIDENCE_IDX] == "Low"
+    assert provider.values[10][HARDNESS_IDX] == hardness[10]
+
+
+def test_coded_confidence_writes_null_when_not_computed():
+    provider = FakeProvider()
+    writer = BatchWriter(provider, HARDNESS_IDX, CONFIDENCE_IDX, 100, coded_confidence=True)
+    fids, hardness, confidence = rows(3)
+    confidence[:] = [CONFIDENCE_HIGH, CONFIDENCE_LOW, CONFIDENCE_NONE]
+    writer.write(fids, hardness, confidence)
+    assert [provider.values[fid][CONFIDENCE_IDX] for fid in range(3)] == [CONFIDENCE_HIGH, CONFIDENCE_LOW, None]
+
+
+def test_retry_halves_failed_batches_down_to_the_bad_features():
+    provider = FakeProvider(bad={7, 123})
+    writer = BatchWriter(provider, HARDNESS_IDX, CONFIDENCE_IDX, 50)
+    fids, hardness, confidence = rows(1000)
+
+    assert writer.write(fids, hardness, confidence)
+    assert [batch.number for batch in writer.failed] == [1, 3]
+    assert writer.written == 900 and not writer.success
+
+    calls_before = len(provider.calls)
+    assert writer.retry() == 98
+    assert writer.unwritten_fids().tolist() == [7, 123]
+    assert writer.written == 998 and not writer.failed and not writer.success
+    assert set(provider.values) == set(range(1000)) - {7, 123}
+    # Halving a batch of 50 down to one bad feature takes about 2*log2(50) calls
+    assert len(provider.calls) - calls_before <= 2 * (2 * 6 + 1)
+
+
+def test_retry_recovers_transient_failures():
+    provider = FakeProvider(bad={42})
+    writer = BatchWriter(provider, HARDNESS_IDX, CONFIDENCE_IDX, 100)
+    writer.write(*rows(300))
+    provider.bad.clear()
+    assert writer.retry() == 100
+    assert writer.success and writer.written == 300
+    assert len(writer.unwritten_fids()) == 0
+
+
+def test_retry_stops_after_the_call_limit():
+    fids, hardness, confidence = rows(4 * MAX_RETRY_CALLS)
+    provider = FakeProvider(bad=fids.tolist())
+    writer = BatchWriter(provider, HARDNESS_IDX, CONFIDENCE_IDX, len(fids))
+    writer.write(fids, hardness, confidence)
+
+    calls_before = len(provider.calls)
+    assert writer.retry() == 0
+    assert len(provider.calls) - calls_before == MAX_RETRY_CALLS
+    np.testing.assert_array_equal(writer.unwritten_fids(), fids)
+
+
+def test_write_stops_when_canceled():
+    class Canceled:
+        def isCanceled(self):
+            return True
+
+        def setProgress(self, progress):
+            pass
+
+    provider = FakeProvider()
+    writer = BatchWriter(provider, HARDNESS_IDX, CONFIDENCE_IDX, 100)
+    assert not writer.write(*rows(300), feedback=Canceled())
+    assert provider.calls == []
@@ -0,0 +1,228 @@
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.stats import norm
+from .engine import CONFIDENCE_HIGH, CONFIDENCE_LOW, ratio_term
+
+# Rows are spread at random over this many blocks; resamples draw whole blocks
+VALIDATION_BLOCKS = 1024
+
+# Fixed seed, so repeated runs on the same data report the same intervals
+VALIDATION_SEED = 0
+
+# Resampled problems solved per worker task
+SOLVE_BATCH_SIZE = 4096
+
+# Fitted columns plus a constant column, so that block Gram matrices also carry counts and sums
+GRAM_WIDTH = 5
+
+
+class BlockGrams:
+    """Gram matrices of [E1, E1_E2_ratio, PeakSV, Depth, 1] per random block of rows.
+
+    Every row is assigned to one of blocks blocks at random and its outer
+    product is added to that block, so the statistics can be accumulated
+    chunk by chunk in one pass. A bootstrap resample is then a weighted sum
+    of block matrices, and a cross-validation fold a group of blocks, which
+    makes thousands of resamples cost a matrix product instead of a pass
+    over the data.
+    """
+
+    def __init__(self, blocks=VALIDATION_BLOCKS, seed=VALIDATION_SEED):
+        self.blocks = blocks
+        self.grams = np.zeros((blocks, GRAM_WIDTH, GRAM_WIDTH))
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def n(self):
+        return int(round(self.grams[:, -1, -1].sum()))
+
+    def update(self, values):
+        """Add the rows of an (n, 4) array of FIT_COLUMNS"""
+        if len(values) == 0:
+            return
+        rows = np.column_stack([values, np.ones(len(values))])
+        block = self._rng.integers(0, self.blocks, len(values))
+        for i, j in zip(*np.triu_indices(GRAM_WIDTH)):
+            sums = np.bincount(block, weights=rows[:, i] * rows[:, j], minlength=self.blocks)
+            self.grams[:, i, j] += sums
+            if i != j:
+                self.grams[:, j, i] += sums
+
+    def merge(self, other):
+        """Add the block matrices of another BlockGrams with the same number of blocks"""
+        self.grams += other.grams
+
+    def normalized(self, minimum, maximum):
+        """Block Gram matrices of the min-max normalized columns, as used by fit_from_moments()"""
+        value_range = maximum - minimum
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scale = np.where(value_range > 0, 1.0 / value_range, 0.0)
+        transform = np.eye(GRAM_WIDTH)
+        transform[np.arange(4), np.arange(4)] = scale
+        transform[4, :4] = -minimum * scale
+        return transform.T @ self.grams @ transform
+
+
+def batched_bounded_solve(grams, moments, bounds, workers=1):
+    """Minimize ||Xk - y||^2 within box bounds for a batch of problems.
+
+    grams is (B, p, p) X'X and moments is (B, p) X'y. The solution of a box
+    constrained least-squares problem lies on one of the 3^p active sets
+    (each coefficient free, at its lower or at its upper bound). Every set
+    is solved for all problems at once with batched linear algebra, and the
+    feasible candidate with the lowest objective is kept, which gives the
+    same minimizer as lsq_linear without a Python loop over the problems.
+    """
+    if len(grams) > SOLVE_BATCH_SIZE and workers > 1:
+        starts = range(0, len(grams), SOLVE_BATCH_SIZE)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            parts = executor.map(lambda start: batched_bounded_solve(
+                grams[start:start + SOLVE_BATCH_SIZE], moments[start:start + SOLVE_BATCH_SIZE], bounds), starts)
+            return np.concatenate(list(parts))
+
+    lower, upper = (np.asarray(bound, dtype=float) for bound in bounds)
+    count, width = moments.shape
+    tolerance = 1e-9 * np.maximum(1.0, np.abs(upper - lower))
+    best = np.tile(lower, (count, 1))
+    best_objective = np.full(count, np.inf)
+    for states in itertools.product((0, 1, 2), repeat=width):
+        states = np.array(states)
+        free = states == 0
+        k = np.tile(np.where(states == 1, lower, upper), (count, 1))
+        feasible = np.ones(count, dtype=bool)
+        if free.any():
+            rhs = moments[:, free] - np.einsum("bij,bj->bi", grams[:, free][:, :, ~free], k[:, ~free])
+            k[:, free] = np.einsum("bij,bj->bi", np.linalg.pinv(grams[:, free][:, :, free]), rhs)
+            feasible = ((k[:, free] >= lower[free] - tolerance[free]) & (k[:, free] <= upper[free] + tolerance[free])).all(axis=1)
+        objective = np.einsum("bi,bij,bj->b", k, grams, k) - 2 * np.einsum("bi,bi->b", k, moments)
+        better = feasible & (objective < best_objective)
+        best[better] = k[better]
+        best_objective[better] = objective[better]
+    return np.clip(best, lower, upper)
+
+
+def _errors(grams, coefficients):
+    """(SSE, SST) of depth for coefficients on the matching (B, 5, 5) normalized Gram matrices"""
+    xx = grams[:, :3, :3]
+    xy = grams[:, :3, 3]
+    sse = np.einsum("bi,bij,bj->b", coefficients, xx, coefficients) - 2 * np.einsum("bi,bi->b", coefficients, xy) + grams[:, 3, 3]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sst = grams[:, 3, 3] - grams[:, 3, 4] ** 2 / grams[:, 4, 4]
+    return np.maximum(sse, 0.0), sst
+
+
+@dataclass
+class ValidationResult:
+    """Bootstrap intervals of (k1, k2, k3) and cross-validated R² of a fit"""
+    level: float
+    lower: tuple
+    upper: tuple
+    std: tuple
+    covariance: list
+    r2: float
+    cv_r2: float
+    fold_r2: tuple
+    resamples: int
+    folds: int
+    blocks: int
+    seconds: float
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def describe(self, coefficients):
+        """One-line summary for the dialog: coefficients with their intervals and the CV R²"""
+        parts = [f"k{index + 1}: {k:.4f} [{low:.4f}, {high:.4f}]"
+                 for index, (k, low, high) in enumerate(zip(coefficients, self.lower, self.upper))]
+        return ", ".join(parts) + f", CV R²: {self.cv_r2:.3f}"
+
+
+def validate_fit(block_grams, moments, params, workers=0):
+    """Bootstrap and k-fold validation of the bounded fit from BlockGrams of the outlier-filtered rows.
+
+    moments are the Moments of the same rows; their min/max define the
+    normalization, as in fit_from_moments(). Resamples draw the blocks with
+    replacement; fold f holds the blocks b with b % folds == f.
+    """
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    grams = block_grams.normalized(moments.min, moments.max)
+    total = grams.sum(axis=0)
+    point = batched_bounded_solve(total[None, :3, :3], total[None, :3, 3], params.bounds)
+    sse, sst = _errors(total[None], point)
+    r2 = float(1 - sse[0] / sst[0])
+
+    # Bootstrap: each resample is a multinomial reweighting of the blocks
+    rng = np.random.default_rng(VALIDATION_SEED + 1)
+    weights = rng.multinomial(block_grams.blocks, np.full(block_grams.blocks, 1.0 / block_grams.blocks),
+                              size=params.bootstrap_samples)
+    resampled = (weights @ grams.reshape(block_grams.blocks, -1)).reshape(-1, GRAM_WIDTH, GRAM_WIDTH)
+    bootstrap = batched_bounded_solve(resampled[:, :3, :3], resampled[:, :3, 3], params.bounds, workers)
+
+    # K-fold: fit on all other folds, score on the held-out one
+    fold_of_block = np.arange(block_grams.blocks) % params.folds
+    fold_grams = np.stack([grams[fold_of_block == fold].sum(axis=0) for fold in range(params.folds)])
+    trained = batched_bounded_solve(total[:3, :3] - fold_grams[:, :3, :3], total[:3, 3] - fold_grams[:, :3, 3], params.bounds)
+    fold_sse, fold_sst = _errors(fold_grams, trained)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fold_r2 = 1 - fold_sse / fold_sst
+
+    tail = (1 - params.interval_level) / 2
+    return ValidationResult(
+        params.interval_level,
+        tuple(float(k) for k in np.quantile(bootstrap, tail, axis=0)),
+        tuple(float(k) for k in np.quantile(bootstrap, 1 - tail, axis=0)),
+        tuple(float(k) for k in bootstrap.std(axis=0, ddof=1)),
+        np.cov(bootstrap, rowvar=False).tolist(),
+        r2,
+        float(1 - fold_sse.sum() / fold_sst.sum()),
+        tuple(float(value) for value in fold_r2),
+        params.bootstrap_samples,
+        params.folds,
+        block_grams.blocks,
+        time.perf_counter() - start,
+    )
+
+
+def interval_confidence(columns, hardness, confidence, validation, linearize, max_relative_interval):
+    """Downgrade High confidence to Low where the bootstrap interval of hardness is too wide.
+
+    The interval half-width of each row follows from the bootstrap
+    covariance of (k1, k2, k3) and the row's (E1, f(E1,E2), PeakSV), with a
+    normal approximation at the validation level. Returns the number of rows
+    downgraded; confidence is changed in place.
+    """
+    high = np.flatnonzero(confidence == CONFIDENCE_HIGH)
+    terms = np.column_stack([
+        columns.e1[high],
+        ratio_term(columns.e1[high], columns.e2[high], linearize),
+        columns.peak_sv[high],
+    ])
+    variance = np.einsum("bi,ij,bj->b", terms, np.asarray(validation.covariance), terms)
+    half_width = norm.ppf(0.5 + validation.level / 2) * np.sqrt(np.maximum(variance, 0.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        wide = ~(half_width <= max_relative_interval * np.abs(hardness[high]))
+    confidence[high[wide]] = CONFIDENCE_LOW
+    return int(np.count_nonzero(wide))
+
+
+def log_validation(log, fit):
+    """Bootstrap intervals and cross-validation scores of a fit"""
+    validation = fit.validation
+    log.summary(f"\nBootstrap validation ({validation.resamples} resamples of {validation.blocks} random blocks, "
+                f"{validation.level * 100:g}% intervals):")
+    for index, (k, low, high, std) in enumerate(zip(fit.coefficients, validation.lower, validation.upper, validation.std)):
+        log.summary(f"  k{index + 1}: {k:.4f} [{low:.4f}, {high:.4f}] (sd {std:.4f})")
+    log.summary(f"In-sample R²: {validation.r2:.4f}")
+    log.summary(f"{validation.folds}-fold cross-validated R²: {validation.cv_r2:.4f}")
+    log.phase("  Per fold: " + ", ".join(f"{value:.4f}" for value in validation.fold_r2))
+    log.phase(f"Validation time: {validation.seconds:.3f} s")
@@ -0,0 +1,111 @@
+from dataclasses import dataclass
+
+import numpy as np
+from .engine import CONFIDENCE_NONE, confidence_labels
+
+# Provider calls a retry may spend splitting failed batches before giving up on the rest
+MAX_RETRY_CALLS = 256
+
+
+def confidence_values(confidence, coded):
+    """Attribute values for confidence codes: integer codes (NULL when not computed) or "High"/"Low" labels"""
+    if coded:
+        values = confidence.astype(object)
+        values[confidence == CONFIDENCE_NONE] = None
+        return values
+    return confidence_labels(confidence)
+
+
+@dataclass
+class FailedBatch:
+    """Rows of a batch the provider rejected, kept for a retry"""
+    number: int
+    fids: np.ndarray
+    hardness: np.ndarray
+    confidence: np.ndarray
+
+    def describe(self):
+        return f"batch {self.number}: {len(self.fids)} features, fids {self.fids.min()}-{self.fids.max()}"
+
+
+class BatchWriter:
+    """Write Hardness/Confidence values through a data provider in bounded batches.
+
+    Each batch builds its change map, sends it in one changeAttributeValues
+    call and drops it, so memory depends on batch_size rather than on the
+    layer size. Batches the provider rejects are kept; retry() sends them
+    again, halving any batch that fails again to isolate the features that
+    cannot be written.
+    """
+
+    def __init__(self, provider, hardness_idx, confidence_idx, batch_size, coded_confidence=False):
+        self.provider = provider
+        self.hardness_idx = hardness_idx
+        self.confidence_idx = confidence_idx
+        self.batch_size = batch_size
+        self.coded_confidence = coded_confidence
+        self.batches = 0
+        self.written = 0
+        self.failed = []
+        self.unwritten = []
+
+    def send(self, fids, hardness, confidence):
+        """One changeAttributeValues call for the given rows (NaN -> NULL); returns the provider's success flag"""
+        hardness_idx = self.hardness_idx
+        confidence_idx = self.confidence_idx
+        changes = {
+            feature_id: {hardness_idx: None if value != value else value, confidence_idx: code}
+            for feature_id, value, code in zip(
+                fids.tolist(), hardness.tolist(), confidence_values(confidence, self.coded_confidence).tolist())
+        }
+        return self.provider.changeAttributeValues(changes)
+
+    def write(self, fids, hardness, confidence, feedback=None):
+        """Write rows batch by batch; returns False if canceled through feedback before the last batch"""
+        total = len(fids)
+        for start in range(0, total, self.batch_size):
+            if feedback is not None and feedback.isCanceled():
+                return False
+            stop = min(start + self.batch_size, total)
+            self.batches += 1
+            if self.send(fids[start:stop], hardness[start:stop], confidence[start:stop]):
+                self.written += stop - start
+            else:
+                self.failed.append(FailedBatch(
+                    self.batches, fids[start:stop].copy(), hardness[start:stop].copy(), confidence[start:stop].copy()))
+            if feedback is not None:
+                feedback.setProgress(stop / total * 100)
+        return True
+
+    def retry(self):
+        """Send the failed batches again; returns the number of features recovered"""
+        pending = [(batch.fids, batch.hardness, batch.confidence) for batch in self.failed]
+        self.failed = []
+        recovered = 0
+        calls = 0
+        while pending:
+            fids, hardness, confidence = pending.pop()
+            if calls >= MAX_RETRY_CALLS:
+                self.unwritten.append(fids)
+                continue
+            calls += 1
+            if self.send(fids, hardness, confidence):
+                self.written += len(fids)
+                recovered += len(fids)
+            elif len(fids) == 1:
+                self.unwritten.append(fids)
+            else:
+                middle = len(fids) // 2
+                pending.append((fids[middle:], hardness[middle:], confidence[middle:]))
+                pending.append((fids[:middle], hardness[:middle], confidence[:middle]))
+        return recovered
+
+    def unwritten_fids(self):
+        """Sorted ids of the features that could not be written, even on retry"""
+        if not self.unwritten:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(self.unwritten))
+
+    @property
+    def success(self):
+        return not self.failed and not self.unwritten